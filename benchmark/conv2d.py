@@ -0,0 +1,51 @@
+#################################################################
+###       NOTE: this needs to be run with PYTHONPATH='.'      ###
+#################################################################
+
+import time
+import numpy as np
+from tensorbro import Tensor
+from tensorbro.linearizer import linearize
+
+# (batch, in channels, height/width, out channels, kernel size, stride, padding)
+configs = [
+    (1, 3, 224, 64, 7, 2, 3),
+    (1, 64, 56, 64, 3, 1, 1),
+    (1, 128, 28, 128, 3, 1, 1),
+    (8, 256, 14, 256, 3, 1, 1),
+    (1, 64, 56, 256, 1, 1, 0),
+    (16, 1, 28, 3, 3, 1, 1),
+]
+
+
+def np_conv2d(x, w, stride, padding):
+    # im2col with strides, tensordot copies the windows into a matrix
+    xp = np.pad(x, ((0, 0), (0, 0), (padding, padding), (padding, padding)))
+    windows = np.lib.stride_tricks.sliding_window_view(xp, w.shape[2:], axis=(2, 3))[:, :, ::stride, ::stride]
+    return np.tensordot(w, windows, axes=((1, 2, 3), (1, 4, 5))).transpose(1, 0, 2, 3)
+
+
+def best_of(fn, runs=3):
+    best = float('inf')
+    for _ in range(runs):
+        st = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - st)
+    return best
+
+
+print(f"{'config':>28}{'tensorbro GFLOPS':>18}{'numpy GFLOPS':>14}{'max err':>10}")
+for n, c, hw, o, k, stride, padding in configs:
+    x_np = np.random.rand(n, c, hw, hw).astype(np.float32)
+    w_np = np.random.rand(o, c, k, k).astype(np.float32)
+    res = Tensor.from_numpy(x_np).conv2d(Tensor.from_numpy(w_np), stride=stride, padding=padding)
+    prg = linearize(res.data.schedule())
+    prg()
+
+    best = best_of(prg)
+    np_best = best_of(lambda: np_conv2d(x_np, w_np, stride, padding))
+
+    err = np.abs(res.numpy() - np_conv2d(x_np, w_np, stride, padding)).max()
+    flops = 2 * res.data.size * c * k * k
+    config = f'{n}x{c}x{hw}x{hw} {o}x{k}x{k}/{stride}'
+    print(f"{config:>28}{flops / best * 1e-9:>18.2f}{flops / np_best * 1e-9:>14.2f}{err:>10.2e}")
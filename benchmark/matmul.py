@@ -0,0 +1,37 @@
+#################################################################
+###       NOTE: this needs to be run with PYTHONPATH='.'      ###
+#################################################################
+
+import sys
+import time
+import numpy as np
+from tensorbro import LazyBuffer
+from tensorbro.linearizer import linearize
+
+sizes = [int(s) for s in sys.argv[1:]] or [512, 1024, 2048]
+
+print(f"{'size':>6}{'tensorbro GFLOPS':>18}{'numpy GFLOPS':>14}{'max err':>10}")
+for n in sizes:
+    a = LazyBuffer.rand((n, n), 'CPU', seed=1)
+    b = LazyBuffer.rand((n, n), 'CPU', seed=2)
+    linearize(a.schedule() + b.schedule())()
+    res = a.matmul(b)
+    prg = linearize(res.schedule())
+
+    best = float('inf')
+    for _ in range(3):
+        st = time.perf_counter()
+        prg()
+        best = min(best, time.perf_counter() - st)
+
+    np_a = np.frombuffer(a.base, np.float32).reshape(n, n)
+    np_b = np.frombuffer(b.base, np.float32).reshape(n, n)
+    np_best = float('inf')
+    for _ in range(3):
+        st = time.perf_counter()
+        np_res = np_a @ np_b
+        np_best = min(np_best, time.perf_counter() - st)
+
+    err = np.abs(np.frombuffer(res.base, np.float32).reshape(n, n) - np_res).max()
+    flops = 2 * n ** 3
+    print(f"{n:>6}{flops / best * 1e-9:>18.2f}{flops / np_best * 1e-9:>14.2f}{err:>10.2e}")
@@ -0,0 +1,45 @@
+#################################################################
+###       NOTE: this needs to be run with PYTHONPATH='.'      ###
+#################################################################
+
+import time
+from tensorbro import LazyBuffer
+
+
+def tree_size(lb):
+    # number of kernels a scheduler without memoization would emit
+    size = {}
+    for buf in lb._toposort(set()):
+        size[buf] = 1 + sum(size[src] for src in buf.op.srcs)
+    return size[lb]
+
+
+def diamond(depth):
+    # every level uses the previous one twice: x_{i+1} = x_i * x_i + x_i
+    x = LazyBuffer.rand((64, 64), 'CPU', seed=1)
+    for _ in range(depth):
+        x = (x * x) + x
+    return x
+
+
+def shared_chain(depth):
+    # a running sum that every level adds a shared product into
+    a = LazyBuffer.rand((64, 64), 'CPU', seed=1)
+    b = LazyBuffer.rand((64, 64), 'CPU', seed=2)
+    shared = a * b
+    x = shared
+    for _ in range(depth):
+        x = (x + shared) - a
+    return x
+
+
+print(f"{'graph':<14}{'depth':>7}{'tree kernels':>16}{'kernels':>10}{'schedule ms':>14}")
+for name, build in [('diamond', diamond), ('shared chain', shared_chain)]:
+    for depth in [10, 100, 1000]:
+        out = build(depth)
+        st = time.perf_counter()
+        schedule = out.schedule()
+        et = time.perf_counter()
+        naive = tree_size(out)
+        naive_str = str(naive) if naive < 10**6 else f'~1e{len(str(naive)) - 1}'
+        print(f"{name:<14}{depth:>7}{naive_str:>16}{len(schedule):>10}{(et - st) * 1e3:>14.2f}")
@@ -16,11 +16,16 @@ res = (t1 @ t2) * t3
 # materialize result because by default we are lazy
 res.materialize()
 
-# copy data from clang buffer over into numpy arrays
-np_res = np.frombuffer(res.data.base, np.float32).reshape(*res.data.shape)
-np_t1 = np.frombuffer(t1.data.base, np.float32).reshape(*t1.data.shape)
-np_t2 = np.frombuffer(t2.data.base, np.float32).reshape(*t2.data.shape)
-np_t3 = np.frombuffer(t3.data.base, np.float32).reshape(*t3.data.shape)
+# view the clang buffers as numpy arrays, nothing is copied
+np_res = res.numpy()
+np_t1 = t1.numpy()
+np_t2 = t2.numpy()
+np_t3 = t3.numpy()
+
+# numpy arrays can be used as inputs without a copy as well
+t4 = Tensor.from_numpy(np_t1 + 1)
+if not np.allclose((t4 * t2).numpy(), (np_t1 + 1) * np_t2, rtol=1e-5):
+    print("There is an error :(")
 
 # check if result is correct
 if np.allclose(np_res, (np_t1 @ np_t2) * np_t3, rtol=1e-5):
@@ -1,2 +1,4 @@
 from .lazy import LazyBuffer
-from .tensor import Tensor
+from .tensor import Tensor, no_grad
+from .jit import Jit
+from .dtypes import dtypes
@@ -1,67 +1,109 @@
 import ctypes as c
-import subprocess
+import itertools
 import math
 
 from cgen import (
     FunctionBody,
     FunctionDeclaration,
-    POD,
     Value,
     Pointer,
+    RestrictPointer,
     Module,
     Block,
     Assign,
     For,
     Statement,
+    If,
     Include,
+    Pragma,
 )
-from pathlib import Path
-from typing import List, Tuple, Any, Type
+from typing import Dict, List, Optional, Tuple, Any, Type, TYPE_CHECKING
 
-from ..ops import BinaryOps, LoadOps, OpType, UnaryOps, ReduceOps, MovementOps
+from ..ops import BinaryOps, LoadOps, MovementOps, OpType, UnaryOps, ReduceOps, ElementwiseOps, LazyOp
+from ..runners.clang import KernelCache
+from ..device import Device
+from ..dtypes import DType, dtypes
+from ..shapetracker import ShapeTracker, unravel
 
-ALWAYS_RECOMPILE = True
+if TYPE_CHECKING:
+    from ..lazy import LazyBuffer
+    from ..linearizer import ScheduleItem
+    from ..planner import MemoryPlan
 
 CHARACTERS = list(map(chr, range(97, 123)))
 
-def permute_shape(shape, dim):
-    return tuple(map(lambda i: shape[i], dim))
+# kernels doing less work than this stay single threaded, starting the threads costs more
+PARALLEL_THRESHOLD = 1 << 15
 
 bops_to_cstyle = {
     BinaryOps.MUL: '*',
     BinaryOps.ADD: '+',
     BinaryOps.SUB: '-',
     BinaryOps.DIV: '/',
+    BinaryOps.CMPEQ: '==',
 }
 
-uops_to_cstyle = {
-    UnaryOps.NEG: lambda name: f"-{name}",
-    UnaryOps.SIN: lambda name: f"sinf({name})",
-    UnaryOps.SQRT: lambda name: f"sqrtf({name})",
-    UnaryOps.EXP2: lambda name: f"exp2f({name})",
-    UnaryOps.LOG2: lambda name: f"log2f({name})",
-}
+def cmath(name: str, dtype: DType) -> str:
+    # math.h function for dtype, everything below double uses the float version
+    return name if dtype == dtypes.float64 else f'{name}f'
 
+def cmax(a: str, b: str, dtype: DType) -> str:
+    return f'{cmath("fmax", dtype)}({a}, {b})' if dtype.is_float else f'({a} > {b} ? {a} : {b})'
 
-def ctype2str(t):
-    return t.__name__[2:]
+reduce_init = {
+    ReduceOps.SUM: lambda dtype: '0',
+    ReduceOps.MAX: lambda dtype: '-INFINITY' if dtype.is_float else 'INT_MIN',
+}
 
-def gen_indices_strided(shape, stride, chars=None):
-    if chars is None:
-        chars = CHARACTERS
-    idx_calc = ""
-    for i in range(len(shape)):
-        if stride[i] != 1:
-            continue
-        idx_calc += f"{chars[i]}"
-        for j, s in enumerate(shape[i+1:]):
-            if stride[i+1+j] != 1:
-                continue
-            idx_calc += f" * {s}"
-        idx_calc += " + "
-    idx_calc = idx_calc[:-3]
+reduce_to_cstyle = {
+    ReduceOps.SUM: lambda acc, x, dtype: f"{acc} + {x}",
+    ReduceOps.MAX: lambda acc, x, dtype: cmax(acc, x, dtype),
+}
+
+uops_to_cstyle = {
+    UnaryOps.NEG: lambda name, dtype: f"-{name}",
+    UnaryOps.SIN: lambda name, dtype: f"{cmath('sin', dtype)}({name})",
+    UnaryOps.SQRT: lambda name, dtype: f"{cmath('sqrt', dtype)}({name})",
+    UnaryOps.EXP2: lambda name, dtype: f"{cmath('exp2', dtype)}({name})",
+    UnaryOps.LOG2: lambda name, dtype: f"{cmath('log2', dtype)}({name})",
+    UnaryOps.NOOP: lambda name, dtype: name,
+}
 
-    return idx_calc
+def ast_ops(ast: LazyOp) -> List[OpType]:
+    return [op for src in ast.srcs if isinstance(src, LazyOp) for op in ast_ops(src)] + [ast.op]
+
+def ast_shape(node) -> Tuple[int, ...]:
+    # shape of the input of a reduction, inlined constants carry their shape in their arg
+    if not isinstance(node, LazyOp):
+        return node.shape
+    if node.op is LoadOps.CONST:
+        return node.arg[2]
+    if node.op is MovementOps.EXPAND:
+        return node.arg[0]
+    return ast_shape(node.srcs[0])
+
+def ast_dtype(node) -> DType:
+    # dtype of the value a tree computes, the same rules as in render_ast
+    if not isinstance(node, LazyOp):
+        return node.dtype
+    if node.op is LoadOps.CONST:
+        return node.arg[1]
+    if node.op is UnaryOps.CAST:
+        return node.arg
+    return ast_dtype(node.srcs[0])
+
+def c_literal(value, dtype: DType) -> str:
+    if not dtype.is_float:
+        return str(int(value))
+    if math.isinf(value):
+        return '-INFINITY' if value < 0 else 'INFINITY'
+    if math.isnan(value):
+        return 'NAN'
+    return f'({dtype.c}){float(value)!r}'
+
+def gen_indices(shape: Tuple[int, ...], chars=None) -> str:
+    # row major offset of the element at chars
+    return ShapeTracker.from_shape(shape).expr(CHARACTERS[:len(shape)] if chars is None else chars)[0]
 
 def gen_n_for_loops(shape: Tuple[int, ...], body: str):
     char = CHARACTERS[len(shape) - 1]
@@ -80,200 +122,438 @@ def gen_n_for_loops(shape: Tuple[int, ...], body: str):
         )
     return loops
 
-def c_movement(function_name: str, shape: Tuple[int, ...], stride: Tuple[int, ...] = (), permute_dim: Tuple[int, ...] = (), dtype=c.c_float) -> Module:
-    new_shape = permute_shape(shape, permute_dim)
-    new_chars = permute_shape(CHARACTERS, permute_dim)
-    idx = Assign("int idx", gen_indices_strided(shape, stride))
-    new_idx = Assign("int newIdx", gen_indices_strided(new_shape, tuple([1 for _ in shape]), new_chars))
-    assignment = Assign("out[newIdx]", "inp1[idx]")
-    body = Block([idx, new_idx, assignment])
-    body = gen_n_for_loops(shape, body)
-    code = Module(
-        [
-            Include("math.h"),
-            FunctionBody(
-                FunctionDeclaration(
-                    Value('void', function_name),
-                    arg_decls=[Pointer(POD(dtype, name)) for name in ['out', "inp1"]],
-                ),
-                Block(
-                    [
-                        body
-                    ]
-                ),
-            )
-        ]
-    )
-    return code
-
-def gen_accumulating_loops(shape: Tuple[int, ...], reduce_dim: int, body):
-    char = CHARACTERS[len(shape) - 1]
-    loops = For(
-        f'int {char} = 0',
-        f'{char}<{shape[-1]}',
-        f'{char}++',
-        body
-    )
-    for i, dim in enumerate(reversed(shape[:-1])):
-        char = CHARACTERS[len(shape) - 2 - i]
-        loops = For(f'int {char} = 0',
-            f'{char}<{shape[len(shape) - 2 - i]}',
-            f'{char}++',
-            Block([loops])
-        )
-    return loops
-
-def gen_index_accumulating(shape, stride, acc_dim):
-    idx_calc = ""
-    for i in range(len(shape)):
-        if i == acc_dim:
-            continue
-        idx_calc += f"{CHARACTERS[i]}"
-        for j in range(i+1,len(shape)):
-            idx_calc += f" * {shape[j]}" if j != acc_dim else ""
-        idx_calc += " + "
-    idx_calc = idx_calc[:-3]
-    return idx_calc
-
-def gen_index_from_shape(shape, stride):
-    idx_calc = ""
-    for i in range(len(shape)):
-        if stride[i] != 1:
-            continue
-        idx_calc += f"{CHARACTERS[i]}"
-        for j in range(i+1,len(shape)):
-            idx_calc += f" * {shape[j]}" if stride[j] == 1 else ""
-        idx_calc += " + "
-    idx_calc = idx_calc[:-3]
-    return idx_calc
-    
-def c_reduce(function_name: str, op: ReduceOps, shape: Tuple[int, ...], stride: Tuple[int, ...], dtype=c.c_float, arg=0) -> Module:
-    accIdx = Assign("int accIdx", gen_index_accumulating(shape, stride, arg))
-    idx = Assign("int idx", gen_index_from_shape(shape, stride))
-    if op is ReduceOps.SUM:
-        acc_op = Assign("out[accIdx]", "out[accIdx] + inp1[idx]") 
-    elif op is ReduceOps.MAX: 
-        acc_op = Assign("out[accIdx]", "(out[accIdx] > inp1[idx]) ? out[accIdx] : inp1[idx]") 
-    else:
-        raise NotImplementedError(f"op: {op} not implemented for clang reduce")
-
-    body = Block([idx, accIdx, acc_op])
-    body = gen_accumulating_loops(shape, arg, body)
-
-    code = Module(
-        [
-            Include("math.h"),
-            FunctionBody(
-                FunctionDeclaration(
-                    Value('void', function_name),
-                    arg_decls=[Pointer(POD(dtype, name)) for name in ['out', "inp1"]],
-                ),
-                Block(
-                    [
-                        body
-                    ]
-                ),
-            )
-        ]
-    )
-    return code
-
-
-
-def c_unary(function_name: str, op: UnaryOps, shape: Tuple[int, ...], dtype=c.c_float) -> Module:
-    assignment = Assign("out[i]", uops_to_cstyle[op]('inp1[i]'))
-    code = Module(
+def omp_parallel(shape: Tuple[int, ...], work: Optional[int] = None) -> List[Pragma]:
+    """
+    OpenMP pragma for a loop nest over shape, empty if the kernel should run single threaded.
+    Enough of the outer loops are collapsed to give every thread a few iterations.
+    """
+    threads = Device.THREADS()
+    work = math.prod(shape) if work is None else work
+    if threads <= 1 or len(shape) == 0 or work < PARALLEL_THRESHOLD:
+        return []
+    collapse = 1
+    while collapse < len(shape) and math.prod(shape[:collapse]) < 4 * threads:
+        collapse += 1
+    clause = f' collapse({collapse})' if collapse > 1 else ''
+    return [Pragma(f'omp parallel for{clause} num_threads({threads})')]
+
+def reduce_chars(chars: Tuple[str, ...], dims: Tuple[int, ...], names: Tuple[str, ...]) -> Tuple[str, ...]:
+    # index of the input of a reduction, the loop variables in names go to the reduced dims
+    out, red = iter(chars), iter(names)
+    return tuple(next(red) if d in dims else next(out) for d in range(len(chars) + len(dims)))
+
+def online_softmax(node: LazyOp) -> Optional[Tuple[Any, LazyOp, float]]:
+    """
+    (x, broadcast max, scale) if node is sum(exp2((x - max(x)) * scale)) over the last dim,
+    the sum softmax normalizes by. The max and the sum are then computed in one loop,
+    the sum is rescaled whenever the running max grows.
+    """
+    e = node.srcs[0]
+    if node.op is not ReduceOps.SUM or not isinstance(e, LazyOp) or e.op is not UnaryOps.EXP2:
+        return None
+    mul = e.srcs[0]
+    if not isinstance(mul, LazyOp) or mul.op is not BinaryOps.MUL:
+        return None
+    sub, scale = mul.srcs
+    if not isinstance(sub, LazyOp) or sub.op is not BinaryOps.SUB or not isinstance(scale, LazyOp) \
+            or scale.op is not LoadOps.CONST or not scale.arg[0] > 0:
+        return None
+    x, bmax = sub.srcs
+    if not isinstance(bmax, LazyOp) or bmax.op is not MovementOps.EXPAND:
+        return None
+    mx = bmax.srcs[0]
+    if mx.op is not ReduceOps.MAX or mx.arg != node.arg or mx.srcs[0] != x:
+        return None
+    return x, bmax, scale.arg[0]
+
+def render_ast(ast: LazyOp, srcs: Tuple[Any, ...], chars: Tuple[str, ...], flat: bool = False,
+               accs: Optional[Dict[int, Tuple[str, DType]]] = None,
+               row_chars: Tuple[str, ...] = (), row_stmts: Optional[List[Any]] = None) -> Tuple[List[Any], str]:
+    """
+    Renders a tree of elementwise and reduce ops into a list of statements, every
+    intermediate is kept in a local variable instead of a buffer.
+    Leaves of the tree are the buffers in srcs, read through their ShapeTracker in the
+    index space given by chars, or at the flat index i if all of them are contiguous.
+    Constants are leaves as well, they are written out as literals.
+    Reductions get their own accumulator and a loop per reduced dimension, unless
+    accs already holds the value for them (by id of the node).
+    Per row values broadcast along the last dim (EXPAND with (shape, shape of the value),
+    see LazyBuffer._row_region) are rendered once into row_stmts, in the index space row_chars.
+    Every value has the dtype of the first operand of its op, CAST converts explicitly.
+    """
+    src_ids = [id(src) for src in srcs]
+    names = itertools.count()
+    accs = {} if accs is None else accs
+    rows: Dict[LazyOp, Tuple[str, DType]] = {}
+
+    def _render(node, chars: Tuple[str, ...], stmts: List[Any]) -> Tuple[str, DType]:
+        if not isinstance(node, LazyOp):
+            i = src_ids.index(id(node))
+            if flat:
+                return f'inp{i+1}[i]', srcs[i].dtype
+            idx, valid = srcs[i].st.expr(chars)
+            read = f'inp{i+1}[{idx}]' if valid is None else f'({valid} ? inp{i+1}[{idx}] : 0)'
+            return read, srcs[i].dtype
+        if id(node) in accs:
+            return accs[id(node)]
+        if node.op is LoadOps.CONST:
+            value, dtype, _ = node.arg
+            return c_literal(value, dtype), dtype
+        if node.op is MovementOps.EXPAND:
+            assert row_stmts is not None, 'per row values need row_stmts to be rendered into'
+            if node not in rows:
+                # the value may have kept the reduced dim, it has size 1
+                _, shape = node.arg
+                rows[node] = _render(node.srcs[0], (*row_chars, *['0'] * (len(shape) - len(row_chars))), row_stmts)
+            return rows[node]
+        if node.op in ReduceOps:
+            dims, k = node.arg, next(names)
+            shape = ast_shape(node.srcs[0])
+            acc, rs, inner = f'acc{k}', tuple(f'r{k}_{j}' for j in range(len(dims))), []
+            online = online_softmax(node) if row_stmts is not None else None
+            if online is not None and online[1] not in rows and ast_dtype(online[0]).is_float:
+                x, bmax, scale = online
+                val, dtype = _render(x, reduce_chars(chars, dims, rs), inner)
+                m, v, exp2 = f'{acc}_max', f'v{k}', cmath('exp2', dtype)
+                loop: Any = Block([*inner, Assign(f'{dtype.acc} {v}', val),
+                                   If(f'{v} > {m}', Block([Assign(acc, f'{acc} * {exp2}(({m} - {v}) * {c_literal(scale, dtype)})'), Assign(m, v)])),
+                                   Assign(acc, f'{acc} + {exp2}(({v} - {m}) * {c_literal(scale, dtype)})')])
+                for r, dim in reversed(list(zip(rs, dims))):
+                    loop = For(f'int {r} = 0', f'{r}<{shape[dim]}', f'{r}++', loop)
+                stmts.extend([Assign(f'{dtype.acc} {m}', '-INFINITY'), Assign(f'{dtype.acc} {acc}', '0'), loop])
+                rows[bmax] = (m, dtype)
+                return acc, dtype
+            val, dtype = _render(node.srcs[0], reduce_chars(chars, dims, rs), inner)
+            loop = Block([*inner, Assign(acc, reduce_to_cstyle[node.op](acc, val, dtype))])
+            for r, dim in reversed(list(zip(rs, dims))):
+                loop = For(f'int {r} = 0', f'{r}<{shape[dim]}', f'{r}++', loop)
+            stmts.extend([Assign(f'{dtype.acc} {acc}', reduce_init[node.op](dtype)), loop])
+            return acc, dtype
+        operands = [_render(src, chars, stmts) for src in node.srcs]
+        (x, dtype) = operands[0]
+        if node.op is UnaryOps.CAST:
+            dtype = node.arg
+            expr = f'({dtype.c}){x}'
+        elif node.op in UnaryOps:
+            expr = uops_to_cstyle[node.op](x, dtype)
+        elif node.op is BinaryOps.MAX:
+            expr = cmax(x, operands[1][0], dtype)
+        else:
+            expr = f'{x} {bops_to_cstyle[node.op]} {operands[1][0]}'
+        name = f't{next(names)}'
+        stmts.append(Assign(f'{dtype.c} {name}', expr))
+        return name, dtype
+
+    stmts: List[Any] = []
+    if row_stmts is not None:
+        # the online sum computes the max as well, it has to come before anything else reads the max
+        for node in ast_nodes(ast):
+            if node.op is MovementOps.EXPAND and isinstance(node.srcs[0], LazyOp) and online_softmax(node.srcs[0]) is not None:
+                _render(node, chars, stmts)
+    return stmts, _render(ast, chars, stmts)[0]
+
+
+def c_kernel(function_name: str, arg_dtypes: Tuple[DType, ...], body: List[Any], restrict: bool = True) -> Module:
+    # arg_dtypes holds the dtype of out followed by the ones of the inputs
+    pointer = RestrictPointer if restrict else Pointer
+    names = ['out', *[f'inp{i+1}' for i in range(len(arg_dtypes) - 1)]]
+    return Module(
         [
             Include("math.h"),
+            Include("limits.h"),
             FunctionBody(
                 FunctionDeclaration(
                     Value('void', function_name),
-                    arg_decls=[Pointer(POD(dtype, name)) for name in ['out', "inp1"]],
-                ),
-                Block(
-                    [
-                        For(
-                            'int i = 0',
-                            f'i<{math.prod(shape)}',
-                            'i++',
-                            Block([assignment]),
-                        ),
-                    ]
+                    arg_decls=[pointer(Value(dtype.c, name)) for dtype, name in zip(arg_dtypes, names)],
                 ),
+                Block(body),
             )
         ]
     )
-    return code
 
 
-def c_binary(function_name: str, op: BinaryOps, shape: Tuple[int, ...], *strides: Tuple[int, ...], dtype=c.c_float) -> Module:
-    includes = []
-    if op is BinaryOps.MAX:
-        assignment = Assign('out[outIdx]', 'fmax(inp1[idx1], inp2[idx2])')
-        includes.append(Include("math.h"))
+# output columns a column reduction accumulates at once, and the fewest it needs to pay off
+COLUMN_BLOCK = 64
+MIN_COLUMNS = 8
+
+def ast_nodes(ast: LazyOp) -> List[LazyOp]:
+    return [node for src in ast.srcs if isinstance(src, LazyOp) for node in ast_nodes(src)] + [ast]
+
+def leaves(ast: LazyOp) -> List[Any]:
+    return [leaf for src in ast.srcs for leaf in (leaves(src) if isinstance(src, LazyOp) else [src])]
+
+def column_reduce(ast: LazyOp) -> Optional[LazyOp]:
+    """
+    The reduction of ast if it is better computed column wise: it is the only one,
+    keeps the last dimension of its input, and every input is laid out along that
+    dimension. Looping over the reduced dims innermost would then stride through
+    memory, instead a block of columns is accumulated side by side.
+    """
+    reduces = [node for node in ast_nodes(ast) if node.op in ReduceOps]
+    if len(reduces) != 1:
+        return None
+    node = reduces[0]
+    shape = ast_shape(node.srcs[0])
+    if len(shape) - 1 in node.arg or shape[-1] < MIN_COLUMNS:
+        return None
+    for leaf in leaves(node):
+        if len(leaf.st.views) != 1 or leaf.st.views[0].strides[-1] not in (0, 1):
+            return None
+    return node
+
+def c_reduce(function_name: str, ast: LazyOp, srcs: Tuple[Any, ...], shape: Tuple[int, ...], dtype: DType = dtypes.float32) -> Module:
+    """
+    Kernel for a tree with at least one reduction in it. Loops over the output, for
+    every output element the reductions accumulate into locals (with their fused
+    elementwise inputs computed on the fly), elementwise ops after them are applied
+    before the single write to out.
+    Reductions that keep the last dimension accumulate a block of columns at once instead,
+    see column_reduce.
+    """
+    arg_dtypes = (dtype, *[src.dtype for src in srcs])
+    # only the output dimensions run in parallel, every reduction stays within one thread
+    work = max([src.size for src in srcs], default=1)
+    chars = tuple(CHARACTERS[:len(shape)])
+    node = column_reduce(ast)
+    if node is None:
+        # out holds one value per row for reductions over the last dim, per row values go first
+        row_stmts: List[Any] = []
+        stmts, res = render_ast(ast, srcs, chars, row_chars=chars, row_stmts=row_stmts)
+        body = Block([*row_stmts, *stmts, Assign(f'out[{gen_indices(shape)}]', res)])
+        loops = gen_n_for_loops(shape, body) if len(shape) > 0 else body
+        return c_kernel(function_name, arg_dtypes, [*omp_parallel(shape, work), loops])
+
+    dims, in_shape, col = node.arg, ast_shape(node.srcs[0]), chars[-1]
+    rs = tuple(f'r_{j}' for j in range(len(dims)))
+    inner, val = render_ast(node.srcs[0], srcs, reduce_chars(chars, dims, rs))
+    val_dtype = ast_dtype(node.srcs[0])
+    post, res = render_ast(ast, srcs, chars, accs={id(node): ('acc[cj]', val_dtype)})
+
+    def columns(body: List[Any]) -> For:
+        # a loop over the columns of the current block, col is the column in the output
+        return For('int cj = 0', 'cj<cn', 'cj++', Block([Assign(f'int {col}', 'cb + cj'), *body]))
+
+    loop: Any = columns([*inner, Assign('acc[cj]', reduce_to_cstyle[node.op]('acc[cj]', val, val_dtype))])
+    for r, dim in reversed(list(zip(rs, dims))):
+        loop = For(f'int {r} = 0', f'{r}<{in_shape[dim]}', f'{r}++', loop)
+    n = shape[-1]
+    block = For('int cb = 0', f'cb<{n}', f'cb+={COLUMN_BLOCK}', Block([
+        Assign('int cn', f'{n} - cb < {COLUMN_BLOCK} ? {n} - cb : {COLUMN_BLOCK}'),
+        Statement(f'{val_dtype.acc} acc[{COLUMN_BLOCK}]'),
+        For('int cj = 0', 'cj<cn', 'cj++', Assign('acc[cj]', reduce_init[node.op](val_dtype))),
+        loop,
+        columns([*post, Assign(f'out[{gen_indices(shape)}]', res)]),
+    ]))
+    loops = gen_n_for_loops(shape[:-1], Block([block])) if len(shape) > 1 else block
+    return c_kernel(function_name, arg_dtypes, [*omp_parallel((*shape[:-1], -(-n // COLUMN_BLOCK)), work), loops])
+
+
+def c_elementwise(function_name: str, ast: LazyOp, srcs: Tuple[Any, ...], shape: Tuple[int, ...], dtype: DType = dtypes.float32,
+                  restrict: bool = True) -> Module:
+    arg_dtypes = (dtype, *[src.dtype for src in srcs])
+    if all(src.st.contiguous for src in srcs):
+        # every buffer has the same layout as the output, so a single flat loop does it
+        stmts, res = render_ast(ast, srcs, (), flat=True)
+        size = math.prod(shape)
+        loops = For('int i = 0', f'i<{size}', 'i++', Block([*stmts, Assign('out[i]', res)]))
+        return c_kernel(function_name, arg_dtypes, [*omp_parallel((size,)), loops], restrict=restrict)
+    stmts, res = render_ast(ast, srcs, tuple(CHARACTERS[:len(shape)]))
+    loops = gen_n_for_loops(shape, Block([*stmts, Assign(f'out[{gen_indices(shape)}]', res)]))
+    return c_kernel(function_name, arg_dtypes, [*omp_parallel(shape), loops], restrict=restrict)
+
+
+def c_rows(function_name: str, ast: LazyOp, srcs: Tuple[Any, ...], shape: Tuple[int, ...], dtype: DType = dtypes.float32,
+           restrict: bool = True) -> Module:
+    """
+    Kernel for an elementwise tree that reads per row values broadcast along the last dim
+    (softmax, layernorm). For every row those are computed first, each in a loop over the
+    row, then a last loop writes the row. The row stays in cache across the loops, so
+    memory is read about once, no matter how many reductions the tree has.
+    """
+    chars = tuple(CHARACTERS[:len(shape)])
+    row_stmts: List[Any] = []
+    stmts, res = render_ast(ast, srcs, chars, row_chars=chars[:-1], row_stmts=row_stmts)
+    col = chars[-1]
+    body = Block([*row_stmts, For(f'int {col} = 0', f'{col}<{shape[-1]}', f'{col}++',
+                                  Block([*stmts, Assign(f'out[{gen_indices(shape)}]', res)]))])
+    loops = gen_n_for_loops(shape[:-1], body) if len(shape) > 1 else body
+    return c_kernel(function_name, (dtype, *[src.dtype for src in srcs]), [*omp_parallel(shape[:-1], math.prod(shape)), loops],
+                    restrict=restrict)
+
+
+# (M, N, K) -> (MR, NR, KC, NC), overrides the heuristic in matmul_tiles for that shape
+MATMUL_TILES: Dict[Tuple[int, int, int], Tuple[int, int, int, int]] = {}
+
+def matmul_tiles(M: int, N: int, K: int) -> Tuple[int, int, int, int]:
+    """
+    Tile sizes for an (M, K) @ (K, N) matmul.
+    MR x NR is the block of out kept in registers, prefering sizes that divide
+    the matrix so there is no remainder, KC x NC the panel of inp2 kept in cache.
+    """
+    if (M, N, K) in MATMUL_TILES:
+        return MATMUL_TILES[(M, N, K)]
+    mr = next((t for t in (4, 3, 2) if M % t == 0), 4)
+    nr = next((t for t in (16, 8) if N % t == 0), 16)
+    mr, nr = min(mr, M), min(nr, N)
+    kc = min(K, 256)
+    nc = min(max(nr, 512 // nr * nr), N // nr * nr)
+    return mr, nr, kc, nc
+
+def gen_flat_offset(var: str, shape: Tuple[int, ...], strides: Tuple[int, ...]) -> str:
+    # memory offset of the var-th element of a row major walk over shape
+    if all(strides[d] == strides[d+1] * shape[d+1] for d in range(len(shape) - 1)):
+        return f'({var}) * {strides[-1]}' if len(shape) > 0 else '0'
+    terms, inner = [], 1
+    for d in reversed(range(len(shape))):
+        if strides[d] != 0 and shape[d] != 1:
+            term = f'({var})' if inner == 1 else f'(({var}) / {inner})'
+            term = f'({term} % {shape[d]})' if d > 0 else term
+            terms.append(f'{term} * {strides[d]}')
+        inner *= shape[d]
+    return ' + '.join(reversed(terms)) if terms else '0'
+
+def c_matmul(function_name: str, shape: Tuple[int, ...], *sts: ShapeTracker, dtype: DType = dtypes.float32, args=None,
+             tiles=None) -> Module:
+    """
+    Blocked matmul of inp1 (*rows, K) with inp2 (K, *cols).
+    The output is computed in MR x NR tiles that accumulate in registers, the loop over
+    a tile's columns walks inp2 and out contiguously. The k dimension is blocked by KC and
+    the columns by NC so the panel of inp2 in use stays in cache. Rows and columns that
+    don't fill a whole tile are handled by a plain loop afterwards.
+    Small dtypes accumulate in a wider type (float16 in float, int8 in int).
+    The inputs are read through their (unmasked) views, so transposed inputs cost no copy.
+
+    An inp2 that is no single unmasked view (e.g. padded sliding windows, im2col) is
+    packed: every KC x NC panel is gathered through its ShapeTracker into a buffer
+    once, the tiles of all rows read the panel from there. Only a panel is ever in memory.
+    """
+    shape0, shape1 = args
+    M, K, N = math.prod(shape0[:-1]), shape0[-1], math.prod(shape1[1:])
+    view0, view1 = sts[0].views[0], sts[1].views[-1]
+    sak, sbk = view0.strides[-1], view1.strides[0]
+    MR, NR, KC, NC = matmul_tiles(M, N, K) if tiles is None else tiles
+    Mm, Nm = M - M % MR, N - N % NR
+    dt = dtype.acc
+    packed = len(sts[1].views) > 1 or view1.mask is not None
+
+    def row_off(i: str) -> str:
+        return gen_flat_offset(i, shape0[:-1], view0.strides[:-1]) + (f' + {view0.offset}' if view0.offset else '')
+
+    def col_off(j: str) -> str:
+        # only used unpacked, when view1 is the only view of inp2
+        return gen_flat_offset(j, shape1[1:], view1.strides[1:]) + (f' + {view1.offset}' if view1.offset else '')
+
+    def inp2(k: str, j: str) -> str:
+        return f'bp[({k} - k0) * {NC} + {j} - j0]' if packed else f'inp2[{k} * {sbk} + {col_off(j)}]'
+
+    def tile(col: str):
+        init = [For('int jj = 0', f'jj<{NR}', 'jj++', Block([
+            Assign(f'acc[{ii}][jj]', f'k0 == 0 ? 0 : out[(i0 + {ii}) * {N} + {col} + jj]') for ii in range(MR)
+        ]))]
+        rows = [Assign(f'int ra{ii}', row_off(f'i0 + {ii}')) for ii in range(MR)]
+        inner = Block([
+            *[Assign(f'{dt} a{ii}', f'inp1[ra{ii} + k * {sak}]') for ii in range(MR)],
+            For('int jj = 0', f'jj<{NR}', 'jj++', Block([
+                Assign(f'{dt} b', inp2('k', f'{col} + jj')),
+                *[Statement(f'acc[{ii}][jj] += a{ii} * b') for ii in range(MR)],
+            ])),
+        ])
+        store = [For('int jj = 0', f'jj<{NR}', 'jj++', Block([
+            Assign(f'out[(i0 + {ii}) * {N} + {col} + jj]', f'acc[{ii}][jj]') for ii in range(MR)
+        ]))]
+        return Block([
+            Statement(f'{dt} acc[{MR}][{NR}]'),
+            *init,
+            *rows,
+            For('int k = k0', 'k<kEnd', 'k++', inner),
+            *store,
+        ])
+
+    def tile_loops():
+        return For('int j0 = 0', f'j0<{Nm}', f'j0 += {NC}', Block([
+            For('int k0 = 0', f'k0<{K}', f'k0 += {KC}', Block([
+                Assign('int kEnd', f'k0 + {KC} < {K} ? k0 + {KC} : {K}'),
+                Assign('int jEnd', f'j0 + {NC} < {Nm} ? j0 + {NC} : {Nm}'),
+                *omp_parallel((Mm // MR,), M * N * K),
+                For('int i0 = 0', f'i0<{Mm}', f'i0 += {MR}', Block([
+                    For('int j1 = j0', 'j1<jEnd', f'j1 += {NR}', tile('j1')),
+                ])),
+            ])),
+        ]))
+
+    def remainder_loops(i_range, j_range):
+        rows, cols = i_range[1] - i_range[0], j_range[1] - j_range[0]
+        # ra is computed in the j loop, the pragma may collapse both loops, which have to be perfectly nested
+        return Block([*omp_parallel((rows, cols), rows * cols * K), For(f'int i = {i_range[0]}', f'i<{i_range[1]}', 'i++', Block([
+            For(f'int j = {j_range[0]}', f'j<{j_range[1]}', 'j++', Block([
+                Assign('int ra', row_off('i')),
+                Assign(f'{dt} acc', '0'),
+                Assign('int cb', col_off('j')),
+                For('int k = 0', f'k<{K}', 'k++', Block([Statement(f'acc += inp1[ra + k * {sak}] * inp2[k * {sbk} + cb]')])),
+                Assign(f'out[i * {N} + j]', 'acc'),
+            ])),
+        ]))])
+
+    def packed_loops():
+        idx, valid = sts[1].expr(['k', *unravel('j', shape1[1:])])
+        pack = f'({valid}) ? ({dt})inp2[{idx}] : 0' if valid is not None else f'inp2[{idx}]'
+
+        def partial(i_range, j_range):
+            # the part of the panel outside of whole tiles, accumulated into out over the k block
+            rows = For(f'int i = {i_range[0]}', f'i<{i_range[1]}', 'i++', Block([
+                Assign('int ra', row_off('i')),
+                For(f'int j = {j_range[0]}', f'j<{j_range[1]}', 'j++', Block([
+                    Assign(f'{dt} acc', f'k0 == 0 ? 0 : out[i * {N} + j]'),
+                    For('int k = k0', 'k<kEnd', 'k++', Block([
+                        Statement(f'acc += inp1[ra + k * {sak}] * {inp2("k", "j")}'),
+                    ])),
+                    Assign(f'out[i * {N} + j]', 'acc'),
+                ])),
+            ]))
+            return Block([*omp_parallel((M,), M * NC * KC), rows])
+
+        return Block([
+            Assign(f'{dt} *bp', f'malloc(sizeof({dt}) * {KC * NC})'),
+            For('int j0 = 0', f'j0<{N}', f'j0 += {NC}', Block([
+                Assign('int jEnd', f'j0 + {NC} < {N} ? j0 + {NC} : {N}'),
+                Assign('int jTile', f'j0 + (jEnd - j0) / {NR} * {NR}'),
+                For('int k0 = 0', f'k0<{K}', f'k0 += {KC}', Block([
+                    Assign('int kEnd', f'k0 + {KC} < {K} ? k0 + {KC} : {K}'),
+                    *omp_parallel((KC,), KC * NC),
+                    For('int k = k0', 'k<kEnd', 'k++', Block([
+                        For('int j = j0', 'j<jEnd', 'j++', Block([Assign(inp2('k', 'j'), pack)])),
+                    ])),
+                    *omp_parallel((Mm // MR,), M * NC * KC),
+                    For('int i0 = 0', f'i0<{Mm}', f'i0 += {MR}', Block([
+                        For('int j1 = j0', 'j1<jTile', f'j1 += {NR}', tile('j1')),
+                    ])),
+                    partial((0, M), ('jTile', 'jEnd')),
+                    partial((Mm, M), ('j0', 'jTile')),
+                ])),
+            ])),
+            Statement('free(bp)'),
+        ])
+
+    loops = []
+    if packed:
+        loops.append(packed_loops())
     else:
-        assignment = Assign('out[outIdx]', f'inp1[idx1] {bops_to_cstyle[op]} inp2[idx2]')
-
-    idx1 = Assign('int idx1', gen_indices_strided(shape, strides[0]))
-    idx2 = Assign('int idx2', gen_indices_strided(shape, strides[1]))
-    out_idx = Assign('int outIdx', gen_indices_strided(shape, tuple([1 for _ in range(len(strides[0]))])))
-    block = Block([
-        idx1,
-        idx2,
-        out_idx,
-        assignment
-    ])
-    loops = gen_n_for_loops(shape ,block)
-    code = Module(
-        [
-            *includes,
-            FunctionBody(
-                FunctionDeclaration(
-                    Value('void', function_name),
-                    arg_decls=[Pointer(POD(dtype, name)) for name in ['out', 'inp1', 'inp2']],
-                ),
-                Block(
-                    [
-                        loops
-                    ]
-                ),
-            )
-        ]
-    )
-    return code
-
-def c_matmul(function_name: str, shape: Tuple[int, ...], *strides: Tuple[int, ...], dtype=c.c_float, args=None) -> Module:
-    old_shape0 = args[0]
-    old_shape1 = args[1]
-    if len(args[0]) > 2:
-        old_shape0 = tuple([math.prod(args[0][:-1]), args[0][-1]])
-    if len(args[1]) > 2:
-        old_shape1 = tuple([args[1][0], math.prod(args[1][1:])])
-    if len(shape) > 2:
-        shape = tuple([math.prod(shape[:-1]), shape[-1]])
-        
-    assignment = Statement('out[outIdx] += inp1[idx1] * inp2[idx2]')
-    idx1 = Assign('int idx1', gen_indices_strided(old_shape0, strides[0], ['a', 'c', 'b']))
-    idx2 = Assign('int idx2', gen_indices_strided(old_shape1, strides[1], ['c', 'b', 'a']))
-    out_idx = Assign('int outIdx', gen_indices_strided(shape, tuple([1 for _ in range(len(strides[0]))])))
-    block = Block([
-        idx1,
-        idx2,
-        out_idx,
-        assignment
-    ])
-    loops = gen_n_for_loops(shape + (args[0][-1],), block)
+        if Mm > 0 and Nm > 0:
+            loops.append(tile_loops())
+        if Nm < N:
+            loops.append(remainder_loops((0, M), (Nm, N)))
+        if Mm < M and Nm > 0:
+            loops.append(remainder_loops((Mm, M), (0, Nm)))
     code = Module(
         [
+            *([Include('stdlib.h')] if packed else []),
             FunctionBody(
                 FunctionDeclaration(
                     Value('void', function_name),
-                    arg_decls=[Pointer(POD(dtype, name)) for name in ['out', 'inp1', 'inp2']],
+                    arg_decls=[RestrictPointer(Value(dtype.c, name)) for name in ['out', 'inp1', 'inp2']],
                 ),
                 Block(
-                    [
-                        loops
-                    ]
+                    loops
                 ),
             )
         ]
@@ -281,35 +561,38 @@ def c_matmul(function_name: str, shape: Tuple[int, ...], *strides: Tuple[int, ..
     return code
 
 
-def c_load(function_name: str, op, shape, dtype=c.c_float, arg=None):
+def c_load(function_name: str, op, shape, dtype: DType = dtypes.float32, arg=None):
     if op is LoadOps.RAND:
         assert arg is not None, 'We need to provide a seed for the rand function'
         includes = ['stdlib.h']
         prefix = Statement(f'srand({arg})')
-        assignment = Assign('out[i]', '(float)rand() / (float)(RAND_MAX)')
+        assignment = Assign('out[i]', f'({dtype.c})((float)rand() / (float)(RAND_MAX))')
     elif op is LoadOps.CONST:
         assert arg is not None, 'Need to provide const value'
-        includes = []
+        # INFINITY and NAN
+        includes = ['math.h']
         prefix = None
-        assignment = Assign('out[i]', f'{float(arg)}')
+        assignment = Assign('out[i]', c_literal(arg, dtype))
     elif op is LoadOps.EMPTY:
         includes = []
         prefix = None
-        assignment = Assign('out[i]', f'{float(0)}')
+        assignment = Assign('out[i]', '0')
     else:
         raise NotImplementedError(f'c_load not implemented for {op}.')
+    # rand() has hidden state, so RAND has to fill the buffer in order on one thread
+    parallel = omp_parallel((math.prod(shape),)) if op is not LoadOps.RAND else []
     code = Module(
         [
             *[Include(include) for include in includes],
             FunctionBody(
-                FunctionDeclaration(Value('void', function_name), arg_decls=[Pointer(POD(dtype, 'out'))]),
+                FunctionDeclaration(Value('void', function_name), arg_decls=[RestrictPointer(Value(dtype.c, 'out'))]),
                 Block(
                     [
                         prefix,
                         For('int i = 0', f'i<{math.prod(shape)}', 'i++', Block([assignment])),
                     ]
                     if prefix is not None
-                    else [For('int i = 0', f'i<{math.prod(shape)}', 'i++', Block([assignment]))]
+                    else [*parallel, For('int i = 0', f'i<{math.prod(shape)}', 'i++', Block([assignment]))]
                 ),
             ),
         ]
@@ -317,22 +600,21 @@ def c_load(function_name: str, op, shape, dtype=c.c_float, arg=None):
     return code
 
 
-def c_generator(func_name: str, op: OpType, shape, *strides, dtype=c.c_float, arg=None) -> Module:
-    if op in BinaryOps:
-        if op is BinaryOps.MATMUL:
-            return c_matmul(func_name, shape, *strides, dtype=c.c_float, args=arg)
-        else:
-            return c_binary(func_name, op, shape, *strides, dtype=dtype) # type: ignore
-    elif op in UnaryOps:
-        strided_shape = tuple([sh//st for sh,st in zip(shape, strides[0])])
-        return c_unary(func_name, op, strided_shape, dtype=dtype) # type: ignore
+def compile_flags(device: str) -> List[str]:
+    return Device.FLAGS(device) + (['-fopenmp'] if Device.THREADS() > 1 else [])
+
+
+def c_generator(func_name: str, op: OpType, shape, dtype: DType = dtypes.float32, arg=None, ast=None, srcs=(), aliased=False) -> Module:
+    if op in ElementwiseOps and MovementOps.EXPAND in ast_ops(ast):
+        return c_rows(func_name, ast, srcs, shape, dtype=dtype, restrict=not aliased)
+    if op in ReduceOps or (op in ElementwiseOps and any(o in ReduceOps for o in ast_ops(ast))):
+        return c_reduce(func_name, ast, srcs, shape, dtype=dtype)
+    elif op in ElementwiseOps:
+        return c_elementwise(func_name, ast, srcs, shape, dtype=dtype, restrict=not aliased)
+    elif op is BinaryOps.MATMUL:
+        return c_matmul(func_name, shape, *[src.st for src in srcs], dtype=dtype, args=arg)
     elif op in LoadOps:
-        strided_shape = tuple([sh//st for sh,st in zip(shape, strides)])
-        return c_load(func_name, op, strided_shape, dtype=dtype, arg=arg)
-    elif op in ReduceOps:
-        return c_reduce(func_name, op, shape, strides[0], dtype=dtype, arg=arg) # type: ignore
-    elif op in MovementOps:
-        return c_movement(func_name, shape, stride=strides[0], permute_dim=arg, dtype=dtype) # type: ignore
+        return c_load(func_name, op, shape, dtype=dtype, arg=arg)
     else:
         raise NotImplementedError(f'c_generator for {op.op} not implemented yet.') # type: ignore
 
@@ -341,19 +623,20 @@ class CProgram:
     incudes: List[str] = ['stdio.h', 'stdlib.h', 'time.h']
     kernel_prefix: str = 'void'
 
-    def __init__(self, si: 'ScheduleItem'):
+    def __init__(self, si: 'ScheduleItem', aliased: bool = False, compile: bool = True):
+        # aliased kernels write over one of their inputs, their pointers must not be restrict
+        self.aliased = aliased
+        self.ast = si.op
+        self.device = si.target.device
         self.op = si.op.op
         self.shape = si.target.shape
-        self.dtype = c.c_float
+        self.dtype: DType = si.target.dtype
         self.arg = si.op.arg
-        if len(si.srcs) > 0:
-            self.srcs = si.srcs
-            self.strides = tuple([lb.st.stride for lb in si.srcs])
-        else:
-            self.srcs = tuple()
-            self.strides = si.target.st.stride
+        # targets are always contiguous, srcs are read through their ShapeTrackers
+        self.srcs = si.srcs
 
-        self._write_codepy()
+        if compile:
+            self._write_codepy()
 
     def __call__(self, output, *inputs):
         self._program(output, *inputs)
@@ -363,61 +646,105 @@ class CProgram:
         return self._program
 
     def _gen_func_name_args(self) -> Tuple[str, Any]:
-        args: Tuple[Type[c._Pointer[c.c_float]], ...] 
-        if self.op in BinaryOps:
-            if self.op is BinaryOps.MATMUL:
-                str_shape = '_'.join([str(s) for s in self.arg[0] + self.arg[1]])
-                func_name = f'{self.op.name}_{str_shape}_{ctype2str(self.dtype)}'
-                args = (c.POINTER(c.c_float), c.POINTER(c.c_float), c.POINTER(c.c_float))
-            else:
-                str_shape = '_'.join([str(s) for s in self.shape])
-                func_name = f'{self.op.name}_{str_shape}_{ctype2str(self.dtype)}'
-                args = (c.POINTER(c.c_float), c.POINTER(c.c_float), c.POINTER(c.c_float))
-        elif self.op in UnaryOps:
+        args: Tuple[Type[c._Pointer], ...]
+        # every buffer is passed as a pointer to its own dtype
+        pointers = tuple(c.POINTER(dtype.ctype) for dtype in (self.dtype, *[lb.dtype for lb in self.srcs]))
+        if self.op in ElementwiseOps or self.op in ReduceOps:
+            ops = ast_ops(self.ast)
+            op_names = '_'.join(op.name for op in ops)
             str_shape = '_'.join([str(s) for s in self.shape])
-            func_name = f'{self.op.name}_{str_shape}_{ctype2str(self.dtype)}'
-            args = (c.POINTER(c.c_float), c.POINTER(c.c_float))
+            prefix = 'reduce_' if any(op in ReduceOps for op in ops) else ''
+            func_name = f'{prefix}{op_names}_{str_shape}_{self.dtype.name}'
+            args = pointers
+        elif self.op is BinaryOps.MATMUL:
+            str_shape = '_'.join([str(s) for s in self.arg[0] + self.arg[1]])
+            func_name = f'{self.op.name}_{str_shape}_{self.dtype.name}'
+            args = pointers
         elif self.op in LoadOps:
-            strided_shape = tuple([sh//st for sh,st in zip(self.shape, self.strides)])
-            str_shape = str(math.prod(strided_shape))
-            li = self.shape + strided_shape
-            str_shape = '_'.join([str(s) for s in li])
-            func_name = f'load_{self.op.name}_{str_shape}_{ctype2str(self.dtype)}'
-            func_name += '' if self.arg is None else f'_{int(self.arg)}'
-            args = (c.POINTER(c.c_float),)
-        elif self.op in ReduceOps:
-            str_shape = '_'.join([str(s) for s in self.srcs[0].shape])
-            func_name = f"reduce_{self.op.name}_{str_shape}_{ctype2str(self.dtype)}_{self.arg}"
-            args = (c.POINTER(c.c_float), c.POINTER(c.c_float))
-        elif self.op in MovementOps:
-            str_shape = '_'.join([str(s) for s in self.srcs[0].shape + self.arg])
-            func_name = f"movement_{self.op.name}_{str_shape}_{ctype2str(self.dtype)}"
-            args = (c.POINTER(c.c_float), c.POINTER(c.c_float))
+            str_shape = '_'.join([str(s) for s in self.shape])
+            func_name = f'load_{self.op.name}_{str_shape}_{self.dtype.name}'
+            func_name += '' if self.arg is None else f'_{int(self.arg)}'.replace('-', 'm')
+            args = pointers
         else: 
             raise NotImplementedError(f"op: {self.op} not implemented in _get_func_name_args")
         return func_name, args
 
+    def render(self, func_name: Optional[str] = None) -> Module:
+        if func_name is None:
+            func_name, _ = self._gen_func_name_args()
+
+        return c_generator(func_name, self.op, self.shape, dtype=self.dtype, arg=self.arg, ast=self.ast, srcs=self.srcs,
+                           aliased=self.aliased)
+
     def _write_codepy(self) -> None:
         func_name, args = self._gen_func_name_args()
-        func_file_cmp = Path('/tmp') / f'{func_name}.out'
-        # check if function was already compiled
-        if func_file_cmp.exists() and not ALWAYS_RECOMPILE:
-            lib = c.CDLL(str(func_file_cmp))
-            lib[func_name].argtypes = args
-            self._program = lib[func_name]
-            return
-
-        shape = self.shape
-        if self.op in ReduceOps or self.op is MovementOps.PERMUTE:
-            shape = self.srcs[0].shape
-
-        code = c_generator(func_name, self.op, shape, *self.strides, dtype=self.dtype, arg=self.arg)
-
-        func_file_code = Path('/tmp') / f'{func_name}.c'
-        # save program to file and compile it
-        with func_file_code.open('w') as f:
-            f.write(str(code))
-        subprocess.run(['clang', '-shared', '-O2', func_file_code, '-o', func_file_cmp], check=True)
-        lib = c.CDLL(str(func_file_cmp))
-        lib[func_name].argtypes = args
+        code = self.render(func_name)
+
+        # the kernel cache is keyed by the source itself, so kernels whose
+        # names collide (e.g. same shape, different strides) never share a binary
+        lib = KernelCache.load(str(code), compile_flags(self.device), Device.COMPILER(self.device))
         self._program = lib[func_name]
+        self._program.argtypes = args
+
+
+class CBatchProgram:
+    """
+    Every kernel of a schedule in a single translation unit.
+
+    The kernels are called in order by one driver function,
+    void run(char *arena, void **bufs), so the whole schedule costs one
+    compiler run, one dlopen and one call through ctypes. Planned
+    intermediates live at fixed offsets in arena, every other buffer
+    (inputs, loads and outputs) is passed in bufs in the order of self.buffers.
+    Kernels with the same source are only emitted once.
+    """
+    driver_name: str = 'run'
+
+    def __init__(self, schedule: List['ScheduleItem'], plan: 'MemoryPlan'):
+        self.buffers: List['LazyBuffer'] = []
+        index: Dict['LazyBuffer', int] = {}
+        kernels: Dict[str, str] = {}
+        includes: Dict[str, Include] = {}
+        functions: List[Any] = []
+        calls: List[Statement] = []
+        self.device = schedule[0].target.device if schedule else Device.DEFAULT()
+
+        def pointer(buf: 'LazyBuffer') -> str:
+            # views are passed as the memory of their root, the kernel applies their ShapeTracker
+            buf = buf.root
+            if buf in plan.offsets:
+                return f'({buf.dtype.c} *)(arena + {plan.offsets[buf]})'
+            if buf not in index:
+                index[buf] = len(self.buffers)
+                self.buffers.append(buf)
+            return f'({buf.dtype.c} *)bufs[{index[buf]}]'
+
+        for si in schedule:
+            prg = CProgram(si, aliased=si.target in plan.inplace, compile=False)
+            key = str(prg.render('kernel'))
+            if key not in kernels:
+                kernels[key] = f'kernel{len(kernels)}'
+                for item in prg.render(kernels[key]).contents:
+                    if isinstance(item, Include):
+                        includes.setdefault(str(item), item)
+                    else:
+                        functions.append(item)
+            calls.append(Statement(f'{kernels[key]}({", ".join(pointer(buf) for buf in (si.target, *si.srcs))})'))
+
+        self.code = Module([
+            *includes.values(),
+            *functions,
+            FunctionBody(
+                FunctionDeclaration(
+                    Value('void', self.driver_name),
+                    arg_decls=[Pointer(Value('char', 'arena')), Pointer(Pointer(Value('void', 'bufs')))],
+                ),
+                Block(calls),
+            ),
+        ])
+        lib = KernelCache.load(str(self.code), compile_flags(self.device), Device.COMPILER(self.device))
+        self._program = lib[self.driver_name]
+        self._program.argtypes = (c.c_void_p, c.POINTER(c.c_void_p))
+
+    def __call__(self, arena, bufs):
+        self._program(arena, bufs)
@@ -1,7 +1,13 @@
 import os
+import shlex
+
+from typing import List
 
 devices = ['CPU']
 
+DEFAULT_FLAGS = '-O2'
+DEFAULT_COMPILER = 'clang'
+
 
 class _Device:
     @staticmethod
@@ -11,5 +17,20 @@ class _Device:
                 return device
         return 'CPU'
 
+    @staticmethod
+    def THREADS() -> int:
+        # threads used by a single kernel, anything above 1 turns on the OpenMP backend
+        return int(os.environ.get('THREADS', 1))
+
+    @staticmethod
+    def FLAGS(device: str) -> List[str]:
+        # compiler flags for kernels of device, e.g. CPU_FLAGS="-O3 -march=native -ffast-math"
+        return shlex.split(os.environ.get(f'{device}_FLAGS', DEFAULT_FLAGS))
+
+    @staticmethod
+    def COMPILER(device: str) -> str:
+        # how kernels of device are compiled (clang, memfd or tcc), e.g. CPU_COMPILER=memfd
+        return os.environ.get(f'{device}_COMPILER', DEFAULT_COMPILER)
+
 
 Device = _Device()
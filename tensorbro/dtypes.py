@@ -0,0 +1,59 @@
+import ctypes as c
+
+from dataclasses import dataclass
+from typing import Any, Dict
+
+
+@dataclass(frozen=True)
+class DType:
+    """
+    name: numpy style name, e.g. float32
+    itemsize: bytes per element
+    c: name of the type in the generated C code
+    fmt: buffer protocol format character
+    is_float: floating point or integer type
+    ctype: ctypes type buffers of this dtype are allocated as, float16 is stored as uint16
+    """
+    name: str
+    itemsize: int
+    c: str
+    fmt: str
+    is_float: bool
+    ctype: Any
+
+    @property
+    def acc(self) -> str:
+        # C type that sums and products of this dtype are accumulated in
+        if self.is_float:
+            return 'float' if self.itemsize < 4 else self.c
+        return 'int' if self.itemsize < 4 else self.c
+
+    def __repr__(self):
+        return f'dtypes.{self.name}'
+
+
+class dtypes:
+    float16 = DType('float16', 2, '_Float16', 'e', True, c.c_uint16)
+    float32 = DType('float32', 4, 'float', 'f', True, c.c_float)
+    float64 = DType('float64', 8, 'double', 'd', True, c.c_double)
+    int8 = DType('int8', 1, 'signed char', 'b', False, c.c_int8)
+    int32 = DType('int32', 4, 'int', 'i', False, c.c_int32)
+
+    @staticmethod
+    def fields() -> Dict[str, DType]:
+        return {name: dt for name, dt in vars(dtypes).items() if isinstance(dt, DType)}
+
+    @staticmethod
+    def from_name(name: str) -> DType:
+        if name not in dtypes.fields():
+            raise ValueError(f'Unsupported dtype: {name}')
+        return dtypes.fields()[name]
+
+    @staticmethod
+    def from_format(fmt: str) -> DType:
+        # buffer protocol format, byte order prefixes for the native order are ignored
+        fmt = fmt.lstrip('@=<')
+        for dt in dtypes.fields().values():
+            if dt.fmt == fmt:
+                return dt
+        raise ValueError(f'Unsupported buffer format: {fmt}')
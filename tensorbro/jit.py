@@ -0,0 +1,87 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+from .lazy import LazyBuffer
+from .linearizer import Runner, linearize
+from .ops import LazyOp, LoadOps
+from .tensor import Tensor
+
+
+@dataclass
+class CapturedGraph:
+    inputs: List[LazyBuffer]
+    outputs: List[LazyBuffer]
+    targets: Set[LazyBuffer]
+    runner: Runner
+    single: bool
+
+
+class Jit:
+    """
+    Captures the kernels of a function of Tensors once and replays them.
+
+    The first call with a new set of input shapes runs fn on placeholder
+    buffers, schedules and compiles the resulting graph and keeps the Runner.
+    Every later call with the same shapes only points the placeholders at the
+    new input memory and runs the kernels again, fn itself is not called.
+
+    Captured functions must not depend on anything but their Tensor arguments
+    (and the hashable non Tensor ones, which are part of the cache key).
+    Every call returns freshly allocated outputs. The graph is compiled as a
+    single translation unit unless batch is False.
+
+        @Jit
+        def step(x, w):
+            return (x @ w) + x
+    """
+    def __init__(self, fn: Callable[..., Any], batch: bool = True):
+        self.fn = fn
+        self.batch = batch
+        self.captured: Dict[Tuple, CapturedGraph] = {}
+
+    @staticmethod
+    def key(args) -> Tuple:
+        return tuple((a.data.st, a.data.dtype, a.device) if isinstance(a, Tensor) else a
+                     for a in args)
+
+    def __call__(self, *args):
+        for a in args:
+            if isinstance(a, Tensor) and not a.data.is_realized:
+                a.materialize()
+        key = self.key(args)
+        if key not in self.captured:
+            self.captured[key] = self.capture(*args)
+        graph = self.captured[key]
+
+        for placeholder, a in zip(graph.inputs, [a for a in args if isinstance(a, Tensor)]):
+            placeholder.realize(a.data.base)
+        for out in graph.outputs:
+            if out.root in graph.targets and out.is_realized:
+                out.realize()
+        graph.runner()
+
+        # hand out buffers of their own, the captured outputs get new memory on the next call
+        ret = [Tensor(LazyBuffer(LazyOp(LoadOps.EMPTY, ()), out.device, out.st, base=out.base, dtype=out.dtype), out.device)
+               for out in graph.outputs]
+        return ret[0] if graph.single else tuple(ret)
+
+    def capture(self, *args) -> CapturedGraph:
+        inputs = []
+        fn_args = []
+        for a in args:
+            if isinstance(a, Tensor):
+                placeholder = LazyBuffer(LazyOp(LoadOps.EMPTY, ()), a.data.device, a.data.st, base=a.data.base,
+                                         dtype=a.data.dtype)
+                inputs.append(placeholder)
+                a = Tensor(placeholder, a.device)
+            fn_args.append(a)
+
+        res = self.fn(*fn_args)
+        single = isinstance(res, Tensor)
+        outputs = [res.data] if single else [t.data for t in res]
+
+        seen: Set[LazyBuffer] = set()
+        schedule = []
+        for out in outputs:
+            schedule += out.schedule(seen)
+        return CapturedGraph(inputs, outputs, {si.target for si in schedule}, linearize(schedule, set(outputs), batch=self.batch), single)
@@ -1,43 +1,47 @@
 import math
-import ctypes as c
 
-from typing import Optional, Tuple, Union, List
+from collections import Counter, defaultdict
+from weakref import WeakValueDictionary
+from typing import Any, Callable, Dict, Optional, Set, Tuple, Union, List
 
-from .ops import LazyOp, BinaryOps, UnaryOps, TernaryOps, LoadOps, MovementOps, ReduceOps
+from .dtypes import DType, dtypes
+from .ops import LazyOp, BinaryOps, UnaryOps, TernaryOps, LoadOps, MovementOps, ReduceOps, ElementwiseOps
 from .runners.clang import CAllocator
 from .linearizer import ScheduleItem
-
-def permute_shape(shape, dim):
-    return tuple(map(lambda i: shape[i], dim))
-
-class ShapeTracker:
-    def __init__(self, view: Tuple[int, ...], stride: Optional[Tuple[int, ...]] = None):
-        self._views: List[Tuple[int, ...]] = [view]
-        self._strides: List[Tuple[int, ...]] = [stride] if stride is not None else [tuple(1 for _ in range(len(view)))]
-
-    @staticmethod
-    def from_shape(shape: Tuple[int, ...]):
-        return ShapeTracker(shape)
-
-    @property
-    def view(self) -> Tuple[int, ...]:
-        return self._views[-1]
-
-    @property
-    def stride(self) -> Tuple[int, ...]:
-        return self._strides[-1]
-
-    def __repr__(self):
-        return '<ST>'
-
+from .shapetracker import ShapeTracker
+from .simplify import const_value, fold_cast, fold_elementwise, fold_reduce
+
+MAX_FUSE_DEPTH = 64
+
+def broadcast_shape(*shapes: Tuple[int, ...]) -> Tuple[int, ...]:
+    # shape numpy broadcasts shapes to, aligned at the last dimension
+    ndim = max(len(shape) for shape in shapes)
+    padded = [(1,) * (ndim - len(shape)) + tuple(shape) for shape in shapes]
+    ret = []
+    for dims in zip(*padded):
+        sizes = set(dims) - {1}
+        assert len(sizes) <= 1, f'Shapes {shapes} can not be broadcast together'
+        ret.append(sizes.pop() if sizes else 1)
+    return tuple(ret)
+
+def reduce_dims(shape: Tuple[int, ...], dim: Union[int, Tuple[int, ...]]) -> Tuple[int, ...]:
+    # sorted, non negative dims of a reduction over shape, out of range dims raise like numpy does
+    dims = dim if isinstance(dim, tuple) else (dim,)
+    for d in dims:
+        if not -len(shape) <= d < len(shape):
+            raise IndexError(f'Dimension {d} is out of bounds for a buffer with {len(shape)} dimensions')
+    return tuple(sorted({d % len(shape) for d in dims}))
 
 class LazyBuffer:
-    def __init__(self, op: Optional[LazyOp], device: str, shape_tracker, base=None):
+    def __init__(self, op: Optional[LazyOp], device: str, shape_tracker, base=None, dtype: DType = dtypes.float32):
         self.op: Optional[LazyOp] = op
         self.device: str = device
+        self.dtype: DType = dtype
         self.shape_tracker: ShapeTracker = shape_tracker
         self._base = base
         self._realized: bool = True if base is not None else False
+        # realized buffer whose memory the result is written to, see assign
+        self.assign_to: Optional['LazyBuffer'] = None
 
     @property
     def st(self):
@@ -45,72 +49,275 @@ class LazyBuffer:
 
     @property
     def shape(self):
-        return self.st.view
+        return self.st.shape
+
+    @property
+    def is_view(self) -> bool:
+        # results of movement ops own no memory, they read the memory of their root through st
+        return self.op is not None and self.op.op in MovementOps
+
+    @property
+    def root(self) -> 'LazyBuffer':
+        buf = self
+        while buf.is_view:
+            buf = buf.op.srcs[0]
+        return buf
 
     @property
     def is_realized(self) -> bool:
-        return self._realized
+        return self.root.is_realized if self.is_view else self._realized
 
     @property
     def size(self):
         return math.prod(self.shape)
 
+    @property
+    def buffer_size(self) -> int:
+        # number of elements in memory, views share the memory of their root
+        return math.prod(self.root.shape)
+
     def realize(self, value=None):
+        if self.is_view:
+            return self.root.realize(value)
         self._realized = True
         if value is not None:
             self._base = value
+        elif self.assign_to is not None and self.assign_to.is_realized:
+            self._base = self.assign_to.base
         else:
-            self._base = CAllocator.alloc(c.c_float, math.prod([sh // st for sh, st in zip(self.shape, self.st.stride)]))
+            self._base = CAllocator.alloc(self.dtype.ctype, self.buffer_size)
+
+    def release(self):
+        # hands the memory back to the allocator, the buffer is recomputed if it is needed again
+        if self.is_view:
+            return self.root.release()
+        if self._base is not None and self.assign_to is None:
+            CAllocator.free(self._base)
+        self._base = None
+        self._realized = False
 
     @property
     def base(self):
-        return self._base
+        return self.root.base if self.is_view else self._base
+
+    def numpy(self):
+        """
+        View of the realized memory as a numpy array of self.shape.
+
+        Nothing is copied as long as st is a single view without padding, expanded
+        dimensions show up with a 0 stride and make the array read only.
+        Anything else is gathered into a new array.
+        """
+        import numpy as np
+        assert self.is_realized, 'LazyBuffer has to be realized before it can be viewed, schedule and run it first'
+        mem = np.frombuffer(self.base, np.dtype(self.dtype.name), count=len(self.base))
+        if self.st.contiguous:
+            return mem[:self.size].reshape(self.shape)
+        if len(self.st.views) == 1 and self.st.views[0].mask is None:
+            view = self.st.views[0]
+            expanded = any(st == 0 and sh != 1 for sh, st in zip(view.shape, view.strides))
+            return np.lib.stride_tricks.as_strided(mem[view.offset:], view.shape, [st * mem.itemsize for st in view.strides],
+                                                   writeable=not expanded)
+        # walk every element through the views, from the outside in
+        idx, valid = np.arange(self.size), np.ones(self.size, dtype=bool)
+        for view in reversed(self.st.views):
+            # masked elements are read as 0 in the end, any index in bounds will do for them
+            idxs = np.unravel_index(np.where(valid, idx, 0), view.shape)
+            if view.mask is not None:
+                for i, (lo, hi) in zip(idxs, view.mask):
+                    valid &= (i >= lo) & (i < hi)
+            idx = view.offset + sum((i * st for i, st in zip(idxs, view.strides)), np.zeros_like(idx))
+        return np.where(valid, mem[np.where(valid, idx, 0)], 0).astype(mem.dtype).reshape(self.shape)
 
     def __repr__(self):
-        return f'<LazyBuffer: op={self.op.op}, realized={self.is_realized}>'
-
-    """
-    This should just split the tree at movement ops and
-    keep the sub trees
-    """
-
-    def schedule(self, seen=None):
-        seen = dict() if seen is None else seen
-        if self in seen:
+        return f'<LazyBuffer: op={self.op.op}, dtype={self.dtype}, realized={self.is_realized}>'
+
+    def schedule(self, seen: Optional[Set['LazyBuffer']] = None) -> List[ScheduleItem]:
+        """
+        Returns the kernels needed to realize this buffer in topological order.
+
+        Every unrealized buffer in the graph is visited once, realized buffers and
+        buffers in seen (already scheduled by an earlier call) are treated as inputs.
+        Sources with a single consumer are fused into it, buffers shared by several
+        consumers get their own kernel so they are only computed once. Reductions over
+        the last dim that are broadcast back along it are fused as well, see _row_region.
+        """
+        seen = set() if seen is None else seen
+        if self.is_realized or self.root in seen:
             return []
 
-        op = self.op
+        # views are no kernels of their own, the kernel computes their root
+        order = self.root._toposort(seen)
+        in_graph = set(order)
+        uses = Counter(src for buf in order for src in buf.op.srcs)
+        consumers: Dict['LazyBuffer', Set['LazyBuffer']] = defaultdict(set)
+        for buf in order:
+            for src in buf.op.srcs:
+                consumers[src].add(buf)
+
+        # only kernels that read a per row value broadcast along the rows (directly or through
+        # the elementwise ops they fuse) can compute rows, every other kernel skips _row_region
+        index = {buf: i for i, buf in enumerate(order)}
+        row_values: Set['LazyBuffer'] = set()
+        row_reads: Set['LazyBuffer'] = set()
+        for buf in order:
+            op, srcs = buf.op.op, buf.op.srcs
+            if op in ReduceOps and buf.op.arg == (len(srcs[0].shape) - 1,):
+                row_values.add(buf)
+            elif row_values and any(src in row_values for src in srcs) and (op in ElementwiseOps or buf.is_view):
+                row_values.add(buf)
+            if row_values and (op in ElementwiseOps or op in ReduceOps):
+                if any(src in row_reads or (src in row_values and src.is_view) for src in srcs):
+                    row_reads.add(buf)
+
+        def fusable(src: 'LazyBuffer', region: Set['LazyBuffer']) -> bool:
+            # a view is only fused as a row broadcast, anything else is read from memory
+            if src.is_view:
+                return src in region
+            return src in region or (src in in_graph and uses[src] == 1)
+
+        # walk from the output towards the inputs, every buffer that is not fused
+        # into a consumer becomes the target of its own kernel
+        kernels: Dict['LazyBuffer', LazyOp] = {}
+        roots = {self.root}
+        for buf in reversed(order):
+            if buf not in roots:
+                continue
+            fuse = buf.op.op in ElementwiseOps or buf.op.op in ReduceOps
+            region = buf._row_region(index, consumers) if fuse and buf in row_reads else set()
+            kernels[buf] = buf._fused_op(lambda src: fusable(src, region)) if fuse else buf.op
+            roots.update(src.root for src in kernels[buf].buffers if src.root in in_graph)
 
         ret = []
-        for src in op.buffers:
-            ret += src.schedule()
-
-        ret.append(ScheduleItem(op, self, tuple(op.buffers)))
+        for buf in order:
+            if buf in kernels:
+                # fused kernels look their inputs up by identity, every other kernel takes its srcs positionally
+                srcs = kernels[buf].buffers
+                if kernels[buf].op in ElementwiseOps or kernels[buf].op in ReduceOps:
+                    srcs = tuple(dict.fromkeys(srcs))
+                ret.append(ScheduleItem(kernels[buf], buf, srcs))
+                seen.add(buf)
         return ret
 
+    def _toposort(self, seen: Set['LazyBuffer']) -> List['LazyBuffer']:
+        # iterative post order dfs, deep graphs would blow the recursion limit
+        order: List['LazyBuffer'] = []
+        visited: Set['LazyBuffer'] = set()
+        stack: List[Tuple['LazyBuffer', bool]] = [(self, False)]
+        while stack:
+            buf, done = stack.pop()
+            if done:
+                order.append(buf)
+                continue
+            if buf in visited:
+                continue
+            visited.add(buf)
+            stack.append((buf, True))
+            for src in reversed(buf.op.srcs):
+                if not src.is_realized and src not in seen and src not in visited:
+                    stack.append((src, False))
+        return order
+
+    def _is_fusable(self, reduce: bool = True) -> bool:
+        # a result read directly (not through a view) lives in the same index space
+        # as its consumer, so it can be computed inside the consumers loop
+        fusable = self.op.op in ElementwiseOps or (reduce and self.op.op in ReduceOps)
+        return not self.is_realized and fusable
+
+    def _fused_op(self, fusable: Callable[['LazyBuffer'], bool], reduce: bool = True, depth: int = 0) -> LazyOp:
+        # reductions are fused after elementwise ops, but never nested into the input of another reduction
+        reduce = reduce and self.op.op not in ReduceOps
+        # very long chains are split up, so neither the kernel nor the recursion here grows without bounds
+        fuse = depth < MAX_FUSE_DEPTH
+        srcs = tuple(src._fused_src(fusable, reduce, depth + 1) if fuse and fusable(src) else src._leaf()
+                     for src in self.op.srcs)
+        return LazyOp(self.op.op, srcs, self.op.arg)
+
+    def _fused_src(self, fusable: Callable[['LazyBuffer'], bool], reduce: bool, depth: int) -> Union['LazyBuffer', LazyOp]:
+        if self.is_view:
+            # a per row value broadcast along the last dim, the kernel computes it once per row
+            return LazyOp(MovementOps.EXPAND, (self.root._fused_op(fusable, True, depth),), (self.shape, self.root.shape))
+        return self._fused_op(fusable, reduce, depth) if self._is_fusable(reduce) else self._leaf()
+
+    def _row_region(self, index: Dict['LazyBuffer', int], consumers: Dict['LazyBuffer', Set['LazyBuffer']]) -> Set['LazyBuffer']:
+        """
+        Buffers the kernel of self computes row by row, the way softmax and layernorm
+        need it: elementwise ops over rows of shape[-1] elements and per row values
+        (reductions over the last dim and elementwise ops on them) that are broadcast
+        back along the rows. The per row values are computed once per row, before the
+        row is written, everything else is recomputed where it is read, so a buffer
+        only joins if all of its consumers do. Empty if nothing is broadcast.
+        index is the position of every buffer of the graph in topological order.
+        """
+        shape = self.op.srcs[0].shape if self.op.op in ReduceOps else self.shape
+        if len(shape) == 0 or (self.op.op in ReduceOps and self.op.arg != (len(shape) - 1,)):
+            return set()
+        rows = shape[:-1]
+        # per row values come with and without the kept dim
+        row_shapes = (rows, rows + (1,))
+
+        def per_element(buf: 'LazyBuffer') -> bool:
+            return buf.op.op in ElementwiseOps and buf.shape == shape
+
+        def per_row(buf: 'LazyBuffer') -> bool:
+            if buf.shape not in row_shapes:
+                return False
+            return buf.op.op in ElementwiseOps or (buf.op.op in ReduceOps and buf.op.arg == (len(shape) - 1,)
+                                                   and buf.op.srcs[0].shape == shape)
+
+        def row_view(buf: 'LazyBuffer', view: 'LazyBuffer') -> bool:
+            # a per row value read by buf, broadcast along the rows or with the kept dim added/removed
+            root = view.root
+            if root not in index or not per_row(root):
+                return False
+            st = ShapeTracker.from_shape(root.shape)
+            if per_element(buf):
+                return view.st == st.reshape(rows + (1,)).expand(shape)
+            return per_row(buf) and view.shape in row_shapes and view.st == st.reshape(view.shape)
+
+        region, stack = {self}, [self]
+        while stack:
+            buf = stack.pop()
+            for src in buf.op.srcs:
+                if src not in index or src in region:
+                    continue
+                if src.is_view:
+                    if not row_view(buf, src):
+                        continue
+                    view = src
+                    while view.is_view:
+                        region.add(view)
+                        view = view.op.srcs[0]
+                    src = view
+                elif not (per_element(src) or per_row(src)):
+                    continue
+                region.add(src)
+                stack.append(src)
+
+        # consumers come after their srcs in index, walking it backwards settles every consumer first
+        for buf in sorted(region - {self}, key=index.__getitem__, reverse=True):
+            if not consumers[buf] <= region:
+                region.discard(buf)
+        # views whose root left are read from memory
+        region -= {buf for buf in region if buf.is_view and buf.root not in region}
+        return region if any(buf.is_view for buf in region) else set()
+
+    def _leaf(self) -> Union['LazyBuffer', LazyOp]:
+        # constants are inlined into the kernel as literals, they need neither a kernel nor memory
+        value = const_value(self)
+        return self if value is None else LazyOp(LoadOps.CONST, (), (value, self.dtype, self.shape))
+
     @property
     def buffers(self):
         return (self,)
 
-    def movement(self, op: MovementOps, arg: Tuple[int, ...]):
-        if op is MovementOps.PERMUTE:
-            src = (self,)
-            lazy_op = LazyOp(op, src, arg) # type: ignore
-            new_shape = permute_shape(self.shape, arg)
-            return LazyBuffer(lazy_op, self.device, ShapeTracker.from_shape(new_shape))
-        new_shape = arg
-
-        if op is MovementOps.EXPAND:
-            assert len(self.shape) == len(new_shape), "Shapes must have the same number of dimensions for expand."
-            for x, y in zip(self.shape, new_shape):
-                assert x == y or x == 1, f"Shape of original buffer must be 1 at the expanded dimensions, not: {x}"
-            expand = tuple([(y // x) for x, y in zip(self.shape, new_shape)])
-            self.st._views.append(new_shape)
-            self.st._strides.append(expand)
-        else:
-            self.st._views.append(new_shape)
-            self.st._strides.append(tuple([1 for _ in new_shape]))
-        return self
+    def movement(self, op: MovementOps, arg: Tuple[Any, ...]):
+        # movement ops never touch memory, the result is a view with a new ShapeTracker on the same root
+        st = getattr(self.st, op.name.lower())(arg)
+        if st == self.st:
+            return self
+        lazy_op = LazyOp(op, (self,), arg) # type: ignore
+        return LazyCache.create(lazy_op, self.device, st, self.dtype)
 
     def permute(self, *args: int):
         assert len(self.shape) == len(args), "Length of shape needs to be same as permute inputs"
@@ -122,16 +329,146 @@ class LazyBuffer:
     def expand(self, *new_shape: int):
         return self.movement(MovementOps.EXPAND, tuple(new_shape))
 
-    # TODO: if we find elemwise, movement elemwise pattern
-    # we can push the movement op above the first elementwise op
+    def shrink(self, *arg: Tuple[int, int]):
+        # keeps [start, end) of every dimension
+        return self.movement(MovementOps.SHRINK, tuple(arg))
+
+    def pad(self, *arg: Tuple[int, int]):
+        # adds (before, after) zeros to every dimension, they are never stored, reads outside of the buffer give 0
+        return self.movement(MovementOps.PAD, tuple(arg))
+
+    def unfold(self, dim: int, size: int, step: int = 1):
+        # sliding windows along dim, (..., n, ...) -> (..., (n - size) // step + 1, size, ...),
+        # overlapping windows share memory
+        return self.movement(MovementOps.UNFOLD, (dim % len(self.shape), size, step))
+
+    def getitem(self, idx):
+        """
+        Basic numpy indexing with ints, slices with a positive step, None and Ellipsis.
+        The result is a view on the same memory, steps split the dimension into
+        (n, step) and keep the first column.
+        """
+        idx = idx if isinstance(idx, tuple) else (idx,)
+        for i in idx:
+            if not (i is None or i is Ellipsis or isinstance(i, (int, slice))) or isinstance(i, bool):
+                raise TypeError(f'Only ints, slices, None and Ellipsis can index a LazyBuffer, not {type(i).__name__}')
+        n_dims = len([i for i in idx if i is not None and i is not Ellipsis])
+        if n_dims > len(self.shape) or len([i for i in idx if i is Ellipsis]) > 1:
+            raise IndexError(f'Too many indices for shape {self.shape}: {idx}')
+        if Ellipsis not in idx:
+            idx = (*idx, Ellipsis)
+        ellipsis = idx.index(Ellipsis)
+        idx = (*idx[:ellipsis], *[slice(None)] * (len(self.shape) - n_dims), *idx[ellipsis + 1:])
+
+        shrink, pad, split, new_shape = [], [], [], []
+        for i, sh in zip([i for i in idx if i is not None], self.shape):
+            if isinstance(i, int):
+                if not -sh <= i < sh:
+                    raise IndexError(f'Index {i} is out of bounds for dimension of size {sh}')
+                start, n, step = i % sh, 1, 1
+            else:
+                start, stop, step = i.indices(sh)
+                if step <= 0:
+                    raise NotImplementedError('Only positive steps are supported')
+                n = len(range(start, stop, step))
+                step = step if n > 1 else 1
+            end = min(start + n * step, sh)
+            shrink.append((start, end))
+            pad.append((0, n * step - (end - start)))
+            split.append((n, step))
+        dims = iter(split)
+        for i in idx:
+            if i is None:
+                new_shape.append(1)
+                continue
+            n, _ = next(dims)
+            if isinstance(i, slice):
+                new_shape.append(n)
+
+        ret = self.shrink(*shrink).pad(*pad)
+        if any(step != 1 for _, step in split):
+            ret = ret.reshape(*[x for n, step in split for x in (n, step)])
+            ret = ret.shrink(*[r for n, _ in split for r in ((0, n), (0, 1))])
+        return ret.reshape(*new_shape)
+
+    def broadcast_to(self, *shape: int):
+        # numpy broadcasting, missing leading dimensions are added, dimensions of size 1 are expanded (stride 0)
+        assert len(shape) >= len(self.shape) and all(x == y or x == 1 for x, y in zip(self.shape[::-1], shape[::-1])), \
+            f'Shape {self.shape} can not be broadcast to {shape}'
+        return self.reshape(*[1] * (len(shape) - len(self.shape)), *self.shape).expand(*shape)
+
     def elementwise(self, op: Union[UnaryOps, BinaryOps, TernaryOps], *srcs):
         for src in srcs:
-            assert (
-                src.shape == self.shape
-            ), 'Shapes do not match, broadcasting not implemented yet.'
+            assert src.dtype == self.dtype, f'Dtypes do not match ({self.dtype}, {src.dtype}), cast one of them first.'
+        shape = broadcast_shape(self.shape, *[src.shape for src in srcs])
+        if shape != self.shape or any(src.shape != shape for src in srcs):
+            # broadcast inputs are views, the kernel reads them with stride 0 and nothing is materialized
+            return self.broadcast_to(*shape).elementwise(op, *[src.broadcast_to(*shape) for src in srcs])
+        folded = fold_elementwise(op, (self, *srcs))
+        if folded is not None:
+            return folded
+        if op in UnaryOps and self.op is not None and self.op.op is MovementOps.EXPAND:
+            # a unary op commutes with expand, so it runs once per element in memory
+            return self.op.srcs[0].elementwise(op).expand(*self.shape)
         srcs = (self,) + srcs
         lazy_op = LazyOp(op, srcs) # type: ignore
-        return LazyBuffer(lazy_op, self.device, self.st)
+        return LazyCache.create(lazy_op, self.device, ShapeTracker.from_shape(self.shape), self.dtype)
+
+    def cast(self, dtype: DType):
+        if dtype == self.dtype:
+            return self
+        folded = fold_cast(self, dtype)
+        if folded is not None:
+            return folded
+        if self.op is not None and self.op.op is MovementOps.EXPAND:
+            return self.op.srcs[0].cast(dtype).expand(*self.shape)
+        lazy_op = LazyOp(UnaryOps.CAST, (self,), dtype)
+        return LazyCache.create(lazy_op, self.device, ShapeTracker.from_shape(self.shape), dtype)
+
+    def contiguous(self):
+        # copies a view into memory of its own, laid out row major
+        if self.st.contiguous:
+            return self
+        lazy_op = LazyOp(UnaryOps.NOOP, (self,))
+        return LazyCache.create(lazy_op, self.device, ShapeTracker.from_shape(self.shape), self.dtype)
+
+    def assign(self, value: 'LazyBuffer') -> 'LazyBuffer':
+        """
+        value, computed into the memory of self instead of memory of its own
+        (once self is realized, until then it is a buffer like any other).
+        Afterwards self holds the new values as well.
+
+        The kernel writing value may read self elementwise, at the index it writes
+        to, any other read of self (through a view) would see elements that were
+        already overwritten. Such values get memory of their own.
+        """
+        assert value.shape == self.shape and value.dtype == self.dtype, \
+            f'Can not assign {value.shape} {value.dtype} to {self.shape} {self.dtype}'
+        if self.is_view or not self._reads_elementwise(value):
+            return value
+        # a node of its own, value itself may be shared with consumers that expect memory of its own
+        op = value.op if value.op.op in ElementwiseOps and not value.is_realized else LazyOp(UnaryOps.NOOP, (value,))
+        ret = LazyBuffer(op, value.device, ShapeTracker.from_shape(value.shape), dtype=value.dtype)
+        ret.assign_to = self
+        return ret
+
+    def _reads_elementwise(self, value: 'LazyBuffer') -> bool:
+        # True if no unrealized buffer in the graph of value reads self through a view
+        visited: Set['LazyBuffer'] = set()
+        stack = [value]
+        while stack:
+            buf = stack.pop()
+            if buf in visited or buf.op is None:
+                continue
+            visited.add(buf)
+            if buf.is_view and buf.root is self:
+                return False
+            if not buf.is_realized:
+                stack.extend(buf.op.srcs)
+        return True
+
+    def __neg__(self):
+        return self.elementwise(UnaryOps.NEG)
 
     def __mul__(self, other):
         return self.elementwise(BinaryOps.MUL, other)
@@ -157,11 +494,15 @@ class LazyBuffer:
 
     def dot(self, other):
         assert len(self.shape) >= 2 and len(other.shape) >= 2, "shapes must be at least 2d for matmul"
-        srcs = (self, ) + (other, )
+        assert self.dtype == other.dtype, f'Dtypes do not match ({self.dtype}, {other.dtype}), cast one of them first.'
+        # the matmul kernel walks self with plain strides, anything fancier is copied first.
+        # other is read through its ShapeTracker, any view of it (e.g. im2col windows) costs no copy
+        srcs = (self if len(self.st.views) == 1 and self.st.views[0].mask is None else self.contiguous(), other)
         shapes = tuple([s.shape for s in srcs])
         lazy_op = LazyOp(BinaryOps.MATMUL, srcs, arg=shapes)
-        new_shape = tuple([*self.shape[:-1], other.shape[-1]])
-        return LazyBuffer(lazy_op, self.device, ShapeTracker.from_shape(new_shape))
+        # the kernel writes (*rows, cols) with the columns of other flattened into one dim
+        new_shape = tuple([*self.shape[:-1], math.prod(other.shape[1:])])
+        return LazyCache.create(lazy_op, self.device, ShapeTracker.from_shape(new_shape), self.dtype)
 
     def matmul(self, other):
         res_shape = tuple([*self.shape[:-1], *other.shape[1:]])
@@ -169,25 +510,99 @@ class LazyBuffer:
         return dot.reshape(*res_shape)
 
 
-    def reduce(self, op: ReduceOps, dim: int = 0):
-        new_shape = tuple([size for i, size in enumerate(self.shape) if i != dim])
-        lazy_op = LazyOp(op, (self,), dim) # type: ignore
-        return LazyBuffer(lazy_op, self.device, ShapeTracker.from_shape(new_shape))
+    def reduce(self, op: ReduceOps, dim: Union[int, Tuple[int, ...]] = 0, keepdim: bool = False):
+        """
+        Reduces over one or several dimensions in a single kernel, keepdim keeps them
+        with size 1 (a reshape of the result, so it costs nothing).
+        """
+        dims = reduce_dims(self.shape, dim)
+        new_shape = tuple([size for i, size in enumerate(self.shape) if i not in dims])
+        ret = fold_reduce(op, self, dims, new_shape)
+        if ret is None:
+            lazy_op = LazyOp(op, (self,), dims) # type: ignore
+            ret = LazyCache.create(lazy_op, self.device, ShapeTracker.from_shape(new_shape), self.dtype)
+        return ret.reshape(*[1 if i in dims else size for i, size in enumerate(self.shape)]) if keepdim else ret
+
+    def sum(self, dim: Union[int, Tuple[int, ...]] = 0, keepdim: bool = False):
+        return self.reduce(ReduceOps.SUM, dim, keepdim)
 
-    def sum(self, dim: int = 0):
-        if dim < 0:
-            dim = len(self.shape) + dim
-        return self.reduce(ReduceOps.SUM, dim)
+    def max(self, dim: Union[int, Tuple[int, ...]] = 0, keepdim: bool = False):
+        return self.reduce(ReduceOps.MAX, dim, keepdim)
 
 
     # utility functions to make life easier
     @staticmethod
-    def rand(shape, device, seed=1):
+    def rand(shape, device, seed=1, dtype: DType = dtypes.float32):
+        assert dtype.is_float, f'rand fills buffers with floats in [0, 1], {dtype} is not a float type'
         lazy_op = LazyOp(LoadOps.RAND, (), arg=seed)
-        return LazyBuffer(lazy_op, device, ShapeTracker(shape))
+        return LazyCache.create(lazy_op, device, ShapeTracker.from_shape(shape), dtype)
+
+    @staticmethod
+    def from_buffer(buf, shape: Optional[Tuple[int, ...]] = None, device='CPU'):
+        """
+        Wraps the memory of a C contiguous buffer (e.g. a numpy array) without copying it,
+        the dtype follows from the format of the buffer.
+
+        The buffer is referenced, not owned, changes to it are visible to
+        every kernel that runs afterwards.
+        """
+        mv = memoryview(buf)
+        assert mv.c_contiguous, 'Only C contiguous buffers can be wrapped, copy it first (e.g. np.ascontiguousarray)'
+        dtype = dtypes.from_format(mv.format)
+        shape = tuple(mv.shape) if shape is None else tuple(shape)
+        size = mv.nbytes // mv.itemsize
+        assert math.prod(shape) == size, f'Shape {shape} does not match the {size} elements of the buffer'
+        if mv.readonly:
+            # kernels never write to their inputs, so read only memory is fine as well
+            assert hasattr(buf, '__array_interface__'), 'Read only buffers need to expose the array interface'
+            base = (dtype.ctype * size).from_address(buf.__array_interface__['data'][0])
+            base._source = buf
+        else:
+            base = (dtype.ctype * size).from_buffer(buf)
+        lazy_op = LazyOp(LoadOps.EXTERN, ())
+        return LazyBuffer(lazy_op, device, ShapeTracker.from_shape(shape), base=base, dtype=dtype)
 
     @staticmethod
-    def full(value, shape, device='CPU'):
+    def full(value, shape, device='CPU', dtype: DType = dtypes.float32):
         lazy_op = LazyOp(LoadOps.CONST, (), value)
         st = ShapeTracker.from_shape(shape)
-        return LazyBuffer(lazy_op, device, st)
+        return LazyCache.create(lazy_op, device, st, dtype)
+
+
+class _LazyCache:
+    """
+    Hash consing of LazyBuffers.
+
+    Every computed buffer is keyed by its op (which holds the identities of its
+    srcs), ShapeTracker, dtype and device, so building the same computation twice
+    returns the buffer built the first time and it is only computed once.
+    Only unrealized buffers are shared, a realized one could be stale (e.g. its
+    input was wrapped from a numpy array that changed since). Entries go away
+    together with their buffer.
+    hits counts the buffers that were shared instead of being computed again.
+    """
+    def __init__(self):
+        self._buffers: 'WeakValueDictionary[Tuple, LazyBuffer]' = WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def create(self, op: LazyOp, device: str, st: ShapeTracker, dtype: DType) -> LazyBuffer:
+        key = (op, device, st, dtype)
+        buf = self._buffers.get(key)
+        if buf is not None and not buf.is_realized:
+            self.hits += 1
+            return buf
+        self.misses += 1
+        buf = LazyBuffer(op, device, st, dtype=dtype)
+        self._buffers[key] = buf
+        return buf
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+
+LazyCache = _LazyCache()
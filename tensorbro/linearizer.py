@@ -1,22 +1,34 @@
 
-from typing import List, Callable, Union, Tuple, TYPE_CHECKING
+import ctypes as c
+import os
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Set, Tuple, TYPE_CHECKING
 from dataclasses import dataclass
 
 # TODO: This dependency sucks
-from .code_gen.clang import CProgram
+from .code_gen.clang import CBatchProgram, CProgram
 
 from .lazy import LazyOp
+from .planner import plan_memory
+from .runners.clang import CAllocator
 
 if TYPE_CHECKING:
     from .lazy import LazyBuffer
 
+COMPILE_WORKERS = int(os.environ.get('COMPILE_WORKERS', os.cpu_count() or 1))
+
+# kernels compile in the background, the compiler runs in a subprocess so threads are enough
+compile_pool = ThreadPoolExecutor(COMPILE_WORKERS, thread_name_prefix='tensorbro-compile')
+# runs are serialized on a single thread, the kernels themselves bring their own threads
+run_pool = ThreadPoolExecutor(1, thread_name_prefix='tensorbro-run')
 
 
 @dataclass(frozen=True)
 class ScheduleItem:
     op: LazyOp
     target: 'LazyBuffer'
-    srcs: Tuple[Union['LazyBuffer', LazyOp], ...]
+    srcs: Tuple['LazyBuffer', ...]
 
 
 def print_tree(si: ScheduleItem, depth=0):
@@ -35,11 +47,84 @@ def print_tree(si: ScheduleItem, depth=0):
         print('    ' * depth + str(type(si).__name__))
 
 
-def linearize(schedule: List[ScheduleItem]) -> Callable:
+class Runner:
+    """
+    Compiled schedule, calling it runs every kernel in order.
+
+    The kernels are compiled concurrently in the compile pool, a call only
+    waits for the kernel it is about to run. Intermediate buffers are placed in one arena according to a MemoryPlan,
+    they are released once the last kernel reading them ran and recomputed
+    if they are needed again later. Outputs and loaded buffers keep their own memory.
+    """
+    def __init__(self, schedule: List[ScheduleItem], outputs: Optional[Set['LazyBuffer']] = None):
+        self.schedule = schedule
+        self.plan = plan_memory(schedule, outputs)
+        self._programs: List['Future[CProgram]'] = [
+            compile_pool.submit(CProgram, si, aliased=si.target in self.plan.inplace) for si in schedule]
+
+    @property
+    def programs(self) -> List[CProgram]:
+        return [prg.result() for prg in self._programs]
+
+    def submit(self, callback: Optional[Callable[[], Any]] = None) -> Future:
+        """Runs in the background, the future resolves to the result of callback once every kernel ran."""
+        def run():
+            self()
+            return callback() if callback is not None else None
+        return run_pool.submit(run)
+
+    def __call__(self):
+        arena = CAllocator.alloc(c.c_char, self.plan.size) if self.plan.size > 0 else None
+        for i, (prg, si) in enumerate(zip(self._programs, self.schedule)):
+            target = si.target
+            if target in self.plan.offsets:
+                target.realize((target.dtype.ctype * target.buffer_size).from_buffer(arena, self.plan.offsets[target]))
+            elif not target.is_realized:
+                target.realize()
+            prg.result()(target.base, *[src.base for src in si.srcs])
+            for buf in self.plan.release[i]:
+                buf.release()
+        if arena is not None:
+            CAllocator.free(arena)
+
+
+class BatchRunner(Runner):
+    """
+    Runner that compiles the whole schedule into one shared object.
+
+    Intermediates are never handed to Python, the driver addresses them inside
+    the arena directly, so they stay unrealized after a run.
+    """
+    def __init__(self, schedule: List[ScheduleItem], outputs: Optional[Set['LazyBuffer']] = None):
+        self.schedule = schedule
+        self.plan = plan_memory(schedule, outputs)
+        self._program: 'Future[CBatchProgram]' = compile_pool.submit(CBatchProgram, schedule, self.plan)
+
+    @property
+    def program(self) -> CBatchProgram:
+        return self._program.result()
+
+    def __call__(self):
+        arena = CAllocator.alloc(c.c_char, self.plan.size) if self.plan.size > 0 else None
+        for buf in self.program.buffers:
+            if not buf.is_realized:
+                buf.realize()
+        bufs = (c.c_void_p * len(self.program.buffers))(*[c.addressof(buf.base) for buf in self.program.buffers])
+        self.program(arena, bufs)
+        if arena is not None:
+            CAllocator.free(arena)
+
+
+def linearize(schedule: List[ScheduleItem], outputs: Optional[Set['LazyBuffer']] = None, batch: bool = False) -> Runner:
     """
     Linearizes code from ast
 
-    Args: schedule
+    Args:
+        schedule: kernels to run, in order
+        outputs: buffers that have to survive the run, defaults to every
+            target that no later kernel reads
+        batch: compile all kernels into a single translation unit with one
+            driver function instead of one shared object per kernel
     returns: program that can be run
 
 
@@ -47,20 +132,8 @@ def linearize(schedule: List[ScheduleItem]) -> Callable:
     each essignment has:
         Source(s): ex. inp1, inp2
         Target: out
-        dtype: float32 (only support float32)
+        dtype: dtype of the target, inputs may differ if the kernel casts them
         programm: c code that takes the inputs and produces the output
     """
     # print(*schedule, sep='\n')
-    programms = []
-    # buffers = []
-    for s in schedule:
-        prg = CProgram(s)
-        programms.append(prg)
-
-    def runner():
-        for prg, s in zip(programms, schedule):
-            target = s.target
-            target.realize()
-            prg(target.base, *[src.base for src in s.srcs])
-
-    return runner
+    return BatchRunner(schedule, outputs) if batch else Runner(schedule, outputs)
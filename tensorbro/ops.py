@@ -1,3 +1,5 @@
+import math
+
 from dataclasses import dataclass
 from enum import Enum, auto
 
@@ -8,6 +10,7 @@ class LoadOps(Enum):
     EMPTY = auto()
     CONST = auto()
     RAND = auto()
+    EXTERN = auto()
 
 
 class UnaryOps(Enum):
@@ -16,6 +19,8 @@ class UnaryOps(Enum):
     SQRT = auto()
     EXP2 = auto()
     LOG2 = auto()
+    CAST = auto()
+    NOOP = auto()
 
 
 class BinaryOps(Enum):
@@ -24,6 +29,7 @@ class BinaryOps(Enum):
     SUB = auto()
     DIV = auto()
     MAX = auto()
+    CMPEQ = auto()
     MATMUL = auto()
 
 
@@ -42,7 +48,11 @@ class MovementOps(Enum):
     EXPAND = auto()
     PERMUTE = auto()
     PAD = auto()
+    SHRINK = auto()
+    UNFOLD = auto()
+
 
+ElementwiseOps = {*UnaryOps, *[op for op in BinaryOps if op is not BinaryOps.MATMUL]}
 
 Op = Union[UnaryOps, BinaryOps, ReduceOps, MovementOps, LoadOps, TernaryOps]
 OpType = Union[
@@ -65,30 +75,95 @@ class LazyOp:
     def buffers(self):
         return sum([s.buffers for s in self.srcs], ())
 
+def unbroadcast(grad, shape: Tuple[int, ...]):
+    # sums grad over the dimensions an input of shape was broadcast along
+    for _ in range(len(grad.shape) - len(shape)):
+        grad = grad.sum(0)
+    for dim, (g, sh) in enumerate(zip(grad.shape, shape)):
+        if sh == 1 and g != 1:
+            grad = grad.sum(dim).reshape(*shape[:dim + 1], *grad.shape[dim + 1:])
+    return grad
+
+def fold(grad, shape: Tuple[int, ...], arg: Tuple[int, int, int]):
+    """
+    Adjoint of unfold: sums the grad of every window element into the element of shape it was
+    read from. Position k of the windows is spread out step apart (a pad and a reshape) and
+    shifted by k, the size views are summed elementwise.
+    """
+    dim, size, step = arg
+    windows, ret = grad.shape[dim], None
+    for k in range(size):
+        g = grad.shrink(*[(k, k + 1) if d == dim + 1 else (0, sh) for d, sh in enumerate(grad.shape)])
+        g = g.pad(*[(0, step - 1) if d == dim + 1 else (0, 0) for d in range(len(g.shape))])
+        g = g.reshape(*shape[:dim], windows * step, *shape[dim + 1:])
+        g = g.pad(*[(k, max(shape[dim] - windows * step - k, 0)) if d == dim else (0, 0) for d in range(len(shape))])
+        g = g.shrink(*[(0, sh) for sh in shape])
+        ret = g if ret is None else ret + g
+    return ret
+
 class Mul(Context):
     def forward(self, x, y):
         self.x, self.y = x, y
         return x * y
 
     def backward(self, out_grad):
-        return self.y * out_grad, self.x * out_grad
+        return unbroadcast(self.y * out_grad, self.x.shape), unbroadcast(self.x * out_grad, self.y.shape)
 
     def __repr__(self):
         return f'Mul: x={self.x}, y={self.y}'
 
 class Add(Context):
     def forward(self, x, y):
+        self.x_shape, self.y_shape = x.shape, y.shape
         return x + y
 
     def backward(self, out_grad):
-        return out_grad, out_grad
+        return unbroadcast(out_grad, self.x_shape), unbroadcast(out_grad, self.y_shape)
 
 class Sub(Context):
     def forward(self, x, y):
+        self.x_shape, self.y_shape = x.shape, y.shape
         return x - y
 
     def backward(self, out_grad):
-        return out_grad, -out_grad
+        return unbroadcast(out_grad, self.x_shape), unbroadcast(-out_grad, self.y_shape)
+
+class Div(Context):
+    def forward(self, x, y):
+        self.x, self.y = x, y
+        return x.elementwise(BinaryOps.DIV, y)
+
+    def backward(self, out_grad):
+        x_grad = out_grad.elementwise(BinaryOps.DIV, self.y)
+        y_grad = -(x_grad * self.x).elementwise(BinaryOps.DIV, self.y)
+        return unbroadcast(x_grad, self.x.shape), unbroadcast(y_grad, self.y.shape)
+
+# exp and log in terms of the base 2 ops the kernels have
+LOG2_E = math.log2(math.e)
+
+class Exp(Context):
+    def forward(self, x):
+        self.out = (x * x.full(LOG2_E, x.shape, x.device, x.dtype)).elementwise(UnaryOps.EXP2)
+        return self.out
+
+    def backward(self, out_grad):
+        return (out_grad * self.out,)
+
+class Log(Context):
+    def forward(self, x):
+        self.x = x
+        return x.elementwise(UnaryOps.LOG2) * x.full(1 / LOG2_E, x.shape, x.device, x.dtype)
+
+    def backward(self, out_grad):
+        return (out_grad.elementwise(BinaryOps.DIV, self.x),)
+
+class Sqrt(Context):
+    def forward(self, x):
+        self.out = x.elementwise(UnaryOps.SQRT)
+        return self.out
+
+    def backward(self, out_grad):
+        return (out_grad.elementwise(BinaryOps.DIV, self.out * self.out.full(2, self.out.shape, self.out.device, self.out.dtype)),)
 
 class Matmul(Context):
     def forward(self, x, y):
@@ -96,7 +171,77 @@ class Matmul(Context):
         return x.matmul(y)
 
     def backward(self, out_grad):
-        return out_grad.matmul(self.y), self.x.matmul(out_grad)
+        # x is (*rows, k) and y is (k, *cols), both grads are 2d matmuls with a transposed (view) operand
+        k = self.x.shape[-1]
+        rows, cols = math.prod(self.x.shape[:-1]), math.prod(self.y.shape[1:])
+        grad = out_grad.reshape(rows, cols)
+        x_grad = grad.dot(self.y.reshape(k, cols).transpose(0, 1)).reshape(*self.x.shape)
+        y_grad = self.x.reshape(rows, k).transpose(0, 1).dot(grad).reshape(*self.y.shape)
+        return x_grad, y_grad
 
     def __repr__(self):
-        return f'Mul: x={self.x}, y={self.y}'
+        return f'Matmul: x={self.x}, y={self.y}'
+
+class Sum(Context):
+    def forward(self, x, dim: Union[int, Tuple[int, ...]] = 0, keepdim: bool = False):
+        from .lazy import reduce_dims
+        self.shape, self.dims = x.shape, reduce_dims(x.shape, dim)
+        return x.sum(self.dims, keepdim)
+
+    def backward(self, out_grad):
+        keepdim = tuple(1 if i in self.dims else sh for i, sh in enumerate(self.shape))
+        return (out_grad.reshape(*keepdim).expand(*self.shape),)
+
+class Max(Context):
+    def forward(self, x, dim: Union[int, Tuple[int, ...]] = 0, keepdim: bool = False):
+        from .lazy import reduce_dims
+        self.x, self.dims = x, reduce_dims(x.shape, dim)
+        self.max = x.max(self.dims, keepdim=True)
+        return self.max if keepdim else self.max.reshape(*[sh for i, sh in enumerate(x.shape) if i not in self.dims])
+
+    def backward(self, out_grad):
+        # the grad goes to the elements equal to the max, split evenly between ties
+        mask = self.x.elementwise(BinaryOps.CMPEQ, self.max)
+        grad = out_grad.reshape(*self.max.shape).elementwise(BinaryOps.DIV, mask.sum(self.dims, keepdim=True))
+        return (mask * grad,)
+
+class Cast(Context):
+    def forward(self, x, dtype):
+        self.dtype = x.dtype
+        return x.cast(dtype)
+
+    def backward(self, out_grad):
+        return (out_grad.cast(self.dtype),)
+
+class Movement(Context):
+    """
+    Any chain of movement ops, fn maps the input to a view of it (e.g. a slice).
+    The gradient walks the chain back to the input and undoes every op on the way,
+    so it is a view of out_grad as well, apart from the sums over expanded dimensions
+    and over overlapping windows.
+    """
+    def forward(self, x, fn):
+        self.x = x
+        self.out = fn(x)
+        return self.out
+
+    def backward(self, out_grad):
+        grad, buf = out_grad, self.out
+        while buf is not self.x:
+            op, src = buf.op, buf.op.srcs[0]
+            if op.op is MovementOps.RESHAPE:
+                grad = grad.reshape(*src.shape)
+            elif op.op is MovementOps.PERMUTE:
+                grad = grad.permute(*[op.arg.index(i) for i in range(len(op.arg))])
+            elif op.op is MovementOps.EXPAND:
+                for dim, (sh, new) in enumerate(zip(src.shape, op.arg)):
+                    if sh != new:
+                        grad = grad.sum(dim).reshape(*src.shape[:dim + 1], *grad.shape[dim + 1:])
+            elif op.op is MovementOps.SHRINK:
+                grad = grad.pad(*[(start, sh - end) for (start, end), sh in zip(op.arg, src.shape)])
+            elif op.op is MovementOps.PAD:
+                grad = grad.shrink(*[(before, before + sh) for (before, _), sh in zip(op.arg, src.shape)])
+            elif op.op is MovementOps.UNFOLD:
+                grad = fold(grad, src.shape, op.arg)
+            buf = src
+        return (grad,)
@@ -0,0 +1,114 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, TYPE_CHECKING
+
+from .ops import ElementwiseOps, LazyOp, LoadOps
+
+if TYPE_CHECKING:
+    from .lazy import LazyBuffer
+    from .linearizer import ScheduleItem
+
+ALIGNMENT = 64
+
+
+@dataclass
+class MemoryPlan:
+    """
+    Where the intermediate buffers of a schedule live.
+
+    offsets: byte offset of every intermediate in one shared arena
+    size: bytes the arena needs, the planned peak for intermediates
+    naive_size: bytes the intermediates would need without any reuse
+    inplace: targets that overwrite one of their own inputs (planned or assigned)
+    release: kernel index -> intermediates read for the last time by it
+    """
+    offsets: Dict['LazyBuffer', int] = field(default_factory=dict)
+    size: int = 0
+    naive_size: int = 0
+    inplace: Set['LazyBuffer'] = field(default_factory=set)
+    release: Dict[int, List['LazyBuffer']] = field(default_factory=lambda: defaultdict(list))
+
+    def __repr__(self):
+        return (f'<MemoryPlan: {len(self.offsets)} intermediates, planned peak={self.size} bytes, '
+                f'without reuse={self.naive_size} bytes, inplace={len(self.inplace)}>')
+
+
+def _nbytes(buf: 'LazyBuffer') -> int:
+    nbytes = buf.buffer_size * buf.dtype.itemsize
+    return (nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _can_overwrite(si: 'ScheduleItem', src: 'LazyBuffer') -> bool:
+    # a flat elementwise kernel reads every input element exactly once, at the same
+    # index it writes the output to, so the output can go over the input
+    if any(op not in ElementwiseOps for op in _ops(si.op)):
+        return False
+    return (all(s.st.contiguous for s in si.srcs) and src.buffer_size == si.target.buffer_size
+            and src.dtype == si.target.dtype)
+
+
+def _ops(ast: LazyOp):
+    yield ast.op
+    for src in ast.srcs:
+        if isinstance(src, LazyOp):
+            yield from _ops(src)
+
+
+def plan_memory(schedule: List['ScheduleItem'], outputs: Optional[Set['LazyBuffer']] = None) -> MemoryPlan:
+    """
+    Assigns every intermediate of schedule to an offset in a single arena.
+
+    Intermediates are targets that a later kernel reads and that are neither
+    outputs nor loaded inputs. Each lives from the kernel writing it to the last
+    kernel reading it, buffers whose lifetimes don't overlap share memory, and an
+    elementwise kernel reuses the memory of an input that dies with it.
+    """
+    plan = MemoryPlan()
+    last_use: Dict['LazyBuffer', int] = {}
+    for i, si in enumerate(schedule):
+        for src in si.srcs:
+            # a view keeps the memory of its root alive
+            last_use[src.root] = i
+    outputs = {si.target for si in schedule if si.target not in last_use} if outputs is None else {out.root for out in outputs}
+
+    # every slot is a piece of memory with a lifetime, inplace targets join their input's slot
+    slot_of: Dict['LazyBuffer', int] = {}
+    slots: List[List[int]] = []  # [size, start, end]
+    for i, si in enumerate(schedule):
+        target = si.target
+        if target.assign_to is not None:
+            # writes into the memory of the buffer it is assigned to, reading that one elementwise
+            if any(src.root is target.assign_to for src in si.srcs):
+                plan.inplace.add(target)
+            continue
+        if target not in last_use or target in outputs or target.op.op in LoadOps:
+            continue
+        plan.release[last_use[target]].append(target)
+        plan.naive_size += _nbytes(target)
+        dying = [src.root for src in si.srcs if src.root in slot_of and last_use[src.root] == i and _can_overwrite(si, src)]
+        if dying:
+            slot_of[target] = slot_of[dying[0]]
+            slots[slot_of[target]][2] = last_use[target]
+            plan.inplace.add(target)
+        else:
+            slot_of[target] = len(slots)
+            slots.append([_nbytes(target), i, last_use[target]])
+
+    # greedy first fit, biggest slots first, against every placed slot alive at the same time
+    placed: List[List[int]] = []  # [offset, size, start, end]
+    slot_offsets: Dict[int, int] = {}
+    for idx in sorted(range(len(slots)), key=lambda k: -slots[k][0]):
+        size, start, end = slots[idx]
+        offset = 0
+        for o, sz, s, e in sorted(placed):
+            if s > end or e < start:
+                continue
+            if offset + size <= o:
+                break
+            offset = max(offset, o + sz)
+        placed.append([offset, size, start, end])
+        slot_offsets[idx] = offset
+        plan.size = max(plan.size, offset + size)
+
+    plan.offsets = {buf: slot_offsets[slot] for buf, slot in slot_of.items()}
+    return plan
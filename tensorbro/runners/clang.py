@@ -1,13 +1,252 @@
 import ctypes as c
+import ctypes.util
+import functools
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+import weakref
+
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+CACHE_DIR = Path(os.environ.get('CACHE_DIR', Path.home() / '.cache' / 'tensorbro'))
+CACHE_SIZE = int(os.environ.get('CACHE_SIZE', 256 * 1024 * 1024))
+COMPILER = 'clang'
+# clang: compile into the shared on disk cache
+# memfd: compile into an anonymous in memory file, nothing touches the file system
+# tcc: compile in process with libtcc, fast compiles but slow kernels and no OpenMP
+COMPILERS = ('clang', 'memfd', 'tcc')
 
 
 class _CAllocator:
+    """
+    Caching allocator for kernel buffers.
+
+    Memory is handed out in size classes (a quarter of a power of two apart) and
+    goes back into a pool once the array is freed or garbage collected, so
+    repeatedly running the same graph settles at zero new allocations.
+    Reused memory is not zeroed, kernels overwrite their whole output.
+    """
+    alignment: int = 64
+
+    def __init__(self):
+        self._pool: Dict[int, List[c.Array]] = defaultdict(list)
+        self._finalizers: Dict[int, weakref.finalize] = {}
+        self.live = 0
+        self.peak = 0
+        self.allocs = 0
+        self.reuses = 0
+
+    @staticmethod
+    def bucket(nbytes: int) -> int:
+        if nbytes <= 64:
+            return 64
+        step = (1 << (nbytes - 1).bit_length()) // 8
+        return (nbytes + step - 1) // step * step
+
+    def alloc(self, dtype, size):
+        bucket = self.bucket(size * c.sizeof(dtype))
+        if self._pool[bucket]:
+            raw = self._pool[bucket].pop()
+            self.reuses += 1
+        else:
+            # over allocate and hand out the part starting at the first aligned
+            # address, so vector loads/stores never split a cache line
+            raw = (c.c_char * (bucket + self.alignment))()
+            self.allocs += 1
+        offset = -c.addressof(raw) % self.alignment
+        buf = (dtype * size).from_buffer(raw, offset)
+        self._finalizers[c.addressof(buf)] = weakref.finalize(buf, self._release, c.addressof(buf), raw, bucket)
+        self.live += bucket
+        self.peak = max(self.peak, self.live)
+        return buf
+
+    def free(self, buf):
+        # the caller promises that buf is not used anymore, its memory is reused right away
+        finalizer = self._finalizers.get(c.addressof(buf))
+        # views into an allocation (e.g. a planned arena) share its address but don't own it
+        if finalizer is not None and finalizer.alive and finalizer.peek()[0] is buf:
+            finalizer()
+
+    def _release(self, addr: int, raw, bucket: int):
+        self._finalizers.pop(addr, None)
+        self._pool[bucket].append(raw)
+        self.live -= bucket
+
+    @property
+    def cached(self) -> int:
+        return sum(bucket * len(raws) for bucket, raws in self._pool.items())
+
+    def clear(self):
+        # drop all cached memory, buffers in use are not affected
+        self._pool.clear()
+
+    def reset_stats(self):
+        self.peak = self.live
+        self.allocs = 0
+        self.reuses = 0
+
+
+class _KernelCache:
+    """
+    Content addressed cache for compiled kernels.
+
+    Shared objects are keyed by a hash of the compiler, its flags and the
+    generated C source, so two kernels only share a binary if they are
+    really the same. Loaded libraries are kept in memory, the binaries on disk
+    are evicted least recently used first once the cache grows over max_size bytes.
+    Loading is thread safe, concurrent loads of the same source compile it once.
+    """
+    def __init__(self, cache_dir: Union[str, Path] = CACHE_DIR, max_size: int = CACHE_SIZE):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self._libs: Dict[str, Union[c.CDLL, '_TCCLibrary']] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
     @staticmethod
-    def alloc(dtype, size):
-        return (dtype * size)()
+    def key(src: str, flags: List[str], compiler: str = COMPILER) -> str:
+        h = hashlib.sha256()
+        h.update(' '.join([compiler, *flags]).encode())
+        h.update(b'\0')
+        h.update(src.encode())
+        return h.hexdigest()
+
+    def load(self, src: str, flags: List[str], compiler: str = COMPILER) -> Union[c.CDLL, '_TCCLibrary']:
+        if compiler not in COMPILERS:
+            raise ValueError(f'Unknown compiler {compiler}, expected one of {COMPILERS}')
+        key = self.key(src, flags, compiler)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            return self._load(key, src, flags, compiler)
+
+    def _load(self, key: str, src: str, flags: List[str], compiler: str) -> Union[c.CDLL, '_TCCLibrary']:
+        if key in self._libs:
+            self.hits += 1
+            return self._libs[key]
+        if compiler != 'clang':
+            # in memory backends only cache within the process
+            self.misses += 1
+            lib = _compile_memfd(src, flags) if compiler == 'memfd' else _TCCLibrary(src)
+            self._libs[key] = lib
+            return lib
+
+        path = self.cache_dir / f'{key}.so'
+        if path.exists():
+            self.hits += 1
+            # bump mtime, it is what the LRU eviction orders by
+            os.utime(path)
+        else:
+            self.misses += 1
+            self._compile(src, flags, path)
+            self._evict(keep=path)
+
+        lib = c.CDLL(str(path))
+        self._libs[key] = lib
+        return lib
+
+    def _compile(self, src: str, flags: List[str], path: Path) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # the source goes in over stdin, the binary into a private temporary that is
+        # renamed into place, so concurrent processes never see (or load) a half written shared object
+        fd, tmp_name = tempfile.mkstemp(suffix='.so', dir=self.cache_dir)
+        os.close(fd)
+        tmp_out = Path(tmp_name)
+        try:
+            subprocess.run([COMPILER, '-shared', *flags, '-x', 'c', '-', '-o', tmp_out], input=src.encode(), check=True)
+            os.replace(tmp_out, path)
+        finally:
+            if tmp_out.exists():
+                os.unlink(tmp_out)
+
+    def _evict(self, keep: Optional[Path] = None) -> None:
+        entries = []
+        for p in self.cache_dir.glob('*.so'):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if total <= self.max_size:
+                break
+            if p == keep:
+                continue
+            try:
+                os.unlink(p)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self) -> None:
+        self._libs.clear()
+        for p in self.cache_dir.glob('*.so'):
+            os.unlink(p)
+
+
+def _compile_memfd(src: str, flags: List[str]) -> c.CDLL:
+    # the compiler inherits the memfd and writes the shared object straight into it,
+    # the descriptor stays open for as long as the process, dlopen needs a path to it
+    fd = os.memfd_create('tensorbro_kernel')
+    path = f'/proc/self/fd/{fd}'
+    subprocess.run([COMPILER, '-shared', *flags, '-x', 'c', '-', '-o', path], input=src.encode(), pass_fds=(fd,), check=True)
+    return c.CDLL(path)
+
+
+@functools.lru_cache(maxsize=None)
+def _libtcc() -> c.CDLL:
+    path = os.environ.get('LIBTCC') or ctypes.util.find_library('tcc')
+    if path is None:
+        raise RuntimeError('The tcc compiler needs libtcc, install it or point LIBTCC at libtcc.so')
+    lib = c.CDLL(path)
+    lib.tcc_new.restype = c.c_void_p
+    lib.tcc_delete.argtypes = [c.c_void_p]
+    lib.tcc_set_output_type.argtypes = [c.c_void_p, c.c_int]
+    lib.tcc_add_library.argtypes = [c.c_void_p, c.c_char_p]
+    lib.tcc_compile_string.argtypes = [c.c_void_p, c.c_char_p]
+    lib.tcc_get_symbol.argtypes = [c.c_void_p, c.c_char_p]
+    lib.tcc_get_symbol.restype = c.c_void_p
+    return lib
+
+
+class _TCCLibrary:
+    """
+    Kernels compiled in memory by libtcc, functions are looked up like on a CDLL.
+
+    Compiler flags are ignored, tcc doesn't optimize and has no OpenMP.
+    """
+    TCC_OUTPUT_MEMORY = 1
+    TCC_RELOCATE_AUTO = c.c_void_p(1)
+
+    def __init__(self, src: str):
+        self._tcc = _libtcc()
+        self._state = self._tcc.tcc_new()
+        self._tcc.tcc_set_output_type(self._state, self.TCC_OUTPUT_MEMORY)
+        self._tcc.tcc_add_library(self._state, b'm')
+        if self._tcc.tcc_compile_string(self._state, src.encode()) == -1:
+            raise RuntimeError('tcc failed to compile kernel')
+        # newer versions of tcc_relocate only take the state, the extra argument is ignored there
+        if self._tcc.tcc_relocate(c.c_void_p(self._state), self.TCC_RELOCATE_AUTO) == -1:
+            raise RuntimeError('tcc failed to relocate kernel')
+
+    def __getitem__(self, name: str):
+        addr = self._tcc.tcc_get_symbol(self._state, name.encode())
+        if addr is None:
+            raise KeyError(name)
+        return c.CFUNCTYPE(None)(addr)
 
-    def free(self, pointer):
-        c.free(pointer)
+    def __del__(self):
+        if getattr(self, '_state', None):
+            self._tcc.tcc_delete(self._state)
 
 
 CAllocator = _CAllocator()
+KernelCache = _KernelCache()
@@ -0,0 +1,283 @@
+import math
+
+from dataclasses import dataclass, replace
+from typing import List, Optional, Sequence, Tuple
+
+# per dimension [start, end) range of indices that are backed by memory, everything outside reads as 0
+Mask = Tuple[Tuple[int, int], ...]
+
+
+def strides_for_shape(shape: Tuple[int, ...]) -> Tuple[int, ...]:
+    # row major strides, dimensions of size 1 get stride 0 so equal views compare equal
+    strides, acc = [], 1
+    for sh in reversed(shape):
+        strides.append(acc if sh != 1 else 0)
+        acc *= sh
+    return tuple(reversed(strides))
+
+
+def _reshape_strides(shape: Tuple[int, ...], strides: Tuple[int, ...], new_shape: Tuple[int, ...]) -> Optional[Tuple[int, ...]]:
+    """
+    Strides that walk the same memory in new_shape, None if there are none.
+    Groups of dimensions are merged or split like numpy does it without a copy,
+    which only works for groups that are contiguous among themselves.
+    """
+    old = [(sh, st) for sh, st in zip(shape, strides) if sh != 1]
+    new_strides = [0] * len(new_shape)
+    oi, ni = 0, 0
+    while oi < len(old) and ni < len(new_shape):
+        oj, nj = oi + 1, ni + 1
+        o_size, n_size = old[oi][0], new_shape[ni]
+        while o_size != n_size:
+            if n_size < o_size:
+                n_size *= new_shape[nj]
+                nj += 1
+            else:
+                o_size *= old[oj][0]
+                oj += 1
+        if any(old[k][1] != old[k + 1][0] * old[k + 1][1] for k in range(oi, oj - 1)):
+            return None
+        acc = old[oj - 1][1]
+        for k in reversed(range(ni, nj)):
+            new_strides[k] = acc if new_shape[k] != 1 else 0
+            acc *= new_shape[k]
+        oi, ni = oj, nj
+    return tuple(new_strides)
+
+
+def unravel(flat: str, shape: Tuple[int, ...]) -> List[str]:
+    # index expressions of every dimension of shape for a row major position flat
+    idxs, inner = [], 1
+    for d in reversed(range(len(shape))):
+        if shape[d] == 1:
+            idxs.append('0')
+        else:
+            idx = flat if inner == 1 else f'({flat}) / {inner}'
+            idxs.append(f'({idx}) % {shape[d]}' if d > 0 and math.prod(shape[:d]) > 1 else f'({idx})')
+        inner *= shape[d]
+    return list(reversed(idxs))
+
+
+def _split(view: 'View', idxs: Sequence[str], shape: Tuple[int, ...]) -> Optional[List[str]]:
+    """
+    Index expressions of every dimension of shape for the row major position that element
+    idxs of view points to, without the divisions of unravel. Every term of view is added
+    to the dimension its stride is a multiple of, which only works if no dimension
+    can overflow into the next one, None otherwise.
+    """
+    if view.offset < 0:
+        return None
+    dims = [d for d in range(len(shape)) if shape[d] != 1]
+    row_strides = strides_for_shape(shape)
+    terms: List[List[str]] = [[] for _ in shape]
+    highest = [0] * len(shape)
+    rest = view.offset
+    for d in dims:
+        highest[d], rest = divmod(rest, row_strides[d])
+        if highest[d]:
+            terms[d].append(str(highest[d]))
+    for idx, sh, st in zip(idxs, view.shape, view.strides):
+        if st == 0 or sh == 1:
+            continue
+        d = next((d for d in dims if st % row_strides[d] == 0), None)
+        if d is None:
+            return None
+        scale = st // row_strides[d]
+        terms[d].append(f'{idx} * {scale}' if scale != 1 else idx)
+        highest[d] += (sh - 1) * scale
+    if rest != 0 or any(high >= sh for high, sh in zip(highest, shape)):
+        return None
+    return [('(' + ' + '.join(t) + ')' if len(t) > 1 else t[0]) if t else '0' for t in terms]
+
+
+@dataclass(frozen=True)
+class View:
+    """
+    How a shape is laid out in memory.
+
+    Element idx lives at offset + sum(idx * strides), expanded dimensions have
+    stride 0. Indices outside of mask (padding) are not backed by memory and read as 0.
+    """
+    shape: Tuple[int, ...]
+    strides: Tuple[int, ...]
+    offset: int = 0
+    mask: Optional[Mask] = None
+
+    @staticmethod
+    def create(shape: Tuple[int, ...], strides: Optional[Tuple[int, ...]] = None, offset: int = 0, mask: Optional[Mask] = None) -> 'View':
+        shape = tuple(shape)
+        strides = strides_for_shape(shape) if strides is None else tuple(st if sh != 1 else 0 for sh, st in zip(shape, strides))
+        if mask is not None and all(m == (0, sh) for m, sh in zip(mask, shape)):
+            mask = None
+        return View(shape, strides, offset, mask)
+
+    @property
+    def contiguous(self) -> bool:
+        return self.offset == 0 and self.mask is None and self.strides == strides_for_shape(self.shape)
+
+    def reshape(self, new_shape: Tuple[int, ...]) -> Optional['View']:
+        if new_shape == self.shape:
+            return self
+        if self.mask is not None:
+            # only dimensions of size 1 can be added or removed without untangling the mask
+            if [sh for sh in self.shape if sh != 1] != [sh for sh in new_shape if sh != 1]:
+                return None
+            mask = iter([m for m, sh in zip(self.mask, self.shape) if sh != 1])
+            new_mask = tuple(next(mask) if sh != 1 else (0, 1) for sh in new_shape)
+            if any(m[1] - m[0] < 1 for m, sh in zip(self.mask, self.shape) if sh == 1):
+                return None
+            return View.create(new_shape, _reshape_strides(self.shape, self.strides, new_shape), self.offset, new_mask)
+        strides = _reshape_strides(self.shape, self.strides, new_shape)
+        return None if strides is None else View.create(new_shape, strides, self.offset)
+
+    def permute(self, order: Tuple[int, ...]) -> 'View':
+        mask = tuple(self.mask[i] for i in order) if self.mask is not None else None
+        return View.create(tuple(self.shape[i] for i in order), tuple(self.strides[i] for i in order), self.offset, mask)
+
+    def expand(self, new_shape: Tuple[int, ...]) -> 'View':
+        mask = None
+        if self.mask is not None:
+            # an empty range (lo >= hi, e.g. a shrink into the padding) stays empty
+            mask = tuple(m if sh == new else ((0, new) if m[0] < m[1] else (0, 0)) for m, sh, new in zip(self.mask, self.shape, new_shape))
+        return View.create(new_shape, tuple(st if sh == new else 0 for st, sh, new in zip(self.strides, self.shape, new_shape)),
+                           self.offset, mask)
+
+    def shrink(self, arg: Tuple[Tuple[int, int], ...]) -> 'View':
+        offset = self.offset + sum(start * st for (start, _), st in zip(arg, self.strides))
+        mask = None
+        if self.mask is not None:
+            mask = tuple((max(lo - start, 0), min(hi - start, end - start)) for (lo, hi), (start, end) in zip(self.mask, arg))
+            mask = tuple(m if m[0] < m[1] else (0, 0) for m in mask)
+        return View.create(tuple(end - start for start, end in arg), self.strides, offset, mask)
+
+    def pad(self, arg: Tuple[Tuple[int, int], ...]) -> 'View':
+        offset = self.offset - sum(before * st for (before, _), st in zip(arg, self.strides))
+        mask = self.mask if self.mask is not None else tuple((0, sh) for sh in self.shape)
+        mask = tuple((lo + before, hi + before) for (lo, hi), (before, _) in zip(mask, arg))
+        return View.create(tuple(sh + before + after for sh, (before, after) in zip(self.shape, arg)), self.strides, offset, mask)
+
+    def unfold(self, dim: int, size: int, step: int) -> Optional['View']:
+        # dim becomes (windows, size), windows overlap if step < size, None if dim is padded
+        if self.mask is not None and self.mask[dim] != (0, self.shape[dim]):
+            return None
+        windows = (self.shape[dim] - size) // step + 1
+        shape = (*self.shape[:dim], windows, size, *self.shape[dim + 1:])
+        strides = (*self.strides[:dim], self.strides[dim] * step, self.strides[dim], *self.strides[dim + 1:])
+        mask = (*self.mask[:dim], (0, windows), (0, size), *self.mask[dim + 1:]) if self.mask is not None else None
+        return View.create(shape, strides, self.offset, mask)
+
+    def expr(self, idxs: Sequence[str]) -> Tuple[str, Optional[str]]:
+        """C expressions for the memory offset of element idxs and for whether it is backed by memory."""
+        terms = [f'{idx} * {st}' if st != 1 else idx for idx, st, sh in zip(idxs, self.strides, self.shape) if st != 0 and sh != 1]
+        if self.offset != 0 or not terms:
+            terms.append(str(self.offset))
+        valid = None
+        if self.mask is not None:
+            conds = []
+            for idx, (lo, hi), sh in zip(idxs, self.mask, self.shape):
+                if lo >= hi:
+                    return '0', '0'
+                if lo > 0:
+                    conds.append(f'{idx} >= {lo}')
+                if hi < sh:
+                    conds.append(f'{idx} < {hi}')
+            valid = ' && '.join(f'({cond})' for cond in conds) if conds else None
+        return ' + '.join(terms), valid
+
+
+@dataclass(frozen=True)
+class ShapeTracker:
+    """
+    A stack of views, views[-1] has the shape that is seen from the outside, views[0]
+    the layout in memory. Every view indexes the row major layout of the one before it,
+    a new view is only pushed for reshapes that can't be expressed on the current one.
+    Movement ops never move data, they return a new ShapeTracker.
+    """
+    views: Tuple[View, ...]
+
+    @staticmethod
+    def from_shape(shape: Tuple[int, ...]) -> 'ShapeTracker':
+        return ShapeTracker((View.create(tuple(shape)),))
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.views[-1].shape
+
+    @property
+    def size(self) -> int:
+        return math.prod(self.shape)
+
+    @property
+    def contiguous(self) -> bool:
+        return len(self.views) == 1 and self.views[0].contiguous
+
+    def __repr__(self):
+        return f'<ST: {self.views}>'
+
+    def _replace_last(self, view: View) -> 'ShapeTracker':
+        return ShapeTracker((*self.views[:-1], view)).simplify()
+
+    def simplify(self) -> 'ShapeTracker':
+        # a view on top of a contiguous one can address memory directly
+        if len(self.views) >= 2 and self.views[-2].contiguous:
+            return ShapeTracker((*self.views[:-2], self.views[-1])).simplify()
+        if len(self.views) >= 2 and self.views[-2].mask is None and strides_for_shape(self.views[-2].shape) == self.views[-2].strides:
+            # contiguous up to an offset
+            return ShapeTracker((*self.views[:-2], replace(self.views[-1], offset=self.views[-1].offset + self.views[-2].offset))).simplify()
+        return self
+
+    def reshape(self, new_shape: Tuple[int, ...]) -> 'ShapeTracker':
+        assert math.prod(new_shape) == self.size, f'Can not reshape {self.shape} to {new_shape}'
+        view = self.views[-1].reshape(tuple(new_shape))
+        if view is not None:
+            return self._replace_last(view)
+        return ShapeTracker((*self.views, View.create(tuple(new_shape))))
+
+    def permute(self, order: Tuple[int, ...]) -> 'ShapeTracker':
+        assert sorted(order) == list(range(len(self.shape))), f'Invalid permutation {order} for shape {self.shape}'
+        return self._replace_last(self.views[-1].permute(order))
+
+    def expand(self, new_shape: Tuple[int, ...]) -> 'ShapeTracker':
+        assert len(self.shape) == len(new_shape), "Shapes must have the same number of dimensions for expand."
+        for x, y in zip(self.shape, new_shape):
+            assert x == y or x == 1, f"Shape of original buffer must be 1 at the expanded dimensions, not: {x}"
+        return self._replace_last(self.views[-1].expand(tuple(new_shape)))
+
+    def shrink(self, arg: Tuple[Tuple[int, int], ...]) -> 'ShapeTracker':
+        assert len(arg) == len(self.shape) and all(0 <= s <= e <= sh for (s, e), sh in zip(arg, self.shape)), \
+            f'Invalid shrink {arg} for shape {self.shape}'
+        return self._replace_last(self.views[-1].shrink(arg))
+
+    def pad(self, arg: Tuple[Tuple[int, int], ...]) -> 'ShapeTracker':
+        assert len(arg) == len(self.shape) and all(b >= 0 and a >= 0 for b, a in arg), f'Invalid pad {arg} for shape {self.shape}'
+        return self._replace_last(self.views[-1].pad(arg))
+
+    def unfold(self, arg: Tuple[int, int, int]) -> 'ShapeTracker':
+        """
+        Sliding windows of size along dim, step apart (like numpy's sliding_window_view).
+        dim is replaced by (windows, size), the windows are strides on the same memory.
+        """
+        dim, size, step = arg
+        assert 0 <= dim < len(self.shape) and 0 < size <= self.shape[dim] and step > 0, \
+            f'Invalid unfold {arg} for shape {self.shape}'
+        view = self.views[-1].unfold(dim, size, step)
+        if view is not None:
+            return self._replace_last(view)
+        # windows over padding index the padded shape, the mask stays with the view below
+        return ShapeTracker((*self.views, View.create(self.shape).unfold(dim, size, step)))  # type: ignore
+
+    def expr(self, idxs: Sequence[str]) -> Tuple[str, Optional[str]]:
+        """
+        C expressions for the memory offset of element idxs of self.shape and for
+        whether it is backed by memory at all, the latter is None if it always is.
+        """
+        valids = []
+        idx, valid = self.views[-1].expr(idxs)
+        valids.append(valid)
+        for above, view in zip(reversed(self.views[1:]), reversed(self.views[:-1])):
+            split = _split(above, idxs, view.shape)
+            idxs = split if split is not None else unravel(idx, view.shape)
+            idx, valid = view.expr(idxs)
+            valids.append(valid)
+        valids = [v for v in valids if v is not None]
+        return idx, ' && '.join(valids) if valids else None
@@ -0,0 +1,104 @@
+import math
+import operator
+
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from .dtypes import DType
+from .ops import BinaryOps, LoadOps, ReduceOps, UnaryOps
+
+if TYPE_CHECKING:
+    from .lazy import LazyBuffer
+
+# Rewrites applied while the graph is built, before anything is scheduled. Ops on
+# constants are computed right away, identities (x * 1, x + 0, neg(neg(x)), ...) return
+# their input, so neither costs a kernel nor a buffer.
+# Floats are simplified like -ffast-math would: x - x is 0 and exp2(log2(x)) is x,
+# even for inf and nan.
+
+fold_ops: Dict[Any, Callable[..., Any]] = {
+    UnaryOps.NEG: operator.neg,
+    UnaryOps.SIN: math.sin,
+    UnaryOps.SQRT: math.sqrt,
+    UnaryOps.EXP2: lambda x: 2.0 ** x,
+    UnaryOps.LOG2: math.log2,
+    UnaryOps.NOOP: lambda x: x,
+    BinaryOps.ADD: operator.add,
+    BinaryOps.SUB: operator.sub,
+    BinaryOps.MUL: operator.mul,
+    BinaryOps.DIV: operator.truediv,
+    BinaryOps.MAX: max,
+    BinaryOps.CMPEQ: operator.eq,
+}
+
+# (inner, outer) unary ops that cancel each other, the bool tells if that holds for integers as well
+inverses: Dict[Tuple[UnaryOps, UnaryOps], bool] = {
+    (UnaryOps.NEG, UnaryOps.NEG): True,
+    (UnaryOps.LOG2, UnaryOps.EXP2): False,
+    (UnaryOps.EXP2, UnaryOps.LOG2): False,
+}
+
+
+def const_value(buf: 'LazyBuffer') -> Optional[Any]:
+    # the value of a buffer that holds the same constant everywhere, None for any other buffer
+    root = buf.root
+    if root.op is None or root.op.op is not LoadOps.CONST or any(view.mask is not None for view in buf.st.views):
+        return None
+    return root.op.arg
+
+
+def as_dtype(value: Any, dtype: DType) -> Any:
+    # value as it ends up in a buffer of dtype, integers wrap around like they do in C
+    if dtype.is_float:
+        return float(value)
+    bits = 8 * dtype.itemsize
+    return (int(value) + (1 << bits - 1)) % (1 << bits) - (1 << bits - 1)
+
+
+def _full(like: 'LazyBuffer', value: Any, shape: Tuple[int, ...], dtype: DType) -> 'LazyBuffer':
+    return like.full(value, shape, like.device, dtype)
+
+
+def fold_elementwise(op: Any, srcs: Sequence['LazyBuffer']) -> Optional['LazyBuffer']:
+    """
+    Simplified result of op on srcs (all of the same shape and dtype), None if there is nothing to simplify.
+    """
+    if op not in fold_ops:
+        return None
+    x = srcs[0]
+    values = [const_value(src) for src in srcs]
+    if all(value is not None for value in values):
+        try:
+            return _full(x, as_dtype(fold_ops[op](*values), x.dtype), x.shape, x.dtype)
+        except (ArithmeticError, ValueError):
+            # inf and nan are left to the kernel
+            return None
+    if op in UnaryOps:
+        if x.op is not None and (x.op.op, op) in inverses and (x.dtype.is_float or inverses[(x.op.op, op)]):
+            return x.op.srcs[0]
+        return None
+    (y, (a, b)) = srcs[1], values
+    if op is BinaryOps.ADD:
+        return y if a == 0 else x if b == 0 else None
+    if op is BinaryOps.MUL:
+        return y if a == 1 else x if b == 1 else None
+    if op is BinaryOps.SUB:
+        return x if b == 0 else _full(x, as_dtype(0, x.dtype), x.shape, x.dtype) if x is y else None
+    if op is BinaryOps.DIV:
+        return x if b == 1 else None
+    if op is BinaryOps.MAX:
+        return x if x is y else None
+    return None
+
+
+def fold_cast(buf: 'LazyBuffer', dtype: DType) -> Optional['LazyBuffer']:
+    value = const_value(buf)
+    return None if value is None else _full(buf, as_dtype(value, dtype), buf.shape, dtype)
+
+
+def fold_reduce(op: ReduceOps, buf: 'LazyBuffer', dims: Tuple[int, ...], new_shape: Tuple[int, ...]) -> Optional['LazyBuffer']:
+    value = const_value(buf)
+    n = math.prod(buf.shape[d] for d in dims)
+    if value is None or n == 0:
+        return None
+    value = value * n if op is ReduceOps.SUM else value
+    return _full(buf, as_dtype(value, buf.dtype), new_shape, buf.dtype)
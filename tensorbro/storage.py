@@ -0,0 +1,89 @@
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from pathlib import Path
+from typing import Union
+
+from .dtypes import dtypes
+from .lazy import LazyBuffer, ShapeTracker
+from .ops import LazyOp, LoadOps
+
+# file layout: MAGIC | u32 header length | json header | padding | raw little endian data
+# the header holds dtype, shape and the byte offset of the data, which is aligned
+# so the mapped data is as aligned as the buffers of the allocator
+MAGIC = b'TNSRBRO\0'
+ALIGNMENT = 64
+
+
+def save(buf: LazyBuffer, path: Union[str, Path]) -> None:
+    """
+    Writes a realized buffer to path.
+
+    The file is written next to path and renamed into place, so concurrent
+    readers never map a half written file.
+    """
+    assert buf.is_realized, 'LazyBuffer has to be realized before it can be saved'
+    if not buf.st.contiguous:
+        # views are written out in their own row major order, the file holds every element
+        import numpy as np
+        data = memoryview(np.ascontiguousarray(buf.numpy())).cast('B')
+    else:
+        data = memoryview(buf.base).cast('B')[:buf.size * buf.dtype.itemsize]
+    if sys.byteorder != 'little':
+        import numpy as np
+        data = memoryview(np.frombuffer(data, buf.dtype.name).byteswap()).cast('B')
+
+    header = {'dtype': buf.dtype.name, 'shape': list(buf.shape), 'offset': 0}
+    raw = json.dumps(header).encode()
+    # the offset is part of the header, leave room for it to grow before filling it in
+    offset = -(-(len(MAGIC) + 4 + len(raw) + 16) // ALIGNMENT) * ALIGNMENT
+    header['offset'] = offset
+    raw = json.dumps(header).encode()
+    raw += b' ' * (offset - len(MAGIC) - 4 - len(raw))
+
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(raw)))
+            f.write(raw)
+            f.write(data)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def load(path: Union[str, Path], device: str = 'CPU') -> LazyBuffer:
+    """
+    Maps the file at path into memory, the realized buffer points straight into the mapping.
+
+    Pages are only read once a kernel touches them and stay shared with every
+    other process mapping the same file. The mapping is copy on write, nothing
+    ever writes back to the file.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a tensorbro file')
+        (length,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length))
+        dtype = dtypes.from_name(header['dtype'])
+        shape = tuple(header['shape'])
+        size = math.prod(shape)
+        if size == 0:
+            base = (dtype.ctype * 0)()
+        else:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            base = (dtype.ctype * size).from_buffer(mm, header['offset'])
+            if sys.byteorder != 'little':
+                # big endian hosts get a private, swapped copy
+                import numpy as np
+                swapped = np.frombuffer(base, dtype.name).byteswap()
+                base = (dtype.ctype * size).from_buffer(swapped)
+    return LazyBuffer(LazyOp(LoadOps.EXTERN, ()), device, ShapeTracker.from_shape(shape), base=base, dtype=dtype)
@@ -1,6 +1,14 @@
-from typing import Optional, Tuple
+import math
+
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
 
 import tensorbro.ops as ops
+from tensorbro.dtypes import DType, dtypes
+
+# convolutions with at most this many weights (O * C * KH * KW) are computed directly, bigger ones as a matmul
+DIRECT_CONV_MAX_WEIGHTS = 64
 
 class Context:
     def __init__(self, *inputs: 'Tensor'):
@@ -16,41 +24,91 @@ class Context:
         return f'{self.__class__.__name__}: parents={self.parents}'
 
     @classmethod
-    def apply(func, *args: 'Tensor'):
+    def apply(func, *args: 'Tensor', **kwargs: Any):
+        # the context is only kept (with the inputs it saved) if a gradient can flow through it
         context = func(*args)
-        result = Tensor(context.forward(*[t.data for t in args]))
-        result.context = context
+        result = Tensor(context.forward(*[t.data for t in args], **kwargs), args[0].device)
+        if Tensor.grad_enabled and any(t.requires_grad for t in args):
+            result.requires_grad = True
+            result.context = context
         return result
 
+@contextmanager
+def no_grad() -> Iterator[None]:
+    """
+    Ops in this block record no Context, so nothing is kept alive for a backward pass
+    (inference). Works as a decorator as well.
+    """
+    enabled, Tensor.grad_enabled = Tensor.grad_enabled, False
+    try:
+        yield
+    finally:
+        Tensor.grad_enabled = enabled
+
 class Tensor:
     _seed: int = 0
-    def __init__(self, data, device="CLANG") -> None:
+    grad_enabled: bool = True
+    def __init__(self, data, device="CLANG", requires_grad: bool = False) -> None:
         self.data = data
         self.context: Optional[Context] = None
         self.device = device
         self.is_materialized = False
+        self.requires_grad = requires_grad
+        self.grad: Optional['Tensor'] = None
 
     def __repr__(self):
         return f'Tensor: data={self.data}\n'
 
+    @property
+    def dtype(self) -> DType:
+        return self.data.dtype
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.data.shape
+
     @staticmethod
-    def full(value, shape, device="CLANG"):
+    def full(value, shape, device="CLANG", dtype: DType = dtypes.float32):
         from tensorbro import LazyBuffer
-        return Tensor(LazyBuffer.full(value, shape, device))
+        return Tensor(LazyBuffer.full(value, shape, device, dtype=dtype), device)
 
     @staticmethod
-    def ones(shape, device="CLANG"):
-        return Tensor.full(1, shape, device)
+    def ones(shape, device="CLANG", dtype: DType = dtypes.float32):
+        return Tensor.full(1, shape, device, dtype)
 
     @staticmethod
-    def zeros(shape, device="CLANG"):
-        return Tensor.full(0, shape, device)
+    def zeros(shape, device="CLANG", dtype: DType = dtypes.float32):
+        return Tensor.full(0, shape, device, dtype)
 
     @staticmethod
-    def rand(shape, device="CLANG"):
+    def rand(shape, device="CLANG", dtype: DType = dtypes.float32):
         from tensorbro import LazyBuffer
         Tensor._seed += 1
-        return Tensor(LazyBuffer.rand(shape, device, seed=Tensor._seed))
+        return Tensor(LazyBuffer.rand(shape, device, seed=Tensor._seed, dtype=dtype), device)
+
+    def cast(self, dtype: DType):
+        return ops.Cast.apply(self, dtype=dtype)
+
+    @staticmethod
+    def from_numpy(array, device="CLANG"):
+        from tensorbro import LazyBuffer
+        return Tensor(LazyBuffer.from_buffer(array, device=device), device)
+
+    @staticmethod
+    def load(path, device="CLANG"):
+        from tensorbro.storage import load
+        return Tensor(load(path, device), device)
+
+    def save(self, path):
+        from tensorbro.storage import save
+        if not self.data.is_realized:
+            self.materialize()
+        save(self.data, path)
+
+    def numpy(self):
+        if not self.data.is_realized:
+            self.materialize()
+        return self.data.numpy()
 
     def __mul__(self, other):
         return ops.Mul.apply(self, other)
@@ -64,11 +122,191 @@ class Tensor:
     def __matmul__(self, other):
         return ops.Matmul.apply(self, other)
 
-    def materialize(self):
+    def __truediv__(self, other):
+        return ops.Div.apply(self, other)
+
+    def exp(self):
+        return ops.Exp.apply(self)
+
+    def log(self):
+        return ops.Log.apply(self)
+
+    def sqrt(self):
+        return ops.Sqrt.apply(self)
+
+    def sum(self, dim: Union[int, Tuple[int, ...]] = 0, keepdim: bool = False):
+        return ops.Sum.apply(self, dim=dim, keepdim=keepdim)
+
+    def max(self, dim: Union[int, Tuple[int, ...]] = 0, keepdim: bool = False):
+        return ops.Max.apply(self, dim=dim, keepdim=keepdim)
+
+    def mean(self, dim: Union[int, Tuple[int, ...]] = 0, keepdim: bool = False):
+        from tensorbro.lazy import reduce_dims
+        assert self.dtype.is_float, f'mean needs a float tensor, not {self.dtype}, cast it first'
+        total = self.sum(dim, keepdim)
+        n = math.prod(self.shape[d] for d in reduce_dims(self.shape, dim))
+        # the scale is a constant, it ends up as a literal in the kernel of the sum
+        return total * Tensor.full(1 / n, total.shape, self.device, self.dtype)
+
+    def var(self, dim: Union[int, Tuple[int, ...]] = 0, keepdim: bool = False):
+        # population variance (numpy's default ddof=0), around the mean for numerical stability
+        diff = self - self.mean(dim, keepdim=True)
+        return (diff * diff).mean(dim, keepdim)
+
+    def softmax(self, dim: int = -1):
+        """
+        exp(x - max(x)) / sum(exp(x - max(x))) along dim. Over the last dim (the default)
+        this is a single kernel with one loop for max and sum (online softmax) and one
+        writing the output.
+        """
+        shifted = self - self._row_max(dim)
+        e = shifted.exp()
+        return e / e.sum(dim, keepdim=True)
+
+    def log_softmax(self, dim: int = -1):
+        shifted = self - self._row_max(dim)
+        return shifted - shifted.exp().sum(dim, keepdim=True).log()
+
+    def _row_max(self, dim: int) -> 'Tensor':
+        # only there for numerical stability, softmax doesn't depend on it, so no gradient flows through it
+        return Tensor(self.data.max(dim, keepdim=True), self.device)
+
+    def layernorm(self, weight: Optional['Tensor'] = None, bias: Optional['Tensor'] = None, eps: float = 1e-5):
+        """
+        Normalizes over the last dim to zero mean and unit variance, then scales by weight and shifts
+        by bias (both of shape[-1], if given). Mean and variance are computed per row inside the
+        kernel that writes the output.
+        """
+        diff = self - self.mean(-1, keepdim=True)
+        var = (diff * diff).mean(-1, keepdim=True)
+        out = diff / (var + Tensor.full(eps, var.shape, self.device, self.dtype)).sqrt()
+        if weight is not None:
+            out = out * weight
+        return out + bias if bias is not None else out
+
+    def conv2d(self, weight: 'Tensor', bias: Optional['Tensor'] = None, stride: Union[int, Tuple[int, int]] = 1,
+               padding: Union[int, Tuple[int, int]] = 0):
+        """
+        2d cross-correlation of self (N, C, H, W) with weight (O, C, KH, KW), plus bias (O,),
+        the result is (N, O, OH, OW).
+
+        The windows (im2col) are a view of self, padding is a bounds check, nothing is copied.
+        Small kernels multiply the windows with the weights and sum over (C, KH, KW) in one
+        reduce kernel. Bigger ones are a matmul of the weights with the windows, it packs one
+        cache sized panel of windows at a time, which pays off once there are a few output
+        channels to reuse it for.
+        """
+        (sh, sw), (ph, pw) = [(v, v) if isinstance(v, int) else v for v in (stride, padding)]
+        n, c, _, _ = self.shape
+        o, c_w, kh, kw = weight.shape
+        assert c == c_w, f'Input has {c} channels, weight expects {c_w}'
+        # (N, C, OH, KH, OW, KW)
+        windows = ops.Movement.apply(
+            self, fn=lambda x: x.pad((0, 0), (0, 0), (ph, ph), (pw, pw)).unfold(2, kh, sh).unfold(4, kw, sw))
+        oh, ow = windows.shape[2], windows.shape[4]
+        if weight.data.size <= DIRECT_CONV_MAX_WEIGHTS:
+            cols = windows.permute(0, 2, 4, 1, 3, 5).reshape(n, 1, oh, ow, c, kh, kw)
+            out = (cols * weight.reshape(1, o, 1, 1, c, kh, kw)).sum((4, 5, 6))
+        else:
+            cols = windows.permute(1, 3, 5, 0, 2, 4).reshape(c * kh * kw, n * oh * ow)
+            out = (weight.reshape(o, c * kh * kw) @ cols).reshape(o, n, oh, ow).permute(1, 0, 2, 3)
+        return out + bias.reshape(1, o, 1, 1) if bias is not None else out
+
+    # movement ops are views, nothing is copied
+    def __getitem__(self, idx):
+        return ops.Movement.apply(self, fn=lambda x: x.getitem(idx))
+
+    def pad(self, *arg: Tuple[int, int]):
+        return ops.Movement.apply(self, fn=lambda x: x.pad(*arg))
+
+    def reshape(self, *shape: int):
+        return ops.Movement.apply(self, fn=lambda x: x.reshape(*shape))
+
+    def permute(self, *order: int):
+        return ops.Movement.apply(self, fn=lambda x: x.permute(*order))
+
+    def expand(self, *shape: int):
+        return ops.Movement.apply(self, fn=lambda x: x.expand(*shape))
+
+    def unfold(self, dim: int, size: int, step: int = 1):
+        return ops.Movement.apply(self, fn=lambda x: x.unfold(dim, size, step))
+
+    def transpose(self, dim1: int, dim2: int):
+        return ops.Movement.apply(self, fn=lambda x: x.transpose(dim1, dim2))
+
+    def assign(self, other: 'Tensor') -> 'Tensor':
+        # other is computed into the memory of this tensor (if it is realized already)
+        self.data = self.data.assign(other.data)
+        return self
+
+    def materialize(self, *others: 'Tensor'):
+        """
+        Computes this tensor and others in one program, buffers they share (e.g. the
+        forward pass that gradients read) are computed once.
+        """
+        from tensorbro.linearizer import linearize
+        seen: Set[Any] = set()
+        schedule = [si for t in (self, *others) for si in t.data.schedule(seen)]
+        prg = linearize(schedule, {t.data for t in (self, *others)})
+        prg()
+
+    def materialize_async(self) -> 'Future[Tensor]':
+        """
+        Schedules the graph right away, compiles and runs it in the background.
+        The future resolves to this tensor, don't build on it before that.
+        """
         from tensorbro.linearizer import linearize
         schedule = self.data.schedule()
         prg = linearize(schedule)
-        prg()
+        return prg.submit(lambda: self)
 
-    def backward(self, grad):
-        pass
+    def backward(self, grad: Optional['Tensor'] = None):
+        """
+        Adds the gradient of this tensor with respect to every leaf tensor with
+        requires_grad to their .grad. grad defaults to ones for single element tensors.
+
+        Nothing is computed here, the gradients are lazy graphs on top of the forward
+        pass, materialize them together with it to run both in one program.
+        A realized .grad is accumulated into in place.
+        """
+        from tensorbro import LazyBuffer
+        assert self.requires_grad, 'Tensor does not require grad, none of its inputs has requires_grad set'
+        if grad is None:
+            assert self.data.size == 1, f'grad can only be left out for single element tensors, not {self.shape}'
+            out_grad = LazyBuffer.full(1, self.shape, self.data.device, self.dtype)
+        else:
+            assert grad.shape == self.shape, f'grad shape {grad.shape} does not match {self.shape}'
+            out_grad = grad.data
+        grads: Dict['Tensor', Any] = {self: out_grad}
+        for t in reversed(self._toposort()):
+            g = grads.pop(t, None)
+            if g is None:
+                continue
+            if t.context is None:
+                if t.grad is None:
+                    t.grad = Tensor(g, t.device)
+                else:
+                    t.grad.assign(t.grad + Tensor(g, t.device))
+                continue
+            for parent, parent_grad in zip(t.context.parents, t.context.backward(g)):
+                if parent_grad is None or not parent.requires_grad:
+                    continue
+                grads[parent] = grads[parent] + parent_grad if parent in grads else parent_grad
+
+    def _toposort(self) -> List['Tensor']:
+        # iterative post order dfs over the tensors a gradient flows to
+        order: List['Tensor'] = []
+        visited: Set['Tensor'] = set()
+        stack: List[Tuple['Tensor', bool]] = [(self, False)]
+        while stack:
+            t, done = stack.pop()
+            if done:
+                order.append(t)
+                continue
+            if t in visited:
+                continue
+            visited.add(t)
+            stack.append((t, True))
+            if t.context is not None:
+                stack.extend((p, False) for p in reversed(t.context.parents) if p.requires_grad and p not in visited)
+        return order
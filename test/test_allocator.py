@@ -0,0 +1,100 @@
+import gc
+import unittest
+import ctypes as c
+import numpy as np
+
+from tensorbro import LazyBuffer
+from tensorbro.linearizer import linearize
+from tensorbro.runners.clang import CAllocator, _CAllocator
+
+
+class TestCAllocator(unittest.TestCase):
+    def setUp(self):
+        self.allocator = _CAllocator()
+
+    def test_alloc_is_aligned(self):
+        for size in [1, 3, 100, 1025]:
+            buf = self.allocator.alloc(c.c_float, size)
+            self.assertEqual(c.addressof(buf) % self.allocator.alignment, 0)
+            self.assertEqual(len(buf), size)
+
+    def test_alloc_is_usable(self):
+        buf = self.allocator.alloc(c.c_float, 10)
+        arr = np.frombuffer(buf, np.float32)
+        np.testing.assert_equal(arr, np.zeros(10))
+        arr[:] = 3
+        self.assertEqual(buf[9], 3)
+
+    def test_buckets(self):
+        self.assertEqual(_CAllocator.bucket(1), 64)
+        self.assertEqual(_CAllocator.bucket(1024), 1024)
+        self.assertEqual(_CAllocator.bucket(1025), 1280)
+        for nbytes in [65, 1000, 4097, 123457]:
+            self.assertGreaterEqual(_CAllocator.bucket(nbytes), nbytes)
+            self.assertLess(_CAllocator.bucket(nbytes), nbytes * 1.25)
+
+    def test_free_reuses_memory(self):
+        buf = self.allocator.alloc(c.c_float, 1000)
+        addr = c.addressof(buf)
+        self.allocator.free(buf)
+        self.assertEqual(self.allocator.live, 0)
+        buf = self.allocator.alloc(c.c_float, 990)
+        self.assertEqual(c.addressof(buf), addr)
+        self.assertEqual(self.allocator.allocs, 1)
+        self.assertEqual(self.allocator.reuses, 1)
+
+    def test_garbage_collected_buffers_are_reused(self):
+        buf = self.allocator.alloc(c.c_float, 1000)
+        del buf
+        gc.collect()
+        self.assertEqual(self.allocator.live, 0)
+        self.assertEqual(self.allocator.cached, _CAllocator.bucket(4000))
+        self.allocator.alloc(c.c_float, 1000)
+        self.assertEqual(self.allocator.allocs, 1)
+
+    def test_live_and_peak(self):
+        bufs = [self.allocator.alloc(c.c_float, 16) for _ in range(4)]
+        self.assertEqual(self.allocator.live, 4 * 64)
+        for buf in bufs:
+            self.allocator.free(buf)
+        self.assertEqual(self.allocator.live, 0)
+        self.assertEqual(self.allocator.peak, 4 * 64)
+
+
+class TestLinearizerReleasesBuffers(unittest.TestCase):
+    def step(self, x, w):
+        shared = x * w
+        return (shared + x) * shared
+
+    def test_intermediates_are_released(self):
+        x = LazyBuffer.rand((64, 64), device="CPU", seed=1)
+        w = LazyBuffer.rand((64, 64), device="CPU", seed=2)
+        shared = x * w
+        res = (shared + x) * shared
+        linearize(res.schedule())()
+        self.assertFalse(shared.is_realized)
+        self.assertTrue(res.is_realized)
+        self.assertTrue(x.is_realized)
+
+        np_x = np.frombuffer(x.base, np.float32).reshape(64, 64)
+        np_w = np.frombuffer(w.base, np.float32).reshape(64, 64)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(64, 64)
+        np.testing.assert_allclose((np_x * np_w + np_x) * (np_x * np_w), clang_res, rtol=1e-6)
+
+    def test_steady_state_has_no_allocations(self):
+        x = LazyBuffer.rand((64, 64), device="CPU", seed=1)
+        w = LazyBuffer.rand((64, 64), device="CPU", seed=2)
+        linearize(x.schedule() + w.schedule())()
+        for i in range(3):
+            res = self.step(x, w)
+            linearize(res.schedule())()
+            del res
+            gc.collect()
+            if i == 0:
+                CAllocator.reset_stats()
+        self.assertEqual(CAllocator.allocs, 0)
+        self.assertGreater(CAllocator.reuses, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
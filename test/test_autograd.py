@@ -0,0 +1,167 @@
+import unittest
+import numpy as np
+
+from tensorbro import Tensor, no_grad, dtypes
+
+
+def param(arr: np.ndarray) -> Tensor:
+    t = Tensor.from_numpy(arr)
+    t.requires_grad = True
+    return t
+
+
+class TestBackward(unittest.TestCase):
+    def setUp(self):
+        self.x_np = np.random.rand(4, 3).astype(np.float32)
+        self.w_np = np.random.rand(3, 5).astype(np.float32)
+        self.b_np = np.random.rand(5).astype(np.float32)
+
+    def test_elementwise(self):
+        x, y = param(self.x_np), param(self.x_np[::-1].copy())
+        ((x * y + x) - y).sum(0).sum(0).backward()
+        x.grad.materialize(y.grad)
+        np.testing.assert_allclose(x.grad.numpy(), self.x_np[::-1] + 1, rtol=1e-6)
+        np.testing.assert_allclose(y.grad.numpy(), self.x_np - 1, rtol=1e-6)
+
+    def test_matmul_with_broadcast_bias(self):
+        x, w, b = Tensor.from_numpy(self.x_np), param(self.w_np), param(self.b_np)
+        xw = self.x_np @ self.w_np
+        loss = ((x @ w + b) * (x @ w)).sum(0).sum(0)
+        loss.backward()
+        self.assertIsNone(x.grad)
+        self.assertEqual(b.grad.shape, (5,))
+        loss.materialize(w.grad, b.grad)
+        np.testing.assert_allclose(w.grad.numpy(), self.x_np.T @ (2 * xw + self.b_np), rtol=1e-5)
+        np.testing.assert_allclose(b.grad.numpy(), xw.sum(0), rtol=1e-5)
+        np.testing.assert_allclose(loss.numpy(), ((xw + self.b_np) * xw).sum(), rtol=1e-5)
+
+    def test_matmul_grad_of_both_inputs(self):
+        x, w = param(self.x_np), param(self.w_np)
+        g = np.random.rand(4, 5).astype(np.float32)
+        (x @ w).backward(Tensor.from_numpy(g))
+        np.testing.assert_allclose(x.grad.numpy(), g @ self.w_np.T, rtol=1e-5)
+        np.testing.assert_allclose(w.grad.numpy(), self.x_np.T @ g, rtol=1e-5)
+
+    def test_movement_ops(self):
+        a = param(np.arange(12, dtype=np.float32).reshape(3, 4))
+        out = a[1:, ::2].pad((1, 0), (0, 1)).transpose(0, 1)
+        (out * out).sum(0).sum(0).backward()
+        expected = np.zeros((3, 4), np.float32)
+        expected[1:, ::2] = 2 * a.numpy()[1:, ::2]
+        np.testing.assert_allclose(a.grad.numpy(), expected)
+
+    def test_expand_sums_the_grad(self):
+        a, e = param(self.x_np), param(np.ones((4, 1), np.float32))
+        (e.expand(4, 3) * a).sum(0).sum(0).backward()
+        np.testing.assert_allclose(e.grad.numpy(), self.x_np.sum(1, keepdims=True), rtol=1e-6)
+
+    def test_cast(self):
+        a = param(self.x_np)
+        (a.cast(dtypes.float64) * a.cast(dtypes.float64)).sum(1).sum(0).backward()
+        self.assertEqual(a.grad.dtype, dtypes.float32)
+        np.testing.assert_allclose(a.grad.numpy(), 2 * self.x_np, rtol=1e-6)
+
+    def test_grad_accumulates_in_place(self):
+        x, w = Tensor.from_numpy(self.x_np), param(self.w_np)
+        (x @ w).sum(0).sum(0).backward()
+        w.grad.materialize()
+        memory = w.grad.data.base
+        (x @ w).sum(0).sum(0).backward()
+        w.grad.materialize()
+        self.assertIs(w.grad.data.base, memory)
+        np.testing.assert_allclose(w.grad.numpy(), 2 * self.x_np.T @ np.ones((4, 5), np.float32), rtol=1e-5)
+
+    def test_shared_tensor_sums_its_grads(self):
+        a = param(self.x_np)
+        b = a * a
+        (b + b).sum(0).sum(0).backward()
+        np.testing.assert_allclose(a.grad.numpy(), 4 * self.x_np, rtol=1e-6)
+
+    def test_sum_over_several_dims(self):
+        a = param(self.x_np)
+        out = a.sum((0, 1), keepdim=True)
+        self.assertEqual(out.shape, (1, 1))
+        (out * out).backward()
+        np.testing.assert_allclose(a.grad.numpy(), np.full((4, 3), 2 * self.x_np.sum()), rtol=1e-5)
+
+    def test_max(self):
+        arr = np.array([[1, 5, 5], [-2, -1, -3]], np.float32)
+        a = param(arr)
+        out = a.max(1)
+        np.testing.assert_equal(out.numpy(), arr.max(1))
+        out.sum(0).backward()
+        np.testing.assert_allclose(a.grad.numpy(), [[0, 0.5, 0.5], [0, 1, 0]])
+
+    def test_mean_and_var(self):
+        arr = np.random.randn(2, 3, 4, 5).astype(np.float32)
+        a = param(arr)
+        np.testing.assert_allclose(a.mean((0, 2, 3)).numpy(), arr.mean(axis=(0, 2, 3)), rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(a.var((0, 2, 3), keepdim=True).numpy(), arr.var(axis=(0, 2, 3), keepdims=True),
+                                   rtol=1e-5, atol=1e-6)
+        a.mean((0, 1, 2, 3)).backward()
+        np.testing.assert_allclose(a.grad.numpy(), np.full(arr.shape, 1 / arr.size), rtol=1e-6)
+
+    def test_softmax_and_layernorm(self):
+        arr, g = np.random.randn(4, 10).astype(np.float32), np.random.randn(4, 10).astype(np.float32)
+        s = np.exp(arr - arr.max(-1, keepdims=True))
+        s /= s.sum(-1, keepdims=True)
+        a = param(arr)
+        (a.softmax() * Tensor.from_numpy(g)).sum((0, 1)).backward()
+        np.testing.assert_allclose(a.grad.numpy(), s * (g - (g * s).sum(-1, keepdims=True)), rtol=1e-4, atol=1e-5)
+        a.grad = None
+        (a.log_softmax() * Tensor.from_numpy(g)).sum((0, 1)).backward()
+        np.testing.assert_allclose(a.grad.numpy(), g - s * g.sum(-1, keepdims=True), rtol=1e-4, atol=1e-5)
+        w = param(np.random.rand(10).astype(np.float32))
+        a.layernorm(w).sum((0, 1)).backward()
+        normed = (arr - arr.mean(-1, keepdims=True)) / np.sqrt(arr.var(-1, keepdims=True) + 1e-5)
+        np.testing.assert_allclose(w.grad.numpy(), normed.sum(0), rtol=1e-4, atol=1e-5)
+
+    def test_conv2d(self):
+        for w_shape, stride in (((2, 2, 3, 3), 1), ((6, 2, 3, 2), 2)):
+            x_np, w_np = np.random.randn(2, 2, 7, 6).astype(np.float32), np.random.randn(*w_shape).astype(np.float32)
+            x, w = param(x_np), param(w_np)
+            out = x.conv2d(w, stride=stride, padding=1)
+            g = np.random.randn(*out.shape).astype(np.float32)
+            out.backward(Tensor.from_numpy(g))
+            # every window element sends its grad back to the (padded) input element it was read from
+            xp = np.pad(x_np, ((0, 0), (0, 0), (1, 1), (1, 1)))
+            x_grad, w_grad = np.zeros_like(xp), np.zeros_like(w_np)
+            oh, ow = out.shape[2:]
+            for i in range(w_shape[2]):
+                for j in range(w_shape[3]):
+                    window = (slice(None), slice(None), slice(i, i + stride * (oh - 1) + 1, stride),
+                              slice(j, j + stride * (ow - 1) + 1, stride))
+                    x_grad[window] += np.einsum('nohw,oc->nchw', g, w_np[:, :, i, j])
+                    w_grad[:, :, i, j] = np.einsum('nohw,nchw->oc', g, xp[window])
+            x.grad.materialize(w.grad)
+            np.testing.assert_allclose(x.grad.numpy(), x_grad[:, :, 1:-1, 1:-1], rtol=1e-4, atol=1e-4)
+            np.testing.assert_allclose(w.grad.numpy(), w_grad, rtol=1e-4, atol=1e-4)
+
+    def test_default_grad_needs_single_element(self):
+        a = param(self.x_np)
+        with self.assertRaises(AssertionError):
+            (a * a).backward()
+
+
+class TestNoGrad(unittest.TestCase):
+    def test_no_context_is_recorded(self):
+        a = param(np.ones((2, 2), np.float32))
+        with no_grad():
+            b = a * a
+        self.assertFalse(b.requires_grad)
+        self.assertIsNone(b.context)
+        self.assertTrue((a * a).requires_grad)
+
+    def test_decorator(self):
+        @no_grad()
+        def infer(t):
+            return t + t
+        self.assertIsNone(infer(param(np.ones((2,), np.float32))).context)
+
+    def test_untracked_inputs(self):
+        a = Tensor.from_numpy(np.ones((2, 2), np.float32))
+        self.assertIsNone((a * a).context)
+
+
+if __name__ == "__main__":
+    unittest.main()
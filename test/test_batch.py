@@ -0,0 +1,75 @@
+import tempfile
+import unittest
+import numpy as np
+
+from unittest import mock
+
+from tensorbro import LazyBuffer
+from tensorbro.linearizer import BatchRunner, linearize
+from tensorbro.ops import ReduceOps, UnaryOps
+from tensorbro.runners.clang import _KernelCache
+
+
+class TestBatchRunner(unittest.TestCase):
+    def setUp(self):
+        self.x = LazyBuffer.rand((32, 32), device="CPU", seed=1)
+        self.w = LazyBuffer.rand((32, 32), device="CPU", seed=2)
+        linearize(self.x.schedule() + self.w.schedule())()
+        self.np_x = np.frombuffer(self.x.base, np.float32).reshape(32, 32)
+        self.np_w = np.frombuffer(self.w.base, np.float32).reshape(32, 32)
+
+    def graph(self):
+        shared = self.x.matmul(self.w)
+        y = (shared + self.x) * shared
+        return y.reduce(ReduceOps.SUM, 1).elementwise(UnaryOps.SQRT)
+
+    def reference(self):
+        shared = self.np_x @ self.np_w
+        return np.sqrt(((shared + self.np_x) * shared).sum(1))
+
+    def test_batch_is_correct(self):
+        res = self.graph()
+        prg = linearize(res.schedule(), batch=True)
+        self.assertIsInstance(prg, BatchRunner)
+        prg()
+        np.testing.assert_allclose(self.reference(), np.frombuffer(res.base, np.float32), rtol=1e-5)
+
+    def test_single_compile(self):
+        res = self.graph()
+        schedule = res.schedule()
+        self.assertGreater(len(schedule), 1)
+        # a cache of its own, binaries compiled by earlier runs would count as hits
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = _KernelCache(cache_dir)
+            with mock.patch('tensorbro.code_gen.clang.KernelCache', cache):
+                prg = linearize(schedule, batch=True)
+                # compilation runs in the background, the program is there once it is done
+                self.assertIn('void run(', str(prg.program.code))
+                self.assertEqual(cache.misses, 1)
+                linearize(schedule).programs
+                self.assertEqual(cache.misses, 1 + len(schedule))
+
+    def test_loads_and_intermediates(self):
+        y = LazyBuffer.rand((32, 32), device="CPU", seed=3)
+        shared = y * y
+        res = shared + shared
+        linearize(res.schedule(), batch=True)()
+        self.assertTrue(y.is_realized)
+        self.assertFalse(shared.is_realized)
+        np_y = np.frombuffer(y.base, np.float32)
+        np.testing.assert_allclose(2 * np_y * np_y, np.frombuffer(res.base, np.float32), rtol=1e-6)
+
+    def test_identical_kernels_emitted_once(self):
+        # both products are shared and compile to the same source
+        a = self.x * self.w
+        b = self.w * self.x
+        res = (a + a) * (b + b)
+        schedule = res.schedule()
+        self.assertEqual(len(schedule), 3)
+        prg = linearize(schedule, batch=True)
+        prg()
+        self.assertEqual(str(prg.program.code).count('void kernel'), 2)
+        np.testing.assert_allclose(4 * (self.np_x * self.np_w) ** 2, np.frombuffer(res.base, np.float32).reshape(32, 32), rtol=1e-5)
+
+if __name__ == "__main__":
+    unittest.main()
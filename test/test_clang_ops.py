@@ -1,40 +1,88 @@
+import os
 import unittest
 import numpy as np
 
+from unittest import mock
+
 from tensorbro import LazyBuffer
-from tensorbro.ops import BinaryOps, UnaryOps, MovementOps, ReduceOps
+from tensorbro.ops import BinaryOps, UnaryOps, MovementOps, ReduceOps, LoadOps
 from tensorbro.linearizer import linearize
+from tensorbro.code_gen.clang import column_reduce, omp_parallel
+from tensorbro.device import Device
 
 class TestMatmul(unittest.TestCase):
     def setUp(self):
         self.l1 = LazyBuffer.rand((10, 20), device="CLANG")
         self.l2 = LazyBuffer.rand((20, 10), device="CLANG")
 
-    # def test_matmul_2d(self):
-    #     res = self.l1.matmul(self.l2)
-    #     linearize(res.schedule())()
-    #
-    #     np1 = np.frombuffer(self.l1.base, np.float32).reshape(10, 20)
-    #     np2 = np.frombuffer(self.l2.base, np.float32).reshape(20, 10)
-    #     np_res = np1 @ np2
-    #     self.assertEqual(np_res.shape, res.shape)
-    #
-    #     clang_res = np.frombuffer(res.base, np.float32).reshape(res.shape)
-    #     np.testing.assert_allclose(np_res, clang_res, rtol=1e-5)
-    #
-    # def test_matmul_3d(self):
-    #     l1 = LazyBuffer.rand((5, 10, 20), device="CLANG")
-    #     l2 = LazyBuffer.rand((20, 10), device="CLANG")
-    #     res = l1.matmul(l2)
-    #     linearize(res.schedule())()
-    #
-    #     np1 = np.frombuffer(l1.base, np.float32).reshape(5, 10, 20)
-    #     np2 = np.frombuffer(l2.base, np.float32).reshape(20, 10)
-    #     np_res = np1 @ np2
-    #     self.assertEqual(np_res.shape, res.shape)
-    #
-    #     clang_res = np.frombuffer(res.base, np.float32).reshape(res.shape)
-    #     np.testing.assert_allclose(np_res, clang_res, rtol=1e-5)
+    def test_matmul_2d(self):
+        res = self.l1.matmul(self.l2)
+        linearize(res.schedule())()
+
+        np1 = np.frombuffer(self.l1.base, np.float32).reshape(10, 20)
+        np2 = np.frombuffer(self.l2.base, np.float32).reshape(20, 10)
+        np_res = np1 @ np2
+        self.assertEqual(np_res.shape, res.shape)
+
+        clang_res = np.frombuffer(res.base, np.float32).reshape(res.shape)
+        np.testing.assert_allclose(np_res, clang_res, rtol=1e-5)
+
+    def test_matmul_3d(self):
+        l1 = LazyBuffer.rand((5, 10, 20), device="CLANG")
+        l2 = LazyBuffer.rand((20, 10), device="CLANG")
+        res = l1.matmul(l2)
+        linearize(res.schedule())()
+
+        np1 = np.frombuffer(l1.base, np.float32).reshape(5, 10, 20)
+        np2 = np.frombuffer(l2.base, np.float32).reshape(20, 10)
+        np_res = np1 @ np2
+        self.assertEqual(np_res.shape, res.shape)
+
+        clang_res = np.frombuffer(res.base, np.float32).reshape(res.shape)
+        np.testing.assert_allclose(np_res, clang_res, rtol=1e-5)
+
+    def test_matmul_packs_padded_windows(self):
+        # the right operand is a padded sliding window view, it is read without a copy
+        l2 = LazyBuffer.rand((3, 9, 41), device="CLANG")
+        cols = l2.pad((0, 0), (1, 1), (2, 2)).unfold(2, 5, 2).permute(0, 3, 1, 2).reshape(15, 231)
+        res = LazyBuffer.rand((7, 15), device="CLANG").matmul(cols)
+        self.assertEqual([si.op.op for si in res.schedule()], [LoadOps.RAND, LoadOps.RAND, BinaryOps.MATMUL])
+        linearize(res.schedule())()
+        np.testing.assert_allclose(res.numpy(), res.op.srcs[0].numpy() @ cols.numpy(), rtol=1e-5)
+
+    def test_matmul_3d_right_operand(self):
+        l1 = LazyBuffer.rand((2, 3, 4), device="CLANG")
+        l2 = LazyBuffer.rand((4, 5, 2), device="CLANG")
+        res = l1.matmul(l2)
+        self.assertEqual(res.shape, (2, 3, 5, 2))
+        linearize(res.schedule())()
+
+        np1 = np.frombuffer(l1.base, np.float32).reshape(2, 3, 4)
+        np2 = np.frombuffer(l2.base, np.float32).reshape(4, 5, 2)
+        np.testing.assert_allclose(res.numpy(), np.tensordot(np1, np2, axes=1), rtol=1e-5)
+
+    def test_matmul_remainder_tiles(self):
+        l1 = LazyBuffer.rand((37, 300), device="CLANG")
+        l2 = LazyBuffer.rand((300, 45), device="CLANG")
+        res = l1.matmul(l2)
+        linearize(res.schedule())()
+
+        np1 = np.frombuffer(l1.base, np.float32).reshape(37, 300)
+        np2 = np.frombuffer(l2.base, np.float32).reshape(300, 45)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(res.shape)
+        np.testing.assert_allclose(np1 @ np2, clang_res, rtol=1e-4)
+
+    def test_matmul_strided(self):
+        l1 = LazyBuffer.rand((1, 20), device="CLANG")
+        l2 = LazyBuffer.rand((20, 1), device="CLANG")
+        res = l1.expand(8, 20).matmul(l2.expand(20, 16))
+        linearize(res.schedule())()
+
+        np1 = np.tile(np.frombuffer(l1.base, np.float32).reshape(1, 20), (8, 1))
+        np2 = np.tile(np.frombuffer(l2.base, np.float32).reshape(20, 1), (1, 16))
+        clang_res = np.frombuffer(res.base, np.float32).reshape(res.shape)
+        np.testing.assert_allclose(np1 @ np2, clang_res, rtol=1e-5)
+
 
 class TestLazyOpsReduce(unittest.TestCase):
     def setUp(self):
@@ -128,6 +176,57 @@ class TestLazyOpsReduce(unittest.TestCase):
 
 
 
+class TestMultiAxisReduce(unittest.TestCase):
+    def setUp(self):
+        # negative values, a MAX that starts from a zeroed accumulator gives 0
+        self.np = (np.random.rand(4, 6, 5, 12) - 2).astype(np.float32)
+        self.l1 = LazyBuffer.from_buffer(self.np, device="CLANG")
+
+    def check(self, res, np_res, n_kernels=1):
+        schedule = res.schedule()
+        self.assertEqual(len(schedule), n_kernels)
+        linearize(schedule)()
+        self.assertEqual(np_res.shape, res.shape)
+        np.testing.assert_allclose(np_res, res.numpy(), rtol=1e-5, atol=1e-5)
+
+    def test_sum_and_max_over_several_dims(self):
+        for dims in [(0, 2), (1, 3), (0, 1, 2, 3), (-1, 0)]:
+            with self.subTest(dims=dims):
+                self.check(self.l1.sum(dims), self.np.sum(axis=dims))
+                self.check(self.l1.max(dims), self.np.max(axis=dims))
+
+    def test_keepdim(self):
+        self.check(self.l1.sum((0, 2, 3), keepdim=True), self.np.sum(axis=(0, 2, 3), keepdims=True))
+        self.check(self.l1.max(1, keepdim=True), self.np.max(axis=1, keepdims=True))
+        self.assertTrue(self.l1.sum(1, keepdim=True).is_view)
+
+    def test_column_reduce(self):
+        # the last dim is kept and has enough columns, so the kernel accumulates columns side by side
+        res = self.l1.reduce(ReduceOps.MAX, (0, 1, 2))
+        self.assertIsNotNone(column_reduce(res.schedule()[-1].op))
+        self.check(res, self.np.max(axis=(0, 1, 2)))
+        wide = np.random.randn(3, 150).astype(np.float32)
+        self.check(LazyBuffer.from_buffer(wide, device="CLANG").sum(0), wide.sum(0))
+
+    def test_column_reduce_epilogue(self):
+        res = (self.l1 * self.l1).sum((0, 2)).elementwise(UnaryOps.SQRT)
+        self.assertIsNotNone(column_reduce(res.schedule()[-1].op))
+        self.check(res, np.sqrt((self.np * self.np).sum(axis=(0, 2))))
+
+    def test_transposed_input_is_not_column_reduced(self):
+        res = self.l1.permute(0, 1, 3, 2).sum((0, 3))
+        self.assertIsNone(column_reduce(res.schedule()[-1].op))
+        self.check(res, self.np.transpose(0, 1, 3, 2).sum(axis=(0, 3)))
+
+    def test_out_of_range_dims(self):
+        with self.assertRaises(IndexError):
+            self.l1.reduce(ReduceOps.SUM, (5,))
+        with self.assertRaises(IndexError):
+            self.l1.sum(-5)
+        with self.assertRaises(IndexError):
+            LazyBuffer.full(1, ()).sum(0)
+
+
 class TestLazyOpsMovement(unittest.TestCase):
     def setUp(self):
         self.l1 = LazyBuffer.full(10, (10, 10), device="CLANG")
@@ -145,14 +244,15 @@ class TestLazyOpsMovement(unittest.TestCase):
         res = lb.movement(MovementOps.EXPAND, (100, 20))
         linearize(res.schedule())()
         self.assertEqual(res.shape, (100, 20))
-        self.assertEqual(res.st.stride, (1, 20))
+        # the expanded dimension doesn't move in memory
+        self.assertEqual(res.st.views[-1].strides, (1, 0))
 
     def test_permute_1(self):
         res = self.l2.permute(0, 2, 1)
         linearize(res.schedule())()
 
         np_res = np.frombuffer(self.l2.base, np.float32).reshape(2, 4, 3).transpose(0, 2, 1)
-        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        clang_res = res.numpy()
         self.assertEqual(np_res.shape, clang_res.shape)
         np.testing.assert_allclose(np_res, clang_res)
 
@@ -161,7 +261,7 @@ class TestLazyOpsMovement(unittest.TestCase):
         linearize(res.schedule())()
 
         np_res = np.frombuffer(self.l2.base, np.float32).reshape(2, 4, 3).transpose(2, 1, 0)
-        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        clang_res = res.numpy()
         self.assertEqual(np_res.shape, clang_res.shape)
         np.testing.assert_allclose(np_res, clang_res)
 
@@ -170,7 +270,7 @@ class TestLazyOpsMovement(unittest.TestCase):
         linearize(res.schedule())()
 
         np_res = np.tile(np.frombuffer(self.l2.base, np.float32).reshape(2, 4, 3, 1), (1, 1, 1, 5)).transpose(0, 2, 1, 3)
-        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        clang_res = res.numpy()
         self.assertEqual(np_res.shape, clang_res.shape)
         np.testing.assert_allclose(np_res, clang_res)
 
@@ -179,15 +279,70 @@ class TestLazyOpsMovement(unittest.TestCase):
         linearize(res.schedule())()
 
         np_res = np.tile(np.frombuffer(self.l2.base, np.float32).reshape(2, 4, 3, 1), (1, 1, 1, 5)).transpose(3, 0, 2, 1)
-        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        clang_res = res.numpy()
         self.assertEqual(np_res.shape, clang_res.shape)
         np.testing.assert_allclose(np_res, clang_res)
 
         
 
+    def test_permute_is_zero_copy(self):
+        res = self.l2.permute(2, 0, 1)
+        schedule = res.schedule()
+        self.assertEqual([si.op.op for si in schedule], [LoadOps.RAND])
+        linearize(schedule)()
+        self.assertIs(res.base, self.l2.base)
+        np.testing.assert_allclose(self.l2.numpy().transpose(2, 0, 1), res.numpy())
+
+    def test_transposed_input_is_read_in_place(self):
+        l3 = LazyBuffer.rand((3, 4, 2), device="CLANG", seed=3)
+        res = self.l2.transpose(0, 2) * l3
+        schedule = res.schedule()
+        self.assertEqual(len([si for si in schedule if si.op.op not in LoadOps]), 1)
+        linearize(schedule)()
+        np.testing.assert_allclose(self.l2.numpy().transpose(2, 1, 0) * l3.numpy(), res.numpy())
+
+    def test_reshape_of_permuted(self):
+        # no strides walk the permuted memory in the new shape, the index goes through a second view
+        res = self.l2.permute(0, 2, 1).reshape(6, 4).elementwise(UnaryOps.NEG)
+        linearize(res.schedule())()
+        np.testing.assert_allclose(-self.l2.numpy().transpose(0, 2, 1).reshape(6, 4), res.numpy())
+
+    def test_matmul_transposed(self):
+        l3 = LazyBuffer.rand((5, 4), device="CLANG", seed=3)
+        res = l3.transpose(0, 1).dot(l3)
+        schedule = res.schedule()
+        self.assertEqual([si.op.op for si in schedule], [LoadOps.RAND, BinaryOps.MATMUL])
+        linearize(schedule)()
+        np.testing.assert_allclose(l3.numpy().T @ l3.numpy(), res.numpy(), rtol=1e-5)
+
+
+    def test_shrink_is_zero_copy(self):
+        res = self.l2.shrink((1, 2), (0, 4), (1, 3))
+        schedule = res.schedule()
+        self.assertEqual([si.op.op for si in schedule], [LoadOps.RAND])
+        linearize(schedule)()
+        self.assertIs(res.base, self.l2.base)
+        np.testing.assert_allclose(self.l2.numpy()[1:2, :, 1:3], res.numpy())
+
+    def test_padded_input(self):
+        l3 = LazyBuffer.rand((4, 6, 5), device="CLANG", seed=3)
+        res = self.l2.pad((1, 1), (0, 2), (2, 0)).elementwise(BinaryOps.ADD, l3)
+        schedule = res.schedule()
+        self.assertEqual(len([si for si in schedule if si.op.op not in LoadOps]), 1)
+        linearize(schedule)()
+        np_res = np.pad(self.l2.numpy(), ((1, 1), (0, 2), (2, 0))) + l3.numpy()
+        np.testing.assert_allclose(np_res, res.numpy(), rtol=1e-6)
+
+    def test_reduce_over_padded_input(self):
+        res = self.l2.pad((0, 0), (2, 2), (0, 0)).reduce(ReduceOps.SUM, 1)
+        linearize(res.schedule())()
+        np.testing.assert_allclose(self.l2.numpy().sum(1), res.numpy(), rtol=1e-5)
+
+
 class TestLazyOpsUnary(unittest.TestCase):
     def setUp(self):
-        self.l1 = LazyBuffer.full(10, (10, 10), device="CLANG")
+        # not LazyBuffer.full, ops on constants are folded before they reach a kernel
+        self.l1 = LazyBuffer.from_buffer(np.full((10, 10), 10, np.float32), device="CLANG")
 
     def test_unary_neg(self):
         res = self.l1.elementwise(UnaryOps.NEG)
@@ -267,8 +422,8 @@ class TestLazyOpsUnary(unittest.TestCase):
 
 class TestLazyOpsBinary(unittest.TestCase):
     def setUp(self):
-        self.l1 = LazyBuffer.full(10, (10, 10), device="CLANG")
-        self.l2 = LazyBuffer.full(10, (10, 10), device="CLANG")
+        self.l1 = LazyBuffer.from_buffer(np.full((10, 10), 10, np.float32), device="CLANG")
+        self.l2 = LazyBuffer.from_buffer(np.full((10, 10), 10, np.float32), device="CLANG")
 
 
     def test_elemwise_mul(self):
@@ -281,7 +436,7 @@ class TestLazyOpsBinary(unittest.TestCase):
     def test_elemwise_mul_strided(self):
         l1 = LazyBuffer.rand((10, 10, 5), device="CLANG")
         l2 = LazyBuffer.rand((1, 10, 1), device="CLANG")
-        l2.movement(MovementOps.EXPAND, (10, 10, 5))
+        l2 = l2.movement(MovementOps.EXPAND, (10, 10, 5))
 
         res = l1.elementwise(BinaryOps.MUL, l2)
         linearize(res.schedule())()
@@ -303,7 +458,7 @@ class TestLazyOpsBinary(unittest.TestCase):
     def test_elemwise_add_strided(self):
         l1 = LazyBuffer.rand((10, 10, 5), device="CLANG")
         l2 = LazyBuffer.rand((1, 10, 1), device="CLANG")
-        l2.movement(MovementOps.EXPAND, (10, 10, 5))
+        l2 = l2.movement(MovementOps.EXPAND, (10, 10, 5))
 
         res = l1.elementwise(BinaryOps.ADD, l2)
         linearize(res.schedule())()
@@ -325,7 +480,7 @@ class TestLazyOpsBinary(unittest.TestCase):
     def test_elemwise_sub_strided(self):
         l1 = LazyBuffer.rand((10, 10, 5), device="CLANG")
         l2 = LazyBuffer.rand((1, 10, 1), device="CLANG")
-        l2.movement(MovementOps.EXPAND, (10, 10, 5))
+        l2 = l2.movement(MovementOps.EXPAND, (10, 10, 5))
 
         res = l1.elementwise(BinaryOps.SUB, l2)
         linearize(res.schedule())()
@@ -347,7 +502,7 @@ class TestLazyOpsBinary(unittest.TestCase):
     def test_elemwise_div_strided(self):
         l1 = LazyBuffer.rand((10, 10, 5), device="CLANG")
         l2 = LazyBuffer.rand((1, 10, 1), device="CLANG")
-        l2.movement(MovementOps.EXPAND, (10, 10, 5))
+        l2 = l2.movement(MovementOps.EXPAND, (10, 10, 5))
 
         res = l1.elementwise(BinaryOps.DIV, l2)
         linearize(res.schedule())()
@@ -370,7 +525,7 @@ class TestLazyOpsBinary(unittest.TestCase):
     def test_elemwise_max_strided(self):
         l1 = LazyBuffer.rand((10, 10, 5), device="CLANG")
         l2 = LazyBuffer.rand((1, 10, 1), device="CLANG")
-        l2.movement(MovementOps.EXPAND, (10, 10, 5))
+        l2 = l2.movement(MovementOps.EXPAND, (10, 10, 5))
 
         res = l1.elementwise(BinaryOps.MAX, l2)
         linearize(res.schedule())()
@@ -381,3 +536,229 @@ class TestLazyOpsBinary(unittest.TestCase):
 
         clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
         np.testing.assert_allclose(np.maximum(np1, np3), clang_res)
+
+
+class TestBroadcasting(unittest.TestCase):
+    def test_bias_add_is_one_kernel(self):
+        act = LazyBuffer.rand((64, 32), device="CLANG", seed=1)
+        bias = LazyBuffer.rand((32,), device="CLANG", seed=2)
+        res = act + bias
+        schedule = res.schedule()
+        kernels = [si for si in schedule if si.op.op not in LoadOps]
+        self.assertEqual(len(kernels), 1)
+        # the bias is read through a stride 0 view, never expanded in memory
+        self.assertEqual(res.shape, (64, 32))
+        self.assertEqual([src.st.views[-1].strides for src in kernels[0].srcs], [(32, 1), (0, 1)])
+        linearize(schedule)()
+        np.testing.assert_allclose(act.numpy() + bias.numpy(), res.numpy(), rtol=1e-6)
+
+    def test_both_sides_broadcast(self):
+        l1 = LazyBuffer.rand((3, 1), device="CLANG", seed=1)
+        l2 = LazyBuffer.rand((2, 1, 4), device="CLANG", seed=2)
+        for op, np_op in [(BinaryOps.MUL, np.multiply), (BinaryOps.SUB, np.subtract), (BinaryOps.MAX, np.maximum)]:
+            with self.subTest(op=op):
+                res = l1.elementwise(op, l2)
+                linearize(res.schedule())()
+                self.assertEqual(res.shape, (2, 3, 4))
+                np.testing.assert_allclose(np_op(l1.numpy(), l2.numpy()), res.numpy(), rtol=1e-6)
+
+    def test_inputs_are_not_changed(self):
+        l1 = LazyBuffer.rand((4,), device="CLANG", seed=1)
+        l2 = LazyBuffer.rand((3, 4), device="CLANG", seed=2)
+        l3 = LazyBuffer.rand((4,), device="CLANG", seed=3)
+        res1, res2 = l1 + l2, l1 * l3
+        self.assertEqual(l1.shape, (4,))
+        self.assertEqual(res2.shape, (4,))
+        seen = set()
+        linearize(res1.schedule(seen) + res2.schedule(seen))()
+        np.testing.assert_allclose(l1.numpy() + l2.numpy(), res1.numpy(), rtol=1e-6)
+        np.testing.assert_allclose(l1.numpy() * l3.numpy(), res2.numpy(), rtol=1e-6)
+
+    def test_incompatible_shapes(self):
+        with self.assertRaises(AssertionError):
+            LazyBuffer.rand((3, 4), device="CLANG") + LazyBuffer.rand((3,), device="CLANG")
+
+
+class TestLazyOpsFused(unittest.TestCase):
+    def setUp(self):
+        self.l1 = LazyBuffer.rand((10, 10, 5), device="CLANG", seed=1)
+        self.l2 = LazyBuffer.rand((10, 10, 5), device="CLANG", seed=2)
+        self.l3 = LazyBuffer.rand((10, 10, 5), device="CLANG", seed=3)
+
+    def test_chain_is_single_kernel(self):
+        res = ((self.l1 * self.l2) + self.l3) - self.l1
+        schedule = res.schedule()
+        self.assertEqual(len([si for si in schedule if si.op.op not in LoadOps]), 1)
+        self.assertEqual(len(schedule[-1].srcs), 3)
+        linearize(schedule)()
+
+        np1 = np.frombuffer(self.l1.base, np.float32).reshape(10, 10, 5)
+        np2 = np.frombuffer(self.l2.base, np.float32).reshape(10, 10, 5)
+        np3 = np.frombuffer(self.l3.base, np.float32).reshape(10, 10, 5)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        np.testing.assert_allclose((np1 * np2) + np3 - np1, clang_res, rtol=1e-6)
+
+    def test_unary_binary_chain(self):
+        res = (self.l1 * self.l2).elementwise(UnaryOps.EXP2).elementwise(BinaryOps.MAX, self.l3).elementwise(UnaryOps.NEG)
+        schedule = res.schedule()
+        self.assertEqual(len([si for si in schedule if si.op.op not in LoadOps]), 1)
+        linearize(schedule)()
+
+        np1 = np.frombuffer(self.l1.base, np.float32).reshape(10, 10, 5)
+        np2 = np.frombuffer(self.l2.base, np.float32).reshape(10, 10, 5)
+        np3 = np.frombuffer(self.l3.base, np.float32).reshape(10, 10, 5)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        np.testing.assert_allclose(-np.maximum(np.exp2(np1 * np2), np3), clang_res, rtol=1e-6)
+
+    def test_chain_with_expanded_input(self):
+        l4 = LazyBuffer.rand((1, 10, 1), device="CLANG", seed=4)
+        l4 = l4.movement(MovementOps.EXPAND, (10, 10, 5))
+        res = (self.l1 * l4) + self.l2
+        schedule = res.schedule()
+        self.assertEqual(len([si for si in schedule if si.op.op not in LoadOps]), 1)
+        linearize(schedule)()
+
+        np1 = np.frombuffer(self.l1.base, np.float32).reshape(10, 10, 5)
+        np2 = np.frombuffer(self.l2.base, np.float32).reshape(10, 10, 5)
+        np4 = np.tile(np.frombuffer(l4.base, np.float32).reshape(1, 10, 1), (10, 1, 5))
+        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        np.testing.assert_allclose((np1 * np4) + np2, clang_res, rtol=1e-6)
+
+    def test_expanded_intermediate_is_not_fused(self):
+        l4 = LazyBuffer.rand((1, 10, 1), device="CLANG", seed=4)
+        l5 = LazyBuffer.rand((1, 10, 1), device="CLANG", seed=5)
+        prod = (l4 * l5).expand(10, 10, 5)
+        res = prod + self.l1
+        schedule = res.schedule()
+        self.assertEqual(len([si for si in schedule if si.op.op not in LoadOps]), 2)
+        linearize(schedule)()
+
+        np1 = np.frombuffer(self.l1.base, np.float32).reshape(10, 10, 5)
+        np4 = np.frombuffer(l4.base, np.float32).reshape(1, 10, 1)
+        np5 = np.frombuffer(l5.base, np.float32).reshape(1, 10, 1)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        np.testing.assert_allclose(np.tile(np4 * np5, (10, 1, 5)) + np1, clang_res, rtol=1e-6)
+
+    def test_reduce_prologue_is_fused(self):
+        res = (self.l1 * self.l2).reduce(ReduceOps.SUM, 1)
+        schedule = res.schedule()
+        self.assertEqual(len([si for si in schedule if si.op.op not in LoadOps]), 1)
+        linearize(schedule)()
+
+        np1 = np.frombuffer(self.l1.base, np.float32).reshape(10, 10, 5)
+        np2 = np.frombuffer(self.l2.base, np.float32).reshape(10, 10, 5)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        np.testing.assert_allclose((np1 * np2).sum(1), clang_res, rtol=1e-5)
+
+    def test_reduce_epilogue_is_fused(self):
+        l4 = LazyBuffer.rand((10, 5), device="CLANG", seed=4)
+        res = (self.l1 * self.l2).reduce(ReduceOps.MAX, 0).elementwise(BinaryOps.ADD, l4).elementwise(UnaryOps.SQRT)
+        schedule = res.schedule()
+        self.assertEqual(len([si for si in schedule if si.op.op not in LoadOps]), 1)
+        linearize(schedule)()
+
+        np1 = np.frombuffer(self.l1.base, np.float32).reshape(10, 10, 5)
+        np2 = np.frombuffer(self.l2.base, np.float32).reshape(10, 10, 5)
+        np4 = np.frombuffer(l4.base, np.float32).reshape(10, 5)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        np.testing.assert_allclose(np.sqrt((np1 * np2).max(0) + np4), clang_res, rtol=1e-6)
+
+    def test_reduce_of_reduce_is_not_nested(self):
+        res = (self.l1 * self.l2).reduce(ReduceOps.SUM, 2).elementwise(UnaryOps.NEG).reduce(ReduceOps.MAX, 0)
+        schedule = res.schedule()
+        self.assertEqual(len([si for si in schedule if si.op.op not in LoadOps]), 2)
+        linearize(schedule)()
+
+        np1 = np.frombuffer(self.l1.base, np.float32).reshape(10, 10, 5)
+        np2 = np.frombuffer(self.l2.base, np.float32).reshape(10, 10, 5)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        np.testing.assert_allclose((-(np1 * np2).sum(2)).max(0), clang_res, rtol=1e-5)
+
+    def test_max_of_negative_values(self):
+        res = self.l1.elementwise(UnaryOps.NEG).reduce(ReduceOps.MAX, 1)
+        linearize(res.schedule())()
+
+        np1 = np.frombuffer(self.l1.base, np.float32).reshape(10, 10, 5)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        np.testing.assert_allclose((-np1).max(1), clang_res)
+
+
+@mock.patch.dict(os.environ, {'THREADS': '2'})
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        self.l1 = LazyBuffer.rand((8, 64, 128), device="CLANG", seed=1)
+        self.l2 = LazyBuffer.rand((8, 64, 128), device="CLANG", seed=2)
+
+    def test_pragma_emitted(self):
+        self.assertEqual(omp_parallel((8, 64, 128))[0].value, 'omp parallel for num_threads(2)')
+        self.assertEqual(omp_parallel((1, 2, 32768))[0].value, 'omp parallel for collapse(3) num_threads(2)')
+        self.assertEqual(omp_parallel((10, 10)), [])
+        with mock.patch.dict(os.environ, {'THREADS': '1'}):
+            self.assertEqual(omp_parallel((8, 64, 128)), [])
+
+    def test_parallel_elementwise(self):
+        res = (self.l1 * self.l2).elementwise(UnaryOps.SQRT)
+        linearize(res.schedule())()
+
+        np1 = np.frombuffer(self.l1.base, np.float32).reshape(8, 64, 128)
+        np2 = np.frombuffer(self.l2.base, np.float32).reshape(8, 64, 128)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        np.testing.assert_allclose(np.sqrt(np1 * np2), clang_res, rtol=1e-6)
+
+    def test_parallel_reduce(self):
+        res = (self.l1 * self.l2).reduce(ReduceOps.SUM, 1)
+        linearize(res.schedule())()
+
+        np1 = np.frombuffer(self.l1.base, np.float32).reshape(8, 64, 128)
+        np2 = np.frombuffer(self.l2.base, np.float32).reshape(8, 64, 128)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(*res.shape)
+        np.testing.assert_allclose((np1 * np2).sum(1), clang_res, rtol=1e-5)
+
+    def test_parallel_matmul(self):
+        l1 = LazyBuffer.rand((130, 70), device="CLANG", seed=1)
+        l2 = LazyBuffer.rand((70, 90), device="CLANG", seed=2)
+        res = l1.matmul(l2)
+        linearize(res.schedule())()
+
+        np1 = np.frombuffer(l1.base, np.float32).reshape(130, 70)
+        np2 = np.frombuffer(l2.base, np.float32).reshape(70, 90)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(res.shape)
+        np.testing.assert_allclose(np1 @ np2, clang_res, rtol=1e-5)
+
+    def test_parallel_matmul_with_remainder_rows(self):
+        # a single row left over after the 4 row tiles, the pragma of its loop collapses i and j
+        with mock.patch.dict(os.environ, {'THREADS': '8'}):
+            l1 = LazyBuffer.rand((257, 300), device="CLANG", seed=1)
+            l2 = LazyBuffer.rand((300, 129), device="CLANG", seed=2)
+            res = l1.matmul(l2)
+            linearize(res.schedule())()
+        np.testing.assert_allclose(res.numpy(), l1.numpy() @ l2.numpy(), rtol=1e-4)
+
+
+class TestCompileFlags(unittest.TestCase):
+    @mock.patch.dict(os.environ, {'CPU_FLAGS': '-O3 -march=native -ffast-math'})
+    def test_device_flags(self):
+        self.assertEqual(Device.FLAGS('CPU'), ['-O3', '-march=native', '-ffast-math'])
+        self.assertEqual(Device.FLAGS('CLANG'), ['-O2'])
+
+        l1 = LazyBuffer.rand((64, 100), device="CPU", seed=1)
+        l2 = LazyBuffer.rand((64, 100), device="CPU", seed=2)
+        res = (l1 * l2).reduce(ReduceOps.SUM, 1)
+        linearize(res.schedule())()
+
+        np1 = np.frombuffer(l1.base, np.float32).reshape(64, 100)
+        np2 = np.frombuffer(l2.base, np.float32).reshape(64, 100)
+        clang_res = np.frombuffer(res.base, np.float32).reshape(res.shape)
+        np.testing.assert_allclose((np1 * np2).sum(1), clang_res, rtol=1e-5)
+
+    @mock.patch.dict(os.environ, {'CPU_COMPILER': 'memfd'})
+    def test_device_compiler(self):
+        self.assertEqual(Device.COMPILER('CPU'), 'memfd')
+        self.assertEqual(Device.COMPILER('CLANG'), 'clang')
+
+        l1 = LazyBuffer.rand((16, 16), device="CPU", seed=3)
+        res = (l1 * l1).reduce(ReduceOps.SUM, 0)
+        linearize(res.schedule())()
+
+        np1 = np.frombuffer(l1.base, np.float32).reshape(16, 16)
+        np.testing.assert_allclose((np1 * np1).sum(0), np.frombuffer(res.base, np.float32), rtol=1e-5)
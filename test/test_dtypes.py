@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from tensorbro import LazyBuffer, Tensor, dtypes
+from tensorbro.linearizer import linearize
+from tensorbro.ops import ReduceOps, UnaryOps
+from tensorbro.planner import plan_memory
+from tensorbro.storage import load, save
+
+
+def ints(shape, dtype, seed):
+    return np.random.default_rng(seed).integers(-5, 5, shape).astype(dtype)
+
+
+class TestDtypes(unittest.TestCase):
+    def test_from_format(self):
+        self.assertIs(dtypes.from_format('<f'), dtypes.float32)
+        self.assertIs(dtypes.from_format('e'), dtypes.float16)
+        self.assertIs(dtypes.from_name('int8'), dtypes.int8)
+        with self.assertRaises(ValueError):
+            dtypes.from_format('q')
+
+    def test_dtype_is_propagated(self):
+        x = LazyBuffer.rand((4, 4), device='CPU', dtype=dtypes.float64)
+        self.assertEqual((x * x).dtype, dtypes.float64)
+        self.assertEqual(x.reduce(ReduceOps.SUM, 0).dtype, dtypes.float64)
+        self.assertEqual(x.matmul(x).dtype, dtypes.float64)
+        self.assertEqual(x.permute(1, 0).dtype, dtypes.float64)
+        self.assertEqual(x.cast(dtypes.int32).dtype, dtypes.int32)
+        with self.assertRaises(AssertionError):
+            x * LazyBuffer.rand((4, 4), device='CPU')
+
+    def test_elementwise_and_reduce(self):
+        for np_dtype in [np.float16, np.float32, np.float64, np.int32, np.int8]:
+            with self.subTest(dtype=np_dtype):
+                a, b = ints((8, 16), np_dtype, 1), ints((8, 16), np_dtype, 2)
+                x, y = LazyBuffer.from_buffer(a, device='CPU'), LazyBuffer.from_buffer(b, device='CPU')
+                prod = x * y + x
+                res = prod.reduce(ReduceOps.SUM, 1)
+                mx = (x - y).reduce(ReduceOps.MAX, 0)
+                linearize(prod.schedule() + res.schedule() + mx.schedule())()
+                self.assertEqual(res.numpy().dtype, np_dtype)
+                np.testing.assert_equal(prod.numpy(), a * b + a)
+                np.testing.assert_equal(res.numpy(), (a * b + a).sum(1, dtype=np_dtype))
+                np.testing.assert_equal(mx.numpy(), (a - b).max(0))
+
+    def test_matmul(self):
+        for np_dtype, rtol in [(np.float16, 1e-3), (np.float64, 1e-12), (np.int32, 0), (np.int8, 0)]:
+            with self.subTest(dtype=np_dtype):
+                a, b = ints((9, 20), np_dtype, 3), ints((20, 17), np_dtype, 4)
+                x, y = LazyBuffer.from_buffer(a, device='CPU'), LazyBuffer.from_buffer(b, device='CPU')
+                res = x.matmul(y)
+                linearize(res.schedule())()
+                ref = (a.astype(np.int64) @ b.astype(np.int64)).astype(np_dtype)
+                np.testing.assert_allclose(res.numpy().astype(np.float64), ref.astype(np.float64), rtol=rtol)
+
+    def test_cast(self):
+        a = np.array([[1.7, 0.2], [2.5, 3.9]], np.float32)
+        x = LazyBuffer.from_buffer(a, device='CPU')
+        as_int = x.cast(dtypes.int32)
+        back = (as_int + as_int).cast(dtypes.float64).elementwise(UnaryOps.SQRT)
+        linearize(as_int.schedule() + back.schedule(), outputs={as_int, back})()
+        np.testing.assert_equal(as_int.numpy(), a.astype(np.int32))
+        np.testing.assert_allclose(back.numpy(), np.sqrt(2.0 * a.astype(np.int32)), rtol=1e-12)
+
+    def test_loads(self):
+        full = Tensor.full(3, (4, 4), dtype=dtypes.int8)
+        half = Tensor.rand((4, 4), dtype=dtypes.float16)
+        np.testing.assert_equal(full.numpy(), np.full((4, 4), 3, np.int8))
+        self.assertEqual(half.numpy().dtype, np.float16)
+        self.assertTrue(((half.numpy() >= 0) & (half.numpy() <= 1)).all())
+
+    def test_memory_plan_uses_itemsize(self):
+        x = LazyBuffer.rand((64, 64), device='CPU', dtype=dtypes.float16)
+        shared = x * x
+        res = shared + shared
+        plan = plan_memory(x.schedule() + res.schedule())
+        self.assertEqual(plan.naive_size, 64 * 64 * 2)
+
+    def test_batch_and_storage(self):
+        a = ints((16, 16), np.int8, 5)
+        x = LazyBuffer.from_buffer(a, device='CPU')
+        shared = x * x
+        res = (shared + shared).cast(dtypes.float16)
+        linearize(res.schedule(), batch=True)()
+        np.testing.assert_equal(res.numpy(), (2 * a * a).astype(np.float16))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'half.tb')
+            save(res, path)
+            loaded = load(path)
+            self.assertEqual(loaded.dtype, dtypes.float16)
+            np.testing.assert_equal(loaded.numpy(), res.numpy())
+
+
+if __name__ == "__main__":
+    unittest.main()
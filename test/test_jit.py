@@ -0,0 +1,77 @@
+import unittest
+import numpy as np
+
+from tensorbro import Jit, Tensor
+from tensorbro.runners.clang import KernelCache
+
+
+def to_numpy(t: Tensor, shape):
+    return np.frombuffer(t.data.base, np.float32).reshape(shape)
+
+
+class TestJit(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+
+        def step(x, w):
+            self.calls += 1
+            y = (x @ w) + x
+            return y * y
+
+        self.step = Jit(step)
+
+    def reference(self, x, w):
+        np_x, np_w = to_numpy(x, (32, 32)), to_numpy(w, (32, 32))
+        y = np_x @ np_w + np_x
+        return y * y
+
+    def test_replay_matches_eager(self):
+        for _ in range(3):
+            x, w = Tensor.rand((32, 32)), Tensor.rand((32, 32))
+            res = self.step(x, w)
+            np.testing.assert_allclose(self.reference(x, w), to_numpy(res, (32, 32)), rtol=1e-5)
+
+    def test_function_is_captured_once(self):
+        w = Tensor.rand((32, 32))
+        for _ in range(4):
+            self.step(Tensor.rand((32, 32)), w)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(self.step.captured), 1)
+
+    def test_replay_does_not_compile(self):
+        x, w = Tensor.rand((32, 32)), Tensor.rand((32, 32))
+        self.step(x, w)
+        x = Tensor.rand((32, 32))
+        x.materialize()
+        hits, misses = KernelCache.hits, KernelCache.misses
+        self.step(x, w)
+        self.assertEqual((KernelCache.hits, KernelCache.misses), (hits, misses))
+
+    def test_outputs_are_not_overwritten(self):
+        x1, x2, w = Tensor.rand((32, 32)), Tensor.rand((32, 32)), Tensor.rand((32, 32))
+        res1 = self.step(x1, w)
+        res2 = self.step(x2, w)
+        self.assertIsNot(res1.data.base, res2.data.base)
+        np.testing.assert_allclose(self.reference(x1, w), to_numpy(res1, (32, 32)), rtol=1e-5)
+
+    def test_new_shapes_are_captured_again(self):
+        self.step(Tensor.rand((32, 32)), Tensor.rand((32, 32)))
+        x, w = Tensor.rand((16, 16)), Tensor.rand((16, 16))
+        res = self.step(x, w)
+        self.assertEqual(self.calls, 2)
+        np_x, np_w = to_numpy(x, (16, 16)), to_numpy(w, (16, 16))
+        np.testing.assert_allclose((np_x @ np_w + np_x) ** 2, to_numpy(res, (16, 16)), rtol=1e-5)
+
+    def test_multiple_outputs(self):
+        jit = Jit(lambda x, w: (x * w, x + w))
+        x, w = Tensor.rand((8, 8)), Tensor.rand((8, 8))
+        jit(x, w)
+        x = Tensor.rand((8, 8))
+        mul, add = jit(x, w)
+        np_x, np_w = to_numpy(x, (8, 8)), to_numpy(w, (8, 8))
+        np.testing.assert_allclose(np_x * np_w, to_numpy(mul, (8, 8)), rtol=1e-6)
+        np.testing.assert_allclose(np_x + np_w, to_numpy(add, (8, 8)), rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
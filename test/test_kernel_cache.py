@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+import ctypes as c
+import ctypes.util
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from tensorbro.runners.clang import _KernelCache
+
+SRC = 'void add_one(float *out, float *inp1) { for (int i = 0; i < 4; i++) { out[i] = inp1[i] + 1; } }'
+
+
+class TestKernelCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = _KernelCache(self.tmp.name, max_size=1 << 30)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_source_is_compiled_once(self):
+        lib1 = self.cache.load(SRC, ['-O2'])
+        lib2 = self.cache.load(SRC, ['-O2'])
+        self.assertIs(lib1, lib2)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_compiled_kernel_runs(self):
+        prg = self.cache.load(SRC, ['-O2'])['add_one']
+        inp = (c.c_float * 4)(1, 2, 3, 4)
+        out = (c.c_float * 4)()
+        prg(out, inp)
+        self.assertEqual(list(out), [2, 3, 4, 5])
+
+    def test_key_depends_on_source_and_flags(self):
+        key = _KernelCache.key(SRC, ['-O2'])
+        self.assertNotEqual(key, _KernelCache.key(SRC, ['-O3']))
+        self.assertNotEqual(key, _KernelCache.key(SRC, ['-O2'], 'memfd'))
+        self.assertNotEqual(key, _KernelCache.key(SRC.replace('+ 1', '+ 2'), ['-O2']))
+
+    def test_disk_cache_is_reused_by_new_process(self):
+        self.cache.load(SRC, ['-O2'])
+        other = _KernelCache(self.tmp.name)
+        other.load(SRC, ['-O2'])
+        self.assertEqual(other.misses, 0)
+        self.assertEqual(other.hits, 1)
+
+    def test_concurrent_loads_compile_once(self):
+        with ThreadPoolExecutor(4) as pool:
+            libs = list(pool.map(lambda _: self.cache.load(SRC, ['-O2']), range(8)))
+        self.assertTrue(all(lib is libs[0] for lib in libs))
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_no_temporaries_left_behind(self):
+        self.cache.load(SRC, ['-O2'])
+        files = os.listdir(self.tmp.name)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].endswith('.so'))
+
+    def test_memfd_compiles_in_memory(self):
+        prg = self.cache.load(SRC, ['-O2'], 'memfd')['add_one']
+        prg.argtypes = (c.POINTER(c.c_float), c.POINTER(c.c_float))
+        inp = (c.c_float * 4)(1, 2, 3, 4)
+        out = (c.c_float * 4)()
+        prg(out, inp)
+        self.assertEqual(list(out), [2, 3, 4, 5])
+        self.assertEqual(os.listdir(self.tmp.name), [])
+        self.assertIs(self.cache.load(SRC, ['-O2'], 'memfd'), self.cache.load(SRC, ['-O2'], 'memfd'))
+
+    @unittest.skipUnless(ctypes.util.find_library('tcc') or os.environ.get('LIBTCC'), 'libtcc not installed')
+    def test_tcc_compiles_in_process(self):
+        prg = self.cache.load(SRC, [], 'tcc')['add_one']
+        prg.argtypes = (c.POINTER(c.c_float), c.POINTER(c.c_float))
+        inp = (c.c_float * 4)(1, 2, 3, 4)
+        out = (c.c_float * 4)()
+        prg(out, inp)
+        self.assertEqual(list(out), [2, 3, 4, 5])
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_unknown_compiler(self):
+        with self.assertRaises(ValueError):
+            self.cache.load(SRC, ['-O2'], 'gcc')
+
+    def test_lru_eviction(self):
+        self.cache.load(SRC, ['-O2'])
+        size = next(Path(self.tmp.name).glob('*.so')).stat().st_size
+        self.cache.max_size = size
+        self.cache.load(SRC.replace('+ 1', '+ 2'), ['-O2'])
+        newest = Path(self.tmp.name) / f"{_KernelCache.key(SRC.replace('+ 1', '+ 2'), ['-O2'])}.so"
+        self.assertEqual(list(Path(self.tmp.name).glob('*.so')), [newest])
+
+
+if __name__ == "__main__":
+    unittest.main()
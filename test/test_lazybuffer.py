@@ -1,7 +1,13 @@
 import unittest
+import numpy as np
 
-from tensorbro.lazy import LazyBuffer
-from tensorbro.ops import BinaryOps
+from unittest import mock
+
+from tensorbro import Tensor
+from tensorbro.lazy import LazyBuffer, LazyCache
+from tensorbro.linearizer import linearize
+from tensorbro.dtypes import dtypes
+from tensorbro.ops import BinaryOps, LoadOps, ReduceOps, UnaryOps
 
 class TestLazyBuffer(unittest.TestCase):
     def test_lazy_buffer_full(self):
@@ -13,8 +19,8 @@ class TestLazyBuffer(unittest.TestCase):
         self.assertTrue(True)
 
     def test_elem_op_same_shape_un_realized(self):
-        l1 = LazyBuffer.full(10, (10, 10), device='CPU')
-        l2 = LazyBuffer.full(10, (10, 10), device='CPU')
+        l1 = LazyBuffer.rand((10, 10), device='CPU', seed=1)
+        l2 = LazyBuffer.rand((10, 10), device='CPU', seed=2)
         mul = l1.elementwise(BinaryOps.MUL, l2)
         self.assertEqual(mul.op.op, BinaryOps.MUL)
         self.assertEqual(mul.shape, (10, 10))
@@ -22,5 +28,189 @@ class TestLazyBuffer(unittest.TestCase):
         self.assertFalse(mul.is_realized)
 
 
+class TestNumpyInterop(unittest.TestCase):
+    def test_from_buffer_does_not_copy(self):
+        arr = np.arange(12, dtype=np.float32).reshape(3, 4)
+        lb = LazyBuffer.from_buffer(arr, device='CPU')
+        self.assertTrue(lb.is_realized)
+        self.assertEqual(lb.shape, (3, 4))
+        self.assertEqual(lb.op.op, LoadOps.EXTERN)
+        arr[0, 0] = 42
+        self.assertEqual(lb.base[0], 42)
+        self.assertTrue(np.shares_memory(lb.numpy(), arr))
+
+    def test_from_buffer_in_kernels(self):
+        arr = np.random.rand(8, 8).astype(np.float32)
+        lb = LazyBuffer.from_buffer(arr, device='CPU')
+        res = (lb * lb).reduce(ReduceOps.SUM, 1)
+        linearize(res.schedule())()
+        np.testing.assert_allclose((arr * arr).sum(1), res.numpy(), rtol=1e-5)
+
+    def test_read_only_array(self):
+        arr = np.frombuffer(np.arange(4, dtype=np.float32).tobytes(), np.float32)
+        self.assertFalse(arr.flags.writeable)
+        t = Tensor.from_numpy(arr)
+        np.testing.assert_equal((t + t).numpy(), arr * 2)
+
+    def test_rejects_non_contiguous_and_other_dtypes(self):
+        with self.assertRaises(AssertionError):
+            LazyBuffer.from_buffer(np.zeros((4, 4), np.float32).T, device='CPU')
+        with self.assertRaises(ValueError):
+            LazyBuffer.from_buffer(np.zeros((4, 4), np.int64), device='CPU')
+
+    def test_numpy_view_of_expanded_buffer(self):
+        arr = np.arange(4, dtype=np.float32).reshape(4, 1)
+        lb = LazyBuffer.from_buffer(arr, device='CPU').expand(4, 3)
+        view = lb.numpy()
+        self.assertEqual(view.shape, (4, 3))
+        self.assertEqual(view.strides, (4, 0))
+        np.testing.assert_equal(view, np.broadcast_to(arr, (4, 3)))
+
+    def test_numpy_of_views(self):
+        arr = np.arange(6, dtype=np.float32).reshape(2, 3)
+        lb = LazyBuffer.from_buffer(arr, device='CPU')
+        transposed = lb.transpose(0, 1).numpy()
+        self.assertTrue(np.shares_memory(transposed, arr))
+        np.testing.assert_equal(transposed, arr.T)
+        # the transpose can't be reshaped in place, so this one is gathered
+        np.testing.assert_equal(lb.transpose(0, 1).reshape(6).numpy(), arr.T.reshape(6))
+
+    def test_tensor_numpy_materializes(self):
+        x = np.random.rand(4, 4).astype(np.float32)
+        w = np.random.rand(4, 4).astype(np.float32)
+        res = Tensor.from_numpy(x) @ Tensor.from_numpy(w)
+        np.testing.assert_allclose(x @ w, res.numpy(), rtol=1e-5)
+
+
+class TestAssign(unittest.TestCase):
+    def test_assign_writes_into_memory(self):
+        arr = np.arange(4, dtype=np.float32)
+        x = LazyBuffer.from_buffer(arr, device='CPU')
+        res = x.assign(x * x)
+        self.assertIs(res.assign_to, x)
+        linearize(res.schedule())()
+        self.assertIs(res.base, x.base)
+        np.testing.assert_equal(arr, np.arange(4) ** 2)
+
+    def test_reads_through_a_view_get_own_memory(self):
+        arr = np.arange(4, dtype=np.float32).reshape(2, 2)
+        x = LazyBuffer.from_buffer(arr, device='CPU')
+        res = x.assign(x + x.transpose(0, 1))
+        self.assertIsNone(res.assign_to)
+        linearize(res.schedule())()
+        np.testing.assert_equal(arr, np.arange(4).reshape(2, 2))
+        np.testing.assert_equal(res.numpy(), arr + arr.T)
+
+
+class TestSchedule(unittest.TestCase):
+    def test_shared_buffer_is_scheduled_once(self):
+        l1 = LazyBuffer.rand((10, 10), device="CPU", seed=1)
+        l2 = LazyBuffer.rand((10, 10), device="CPU", seed=2)
+        shared = l1 * l2
+        res = (shared + l1) * shared
+        schedule = res.schedule()
+        targets = [si.target for si in schedule]
+        self.assertEqual(len(targets), len(set(targets)))
+        self.assertIn(shared, targets)
+        self.assertEqual(len(schedule), 4)
+        self.assertIs(schedule[-1].target, res)
+
+    def test_single_use_buffer_is_fused(self):
+        l1 = LazyBuffer.rand((10, 10), device="CPU", seed=1)
+        l2 = LazyBuffer.rand((10, 10), device="CPU", seed=2)
+        inner = l1 * l2
+        res = inner + l1
+        targets = [si.target for si in res.schedule()]
+        self.assertNotIn(inner, targets)
+        self.assertEqual(len(targets), 3)
+
+    def test_realized_buffers_are_skipped(self):
+        l1 = LazyBuffer.rand((10, 10), device="CPU", seed=1)
+        l1.realize()
+        res = l1 * l1
+        schedule = res.schedule()
+        self.assertEqual(len(schedule), 1)
+        self.assertEqual(schedule[0].srcs, (l1,))
+
+    def test_seen_is_shared_between_calls(self):
+        l1 = LazyBuffer.rand((10, 10), device="CPU", seed=1)
+        seen = set()
+        first = l1.schedule(seen)
+        second = (l1 * l1).schedule(seen)
+        self.assertEqual([si.op.op for si in first], [LoadOps.RAND])
+        self.assertEqual([si.op.op for si in second], [BinaryOps.MUL])
+
+    def test_topological_order(self):
+        x = LazyBuffer.rand((10, 10), device="CPU", seed=1)
+        for _ in range(5):
+            x = (x * x) + x
+        done = set()
+        for si in x.schedule():
+            for src in si.srcs:
+                self.assertIn(src, done)
+            done.add(si.target)
+
+    def test_deep_diamond_graph(self):
+        x = LazyBuffer.rand((4, 4), device="CPU", seed=1)
+        for _ in range(2000):
+            x = x + x
+        self.assertEqual(len(x.schedule()), 2001)
+
+    def test_row_regions_only_near_row_reductions(self):
+        # scheduling stays linear, kernels that can't read a row broadcast never look for one
+        x = LazyBuffer.rand((4, 4), device="CPU", seed=1)
+        for _ in range(20):
+            x = (x * x) + x
+        with mock.patch.object(LazyBuffer, '_row_region', side_effect=AssertionError):
+            self.assertEqual(len(x.schedule()), 21)
+        # x - max(x) reads the max broadcast along the rows, the sum over the rows doesn't
+        res = (x - x.max(1, keepdim=True)).sum(0)
+        with mock.patch.object(LazyBuffer, '_row_region', wraps=lambda *args: set()) as row_region:
+            res.schedule()
+        self.assertEqual(row_region.call_count, 1)
+
+
+class TestCSE(unittest.TestCase):
+    def setUp(self):
+        self.l1 = LazyBuffer.rand((10, 10), device="CPU", seed=11)
+        self.l2 = LazyBuffer.rand((10, 10), device="CPU", seed=12)
+
+    def test_equal_computations_are_shared(self):
+        LazyCache.reset_stats()
+        res = (self.l1 * self.l2) + (self.l1 * self.l2).elementwise(UnaryOps.SIN)
+        self.assertEqual(LazyCache.hits, 1)
+        self.assertIs(res.op.srcs[0], res.op.srcs[1].op.srcs[0])
+        self.assertIs(self.l1.transpose(0, 1), self.l1.transpose(0, 1))
+        # the product has two consumers now, so it is computed once in a kernel of its own
+        schedule = res.schedule()
+        self.assertEqual([si.op.op for si in schedule], [LoadOps.RAND, LoadOps.RAND, BinaryOps.MUL, BinaryOps.ADD])
+        linearize(schedule)()
+        np1, np2 = self.l1.numpy(), self.l2.numpy()
+        np.testing.assert_allclose(np1 * np2 + np.sin(np1 * np2), res.numpy(), rtol=1e-6)
+
+    def test_different_computations_are_not_shared(self):
+        self.assertIsNot(self.l1 * self.l2, self.l2 * self.l1)
+        self.assertIsNot(self.l1 * self.l2, self.l1.cast(dtypes.float64) * self.l2.cast(dtypes.float64))
+        self.assertIsNot(self.l1.reduce(ReduceOps.SUM, 0), self.l1.reduce(ReduceOps.SUM, 1))
+
+    def test_realized_buffers_are_not_shared(self):
+        arr = np.ones((4,), np.float32)
+        x = LazyBuffer.from_buffer(arr, device="CPU")
+        first = x * x
+        linearize(first.schedule())()
+        arr[:] = 3
+        second = x * x
+        self.assertIsNot(first, second)
+        linearize(second.schedule())()
+        np.testing.assert_equal(second.numpy(), np.full(4, 9, np.float32))
+
+    def test_entries_die_with_their_buffer(self):
+        size = len(LazyCache)
+        res = self.l1 * self.l2
+        self.assertEqual(len(LazyCache), size + 1)
+        del res
+        self.assertEqual(len(LazyCache), size)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import numpy as np
+
+from tensorbro import LazyBuffer
+from tensorbro.linearizer import linearize
+from tensorbro.ops import ReduceOps, UnaryOps
+from tensorbro.planner import plan_memory
+
+
+class TestMemoryPlan(unittest.TestCase):
+    def setUp(self):
+        self.x = LazyBuffer.rand((64, 64), device="CPU", seed=1)
+        self.w = LazyBuffer.rand((64, 64), device="CPU", seed=2)
+        linearize(self.x.schedule() + self.w.schedule())()
+
+    def chain(self, n):
+        # every step is shared by two consumers, so each one is materialized
+        y = self.x
+        for _ in range(n):
+            y = (y * self.w) + y
+            y = y * y
+        return y
+
+    def test_intermediates_share_memory(self):
+        res = self.chain(6)
+        plan = plan_memory(res.schedule())
+        self.assertEqual(plan.naive_size, 11 * 64 * 64 * 4)
+        self.assertLessEqual(plan.size, 2 * 64 * 64 * 4)
+        self.assertNotIn(res, plan.offsets)
+
+    def test_live_buffers_dont_overlap(self):
+        res = self.chain(4)
+        schedule = res.schedule()
+        plan = plan_memory(schedule)
+        live = {}
+        for i, si in enumerate(schedule):
+            if si.target in plan.offsets and si.target not in plan.inplace:
+                start, end = plan.offsets[si.target], plan.offsets[si.target] + si.target.buffer_size * 4
+                for buf, (s, e) in live.items():
+                    if buf not in si.srcs or buf in plan.release[i]:
+                        continue
+                    self.assertTrue(end <= s or start >= e, f'{si.target} overlaps {buf}')
+                live[si.target] = (start, end)
+            for buf in plan.release[i]:
+                live.pop(buf, None)
+
+    def test_inplace_elementwise(self):
+        a = self.x.reduce(ReduceOps.SUM, 0)
+        b = (a * a).elementwise(UnaryOps.NEG)
+        c = b * b
+        schedule = c.schedule()
+        plan = plan_memory(schedule)
+        self.assertIn(b, plan.inplace)
+        self.assertEqual(plan.offsets[a], plan.offsets[b])
+
+    def test_planned_run_is_correct(self):
+        res = self.chain(5)
+        prg = linearize(res.schedule())
+        self.assertGreater(prg.plan.naive_size, prg.plan.size)
+        prg()
+
+        np_x = np.frombuffer(self.x.base, np.float32).reshape(64, 64).astype(np.float64)
+        np_w = np.frombuffer(self.w.base, np.float32).reshape(64, 64).astype(np.float64)
+        y = np_x
+        for _ in range(5):
+            y = (y * np_w) + y
+            y = y * y
+        clang_res = np.frombuffer(res.base, np.float32).reshape(64, 64)
+        np.testing.assert_allclose(y, clang_res, rtol=1e-4, atol=1e-30)
+
+    def test_inplace_run_is_correct(self):
+        a = self.x.reduce(ReduceOps.SUM, 0)
+        b = (a * a).elementwise(UnaryOps.NEG)
+        c = b * b
+        prg = linearize(c.schedule())
+        self.assertIn(b, prg.plan.inplace)
+        prg()
+        self.assertFalse(a.is_realized)
+        self.assertFalse(b.is_realized)
+
+        np_a = np.frombuffer(self.x.base, np.float32).reshape(64, 64).sum(0)
+        clang_res = np.frombuffer(c.base, np.float32)
+        np.testing.assert_allclose((np_a * np_a) ** 2, clang_res, rtol=1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import numpy as np
+
+from concurrent.futures import Future
+
+from tensorbro import LazyBuffer, Tensor
+from tensorbro.linearizer import linearize
+
+
+class TestBackgroundCompile(unittest.TestCase):
+    def test_linearize_returns_before_compiling(self):
+        x = LazyBuffer.rand((16, 16), device="CPU", seed=11)
+        res = (x * x) + x
+        prg = linearize(x.schedule() + res.schedule())
+        self.assertTrue(all(isinstance(p, Future) for p in prg._programs))
+        prg()
+        np_x = np.frombuffer(x.base, np.float32)
+        np.testing.assert_allclose(np_x * np_x + np_x, np.frombuffer(res.base, np.float32), rtol=1e-6)
+
+    def test_many_kernels_compile_concurrently(self):
+        x = LazyBuffer.rand((8, 8), device="CPU", seed=12)
+        outs = [x * LazyBuffer.full(float(i), (8, 8), 'CPU') for i in range(8)]
+        seen = set()
+        schedule = x.schedule(seen)
+        for out in outs:
+            schedule += out.schedule(seen)
+        linearize(schedule)()
+        np_x = np.frombuffer(x.base, np.float32)
+        for i, out in enumerate(outs):
+            np.testing.assert_allclose(np_x * i, np.frombuffer(out.base, np.float32), rtol=1e-6)
+
+    def test_compile_errors_surface_on_call(self):
+        prg = linearize(LazyBuffer.rand((4, 4), device="CPU", seed=None).schedule())
+        with self.assertRaises(AssertionError):
+            prg()
+
+
+class TestMaterializeAsync(unittest.TestCase):
+    def test_future_resolves_to_tensor(self):
+        x, w = Tensor.rand((16, 16)), Tensor.rand((16, 16))
+        x.materialize()
+        w.materialize()
+        res = (x @ w) + x
+        future = res.materialize_async()
+        self.assertIsInstance(future, Future)
+        self.assertIs(future.result(), res)
+        self.assertTrue(res.data.is_realized)
+
+        np_x = np.frombuffer(x.data.base, np.float32).reshape(16, 16)
+        np_w = np.frombuffer(w.data.base, np.float32).reshape(16, 16)
+        np.testing.assert_allclose(np_x @ np_w + np_x, np.frombuffer(res.data.base, np.float32).reshape(16, 16), rtol=1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,96 @@
+import itertools
 import unittest
 
+import numpy as np
+
 from tensorbro.lazy import ShapeTracker
+from tensorbro.shapetracker import View
+
+
+def evaluate(st: ShapeTracker) -> np.ndarray:
+    # runs the C index expressions in python, masked elements read -1
+    chars = [f'i{d}' for d in range(len(st.shape))]
+    idx, valid = st.expr(chars)
+    ret = np.empty(st.shape, dtype=np.int64)
+    for pos in itertools.product(*[range(sh) for sh in st.shape]):
+        env = dict(zip(chars, pos))
+        ok = valid is None or eval(valid.replace('&&', 'and'), env)
+        ret[pos] = eval(idx.replace('/', '//'), env) if ok else -1
+    return ret
+
 
 class TestShapeTracker(unittest.TestCase):
     def test_init_shape_tracker(self):
         st = ShapeTracker.from_shape((10, 10))
-        self.assertEqual(len(st._views), 1)
-        self.assertEqual(st.view, (10, 10))
-        self.assertEqual(st.view, st._views[-1])
-        self.assertEqual(st.stride, st._strides[-1])
+        self.assertEqual(len(st.views), 1)
+        self.assertEqual(st.shape, (10, 10))
+        self.assertEqual(st.views[0].strides, (10, 1))
+        self.assertTrue(st.contiguous)
+
+    def test_reshape_stays_one_view(self):
+        st = ShapeTracker.from_shape((4, 6)).reshape((2, 2, 3, 2))
+        self.assertEqual(len(st.views), 1)
+        self.assertEqual(st.views[0].strides, (12, 6, 2, 1))
+        self.assertTrue(st.contiguous)
+
+    def test_permute_and_expand_are_strides(self):
+        st = ShapeTracker.from_shape((3, 1)).expand((3, 5)).permute((1, 0))
+        self.assertEqual(len(st.views), 1)
+        self.assertEqual(st.shape, (5, 3))
+        self.assertEqual(st.views[0].strides, (0, 1))
+        self.assertFalse(st.contiguous)
+
+    def test_reshape_of_permuted_pushes_view(self):
+        st = ShapeTracker.from_shape((2, 3)).permute((1, 0)).reshape((6,))
+        self.assertEqual(len(st.views), 2)
+        np.testing.assert_equal(evaluate(st), np.arange(6).reshape(2, 3).T.reshape(6))
+
+    def test_merge_into_contiguous(self):
+        # a permute undone by another permute merges back into a single contiguous view
+        st = ShapeTracker.from_shape((2, 3, 4)).permute((2, 0, 1)).permute((1, 2, 0))
+        self.assertEqual(st, ShapeTracker.from_shape((2, 3, 4)))
+
+    def test_shrink_is_offset(self):
+        st = ShapeTracker.from_shape((4, 5)).shrink(((1, 3), (2, 5)))
+        self.assertEqual(st.views[0], View.create((2, 3), (5, 1), offset=7))
+        np.testing.assert_equal(evaluate(st), np.arange(20).reshape(4, 5)[1:3, 2:5])
+
+    def test_pad_is_mask(self):
+        st = ShapeTracker.from_shape((2, 3)).pad(((1, 0), (0, 2)))
+        self.assertEqual(st.shape, (3, 5))
+        self.assertEqual(st.views[0].mask, ((1, 3), (0, 3)))
+        np.testing.assert_equal(evaluate(st), np.pad(np.arange(6).reshape(2, 3), ((1, 0), (0, 2)), constant_values=-1))
+
+    def test_shrink_undoes_pad(self):
+        st = ShapeTracker.from_shape((2, 3)).pad(((1, 1), (2, 2))).shrink(((1, 3), (2, 5)))
+        self.assertTrue(st.contiguous)
+
+    def test_expand_of_shrink_into_padding(self):
+        st = ShapeTracker.from_shape((2, 3)).pad(((1, 0), (0, 0))).shrink(((0, 1), (0, 3)))
+        self.assertEqual(st.views[0].mask, ((0, 0), (0, 3)))
+        np.testing.assert_equal(evaluate(st.expand((4, 3))), np.full((4, 3), -1))
+
+    def test_expr_matches_numpy(self):
+        ref = np.arange(24).reshape(2, 3, 4)
+        st = ShapeTracker.from_shape((2, 3, 4)).permute((2, 0, 1)).reshape((4, 6)).shrink(((1, 4), (0, 6))).reshape((3, 2, 3))
+        np.testing.assert_equal(evaluate(st), ref.transpose(2, 0, 1).reshape(4, 6)[1:4].reshape(3, 2, 3))
+
+    def test_unfold_is_strides(self):
+        st = ShapeTracker.from_shape((3, 7)).unfold((1, 3, 2))
+        self.assertEqual(len(st.views), 1)
+        self.assertEqual(st.views[0], View.create((3, 3, 3), (7, 2, 1)))
+        ref = np.arange(21).reshape(3, 7)
+        np.testing.assert_equal(evaluate(st), np.lib.stride_tricks.sliding_window_view(ref, 3, axis=1)[:, ::2])
+
+    def test_unfold_of_padded(self):
+        st = ShapeTracker.from_shape((2, 4)).pad(((0, 0), (1, 1))).unfold((1, 3, 1))
+        self.assertEqual(len(st.views), 2)
+        ref = np.pad(np.arange(8).reshape(2, 4), ((0, 0), (1, 1)), constant_values=-1)
+        np.testing.assert_equal(evaluate(st), np.lib.stride_tricks.sliding_window_view(ref, 3, axis=1))
+        # the windows index the padded dims directly, no divisions
+        self.assertNotIn('/', ''.join(x for x in st.expr(['i0', 'i1', 'i2']) if x is not None))
+        # padding along other dims stays a mask of the same view
+        self.assertEqual(len(ShapeTracker.from_shape((2, 4)).pad(((1, 0), (0, 0))).unfold((1, 2, 2)).views), 1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+import unittest
+import numpy as np
+
+from tensorbro.dtypes import dtypes
+from tensorbro.lazy import LazyBuffer
+from tensorbro.linearizer import linearize
+from tensorbro.ops import BinaryOps, LoadOps, ReduceOps, UnaryOps
+from tensorbro.simplify import const_value
+
+
+class TestConstantFolding(unittest.TestCase):
+    def test_constant_subgraph(self):
+        res = (LazyBuffer.full(2, (4, 4)) * LazyBuffer.full(3, (4, 4))).elementwise(UnaryOps.SQRT)
+        self.assertEqual(res.op.op, LoadOps.CONST)
+        self.assertAlmostEqual(const_value(res), 6 ** 0.5)
+
+    def test_reduce_and_cast_of_constant(self):
+        res = LazyBuffer.full(2, (3, 4)).reduce(ReduceOps.SUM, 1).cast(dtypes.int32)
+        self.assertEqual((res.op.op, res.shape, res.dtype), (LoadOps.CONST, (3,), dtypes.int32))
+        self.assertEqual(const_value(res), 8)
+
+    def test_reduce_over_several_dims(self):
+        res = LazyBuffer.full(2, (3, 4, 5)).reduce(ReduceOps.SUM, (0, 2), keepdim=True)
+        self.assertEqual(res.shape, (1, 4, 1))
+        self.assertEqual(const_value(res), 30)
+        self.assertEqual(const_value(LazyBuffer.full(-3, (3, 4, 5)).reduce(ReduceOps.MAX, (0, 1, 2))), -3)
+
+    def test_integers_wrap(self):
+        res = LazyBuffer.full(100, (4,), dtype=dtypes.int8) + LazyBuffer.full(100, (4,), dtype=dtypes.int8)
+        self.assertEqual(const_value(res), -56)
+
+    def test_inf_is_left_to_the_kernel(self):
+        res = LazyBuffer.full(1, (4,)).elementwise(BinaryOps.DIV, LazyBuffer.full(0, (4,)))
+        self.assertEqual(res.op.op, BinaryOps.DIV)
+        linearize(res.schedule())()
+        np.testing.assert_equal(res.numpy(), np.full(4, np.inf, np.float32))
+
+    def test_padded_constant_is_not_constant(self):
+        self.assertIsNone(const_value(LazyBuffer.full(1, (4,)).pad((1, 1))))
+
+
+class TestIdentities(unittest.TestCase):
+    def setUp(self):
+        self.x = LazyBuffer.rand((4, 4), device='CPU', seed=1)
+
+    def test_identity_ops(self):
+        self.assertIs(self.x * LazyBuffer.full(1, (4, 4)), self.x)
+        self.assertIs(LazyBuffer.full(0, (4, 4)) + self.x, self.x)
+        self.assertIs(self.x - LazyBuffer.full(0, (4, 4)), self.x)
+        self.assertIs(self.x.elementwise(BinaryOps.DIV, LazyBuffer.full(1, (4, 4))), self.x)
+        self.assertIs(self.x.elementwise(BinaryOps.MAX, self.x), self.x)
+
+    def test_broadcast_identity_is_a_view(self):
+        res = self.x + LazyBuffer.full(0, (4,))
+        self.assertIs(res.root, self.x)
+        self.assertEqual(res.shape, (4, 4))
+
+    def test_x_minus_x(self):
+        res = self.x - self.x
+        self.assertEqual((res.op.op, const_value(res)), (LoadOps.CONST, 0))
+
+    def test_inverse_unary_ops(self):
+        self.assertIs(self.x.elementwise(UnaryOps.NEG).elementwise(UnaryOps.NEG), self.x)
+        self.assertIs(self.x.elementwise(UnaryOps.LOG2).elementwise(UnaryOps.EXP2), self.x)
+        self.assertIs(self.x.elementwise(UnaryOps.EXP2).elementwise(UnaryOps.LOG2), self.x)
+        # log2 truncates integers, so exp2 doesn't undo it
+        i = self.x.cast(dtypes.int32)
+        self.assertEqual(i.elementwise(UnaryOps.LOG2).elementwise(UnaryOps.EXP2).op.op, UnaryOps.EXP2)
+
+
+class TestInlineConstants(unittest.TestCase):
+    def test_constants_are_literals(self):
+        x = LazyBuffer.rand((8, 8), device='CPU', seed=1)
+        res = (x * LazyBuffer.full(2.5, (8,))).elementwise(BinaryOps.MAX, LazyBuffer.full(1, (8, 8)))
+        schedule = res.schedule()
+        self.assertEqual([si.op.op for si in schedule], [LoadOps.RAND, BinaryOps.MAX])
+        self.assertEqual(schedule[-1].srcs, (x,))
+        linearize(schedule)()
+        np.testing.assert_allclose(np.maximum(x.numpy() * 2.5, 1), res.numpy(), rtol=1e-6)
+
+    def test_reduce_of_constant_expression(self):
+        x = LazyBuffer.rand((8, 8), device='CPU', seed=1)
+        res = (x + LazyBuffer.full(-1, (8, 8))).reduce(ReduceOps.MAX, 0)
+        linearize(res.schedule())()
+        np.testing.assert_allclose((x.numpy() - 1).max(0), res.numpy(), rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import mmap
+import tempfile
+import unittest
+import numpy as np
+
+from tensorbro import LazyBuffer, Tensor
+from tensorbro.ops import LoadOps
+from tensorbro.storage import ALIGNMENT, MAGIC, load, save
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'weights.tb')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip(self):
+        arr = np.random.rand(5, 7).astype(np.float32)
+        save(LazyBuffer.from_buffer(arr, device='CPU'), self.path)
+        lb = load(self.path)
+        self.assertTrue(lb.is_realized)
+        self.assertEqual(lb.op.op, LoadOps.EXTERN)
+        self.assertEqual(lb.shape, (5, 7))
+        np.testing.assert_equal(lb.numpy(), arr)
+
+    def test_file_layout(self):
+        arr = np.arange(6, dtype=np.float32)
+        save(LazyBuffer.from_buffer(arr, device='CPU'), self.path)
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        self.assertTrue(raw.startswith(MAGIC))
+        self.assertEqual(len(raw) % ALIGNMENT, 6 * 4)
+        self.assertEqual(raw[-6 * 4:], arr.astype('<f4').tobytes())
+        self.assertEqual(os.listdir(self.tmp.name), ['weights.tb'])
+
+    def test_load_maps_the_file(self):
+        arr = np.random.rand(64, 64).astype(np.float32)
+        save(LazyBuffer.from_buffer(arr, device='CPU'), self.path)
+        lb = load(self.path)
+        self.assertTrue(any(isinstance(o.obj, mmap.mmap) for o in lb.base._objects.values()))
+
+    def test_loaded_buffer_in_kernels(self):
+        arr = np.random.rand(16, 16).astype(np.float32)
+        save(LazyBuffer.from_buffer(arr, device='CPU'), self.path)
+        w = Tensor.load(self.path)
+        res = w @ w
+        np.testing.assert_allclose(arr @ arr, res.numpy(), rtol=1e-5)
+        # kernels only read their inputs, the file is unchanged
+        np.testing.assert_equal(load(self.path).numpy(), arr)
+
+    def test_save_expanded_and_lazy(self):
+        arr = np.arange(4, dtype=np.float32).reshape(4, 1)
+        lb = LazyBuffer.from_buffer(arr, device='CPU').expand(4, 3)
+        save(lb, self.path)
+        np.testing.assert_equal(load(self.path).numpy(), np.broadcast_to(arr, (4, 3)))
+
+        t = Tensor.rand((3, 3))
+        t.save(self.path)
+        np.testing.assert_equal(Tensor.load(self.path).numpy(), t.numpy())
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a tensor')
+        with self.assertRaises(ValueError):
+            load(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
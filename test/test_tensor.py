@@ -0,0 +1,141 @@
+import unittest
+import numpy as np
+
+from tensorbro import Tensor
+from tensorbro.code_gen.clang import CProgram
+from tensorbro.ops import BinaryOps, LoadOps, ReduceOps
+
+
+class TestGetItem(unittest.TestCase):
+    def setUp(self):
+        self.arr = np.arange(60, dtype=np.float32).reshape(3, 4, 5)
+        self.t = Tensor.from_numpy(self.arr)
+
+    def test_basic_indexing(self):
+        for idx in [1, (1, 2), (slice(None), 2), (..., 1), (None, 0, ..., slice(1, 4)), (-1, slice(None), -2),
+                    (slice(5, 9),), (slice(None), slice(3, 1))]:
+            with self.subTest(idx=idx):
+                res = self.t[idx]
+                self.assertEqual(res.shape, self.arr[idx].shape)
+                np.testing.assert_equal(res.numpy(), self.arr[idx])
+
+    def test_steps(self):
+        for idx in [(slice(None, None, 2),), (slice(1, None, 3), None, slice(0, 5, 2)), (..., slice(None, None, 4))]:
+            with self.subTest(idx=idx):
+                np.testing.assert_equal((self.t[idx] + self.t[idx]).numpy(), self.arr[idx] * 2)
+
+    def test_slice_is_a_view(self):
+        res = self.t[1:, ::2, 3]
+        self.assertIs(res.data.base, self.t.data.base)
+        self.assertEqual([si.op.op for si in res.data.schedule()], [])
+        np.testing.assert_equal(res.numpy(), self.arr[1:, ::2, 3])
+
+    def test_slice_feeds_kernel(self):
+        res = self.t[:, 1:3] * self.t[:, 2:4]
+        schedule = res.data.schedule()
+        self.assertEqual(len([si for si in schedule if si.op.op not in LoadOps]), 1)
+        np.testing.assert_equal(res.numpy(), self.arr[:, 1:3] * self.arr[:, 2:4])
+
+    def test_pad(self):
+        res = self.t.pad((1, 0), (0, 2), (1, 1))
+        np.testing.assert_equal(res.numpy(), np.pad(self.arr, ((1, 0), (0, 2), (1, 1))))
+        np.testing.assert_equal((res + res).numpy(), np.pad(self.arr * 2, ((1, 0), (0, 2), (1, 1))))
+
+    def test_broadcast_slice_of_padding(self):
+        # a slice that only covers padding reads zeros, also when it is broadcast
+        arr = np.arange(1, 7, dtype=np.float32).reshape(2, 3)
+        res = Tensor.from_numpy(arr).pad((1, 0), (0, 0))[0:1] + Tensor.ones((4, 3))
+        np.testing.assert_equal(res.numpy(), np.ones((4, 3), np.float32))
+        view = Tensor.from_numpy(arr).data.pad((1, 0), (0, 0)).shrink((0, 1), (0, 3)).expand(4, 3)
+        np.testing.assert_equal(view.numpy(), np.zeros((4, 3), np.float32))
+
+    def test_invalid_indices(self):
+        with self.assertRaises(IndexError):
+            self.t[3]
+        with self.assertRaises(IndexError):
+            self.t[0, 0, 0, 0]
+        with self.assertRaises(NotImplementedError):
+            self.t[::-1]
+        with self.assertRaises(TypeError):
+            self.t[0.5]
+
+
+
+def np_softmax(arr: np.ndarray, dim: int = -1) -> np.ndarray:
+    e = np.exp(arr - arr.max(dim, keepdims=True))
+    return e / e.sum(dim, keepdims=True)
+
+
+class TestRowKernels(unittest.TestCase):
+    def setUp(self):
+        self.arr = (np.random.default_rng(0).standard_normal((6, 5, 70)) * 10).astype(np.float32)
+        self.t = Tensor.from_numpy(self.arr)
+
+    def check(self, res, expected):
+        self.assertEqual(len(res.data.schedule()), 1)
+        np.testing.assert_allclose(res.numpy(), expected, rtol=1e-4, atol=1e-5)
+
+    def test_softmax(self):
+        self.check(self.t.softmax(), np_softmax(self.arr))
+        # max and sum run in a single loop
+        src = str(CProgram(self.t.softmax().data.schedule()[0], compile=False).render())
+        self.assertEqual(src.count('for (int r'), 1)
+
+    def test_log_softmax(self):
+        self.check(self.t.log_softmax(), np.log(np_softmax(self.arr)))
+
+    def test_layernorm(self):
+        w, b = np.random.rand(70).astype(np.float32), np.random.rand(70).astype(np.float32)
+        mean, var = self.arr.mean(-1, keepdims=True), self.arr.var(-1, keepdims=True)
+        self.check(self.t.layernorm(Tensor.from_numpy(w), Tensor.from_numpy(b)), (self.arr - mean) / np.sqrt(var + 1e-5) * w + b)
+
+    def test_other_dims(self):
+        np.testing.assert_allclose(self.t.softmax(1).numpy(), np_softmax(self.arr, 1), rtol=1e-5, atol=1e-6)
+
+    def test_row_value_as_output(self):
+        mean = self.t.mean(-1, keepdim=True)
+        res = self.t - mean
+        self.assertEqual(len(res.data.schedule()), 1)
+        res.materialize(mean)
+        np.testing.assert_allclose(res.numpy(), self.arr - self.arr.mean(-1, keepdims=True), rtol=1e-4, atol=1e-4)
+        np.testing.assert_allclose(mean.numpy(), self.arr.mean(-1, keepdims=True), rtol=1e-5, atol=1e-4)
+
+
+def np_conv2d(x: np.ndarray, w: np.ndarray, stride: int = 1, padding: int = 0) -> np.ndarray:
+    xp = np.pad(x, ((0, 0), (0, 0), (padding, padding), (padding, padding)))
+    windows = np.lib.stride_tricks.sliding_window_view(xp, w.shape[2:], axis=(2, 3))[:, :, ::stride, ::stride]
+    return np.einsum('nchwij,ocij->nohw', windows, w)
+
+
+class TestConv2d(unittest.TestCase):
+    def conv(self, x_shape, w_shape, stride=1, padding=0):
+        x = np.random.randn(*x_shape).astype(np.float32)
+        w = np.random.randn(*w_shape).astype(np.float32)
+        b = np.random.randn(w_shape[0]).astype(np.float32)
+        res = Tensor.from_numpy(x).conv2d(Tensor.from_numpy(w), Tensor.from_numpy(b), stride=stride, padding=padding)
+        expected = np_conv2d(x, w, stride, padding) + b.reshape(1, -1, 1, 1)
+        np.testing.assert_allclose(res.numpy(), expected, rtol=1e-4, atol=1e-4)
+
+    def test_direct(self):
+        self.conv((2, 1, 9, 10), (3, 1, 3, 3), padding=1)
+        self.conv((3, 2, 7, 7), (1, 2, 5, 5), stride=2, padding=2)
+
+    def test_matmul(self):
+        self.conv((2, 3, 9, 10), (4, 3, 3, 3), padding=1)
+        self.conv((2, 8, 12, 13), (16, 8, 3, 3), stride=2, padding=1)
+        self.conv((1, 16, 10, 10), (5, 16, 1, 1))
+
+    def test_windows_are_not_copied(self):
+        x = Tensor.from_numpy(np.random.randn(1, 4, 8, 8).astype(np.float32))
+        small = x.conv2d(Tensor.from_numpy(np.random.randn(1, 4, 3, 3).astype(np.float32)), padding=1)
+        self.assertEqual([si.op.op for si in small.data.schedule()], [ReduceOps.SUM])
+        big = x.conv2d(Tensor.from_numpy(np.random.randn(8, 4, 3, 3).astype(np.float32)), padding=1)
+        self.assertEqual([si.op.op for si in big.data.schedule()], [BinaryOps.MATMUL])
+
+    def test_unfold(self):
+        arr = np.arange(24, dtype=np.float32).reshape(2, 12)
+        res = Tensor.from_numpy(arr).unfold(1, 4, 3)
+        np.testing.assert_equal(res.numpy(), np.lib.stride_tricks.sliding_window_view(arr, 4, axis=1)[:, ::3])
+
+if __name__ == "__main__":
+    unittest.main()